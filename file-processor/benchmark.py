@@ -0,0 +1,742 @@
+#!/usr/bin/env python3
+"""
+BriskLearning File Processor benchmarks
+Micro-benchmarks of each processing stage and a concurrent HTTP load harness,
+run offline against local stand-ins (see benchmark-compose.yml)
+"""
+import os
+import argparse
+import importlib.util
+import json
+import logging
+import math
+import platform
+import random
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+# requests is imported by the load harness only, so the fake clamd runs on a bare Python image
+if TYPE_CHECKING:
+    import requests
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark")
+
+# Well-known development account of the Azurite storage emulator
+AZURITE_CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+)
+
+# Local stand-ins, used for every variable the environment does not already set
+STAND_IN_ENVIRONMENT = {
+    'PGHOST': 'localhost',
+    'PGPORT': '5432',
+    'PGUSER': 'postgres',
+    'PGPASSWORD': 'postgres',
+    'PGDATABASE': 'processed',
+    'AZURE_STORAGE_CONNECTION_STRING': AZURITE_CONNECTION_STRING,
+    'CLAMAV_HOST': '127.0.0.1',
+    'CLAMAV_PORT': '3310',
+    'EMBEDDING_BACKEND': 'stub',
+    'ENVIRONMENT': 'benchmark',
+    # Caches would turn repeated measurements into cache hits
+    'EXTRACT_CACHE_DIR': '',
+    'CLAMAV_CLEAN_CACHE_TTL': '0'
+}
+
+# Files containing this marker are reported as infected by the fake clamd
+INFECTED_MARKER = b"BRISK-BENCHMARK-INFECTED-TEST-FILE"
+
+WORDS = (
+    "course syllabus lecture assignment grading policy student instructor semester module "
+    "quiz exam deadline enrolment tuition invoice payment receipt contract agreement terms "
+    "renewal learning portal onboarding checklist report quarterly summary analysis budget "
+    "forecast revenue machine gradient descent network training dataset evaluation accuracy "
+    "chemistry biology physics algebra calculus history literature essay thesis research "
+    "library schedule attendance certificate transcript campus workshop webinar feedback"
+).split()
+
+DEFAULT_SIZES = "1024,65536,1048576,8388608"
+DEFAULT_KINDS = "text,json,pdf,image,binary,infected"
+
+def load_processor_module():
+    """Import the processor module with stand-in defaults applied to its configuration
+
+    The module reads its configuration and connects to its services at
+    import time, so the environment must be complete before this is called.
+    """
+    for key, value in STAND_IN_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Deployed as file_processor.py; named file-processor.py in the repository
+    for filename in ("file_processor.py", "file-processor.py"):
+        path = os.path.join(here, filename)
+        if os.path.exists(path):
+            spec = importlib.util.spec_from_file_location("file_processor", path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules["file_processor"] = module
+            spec.loader.exec_module(module)
+            return module
+    raise FileNotFoundError(f"No file processor module found in {here}")
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    """Speaks the subset of the clamd protocol used by ClamdClient: IDSESSION, INSTREAM, PING, END"""
+
+    def _read_exact(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            data = self.request.recv(65536)
+            if not data:
+                raise ConnectionError("client closed the connection")
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _read_command(self) -> bytes:
+        while b"\0" not in self._buffer:
+            data = self.request.recv(4096)
+            if not data:
+                raise ConnectionError("client closed the connection")
+            self._buffer += data
+        command, _, self._buffer = self._buffer.partition(b"\0")
+        # Commands are sent as zCOMMAND; the z selects NUL-terminated replies
+        return command[1:] if command.startswith(b"z") else command
+
+    def _instream(self) -> str:
+        scanned = 0
+        found = False
+        tail = b""
+        while True:
+            size = struct.unpack("!I", self._read_exact(4))[0]
+            if size == 0:
+                break
+            chunk = self._read_exact(size)
+            scanned += size
+            window = tail + chunk
+            found = found or INFECTED_MARKER in window
+            tail = window[-len(INFECTED_MARKER):]
+        self.server.simulate_scan(scanned)
+        if self.server.stream_max and scanned > self.server.stream_max:
+            return "INSTREAM size limit exceeded. ERROR"
+        if found:
+            return "stream: Benchmark-Test-Signature FOUND"
+        return "stream: OK"
+
+    def handle(self):
+        self._buffer = b""
+        session = False
+        number = 0
+        try:
+            while True:
+                command = self._read_command()
+                if command == b"IDSESSION":
+                    session = True
+                    continue
+                if command == b"END":
+                    return
+                number += 1
+                if command == b"PING":
+                    reply = "PONG"
+                elif command == b"INSTREAM":
+                    reply = self._instream()
+                else:
+                    reply = f"{command.decode('ascii', errors='replace')}: Unknown command ERROR"
+                if session:
+                    reply = f"{number}: {reply}"
+                self.request.sendall(reply.encode() + b"\0")
+                if not session:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+class FakeClamd(socketserver.ThreadingTCPServer):
+    """Local clamd stand-in with a configurable per-scan latency, scan throughput and StreamMaxLength"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 3310, latency: float = 0.002,
+                 bytes_per_second: float = 200 * 1024 * 1024, stream_max: int = 0):
+        super().__init__((host, port), FakeClamdHandler)
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        # Like clamd's StreamMaxLength; 0 accepts streams of any size
+        self.stream_max = stream_max
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def simulate_scan(self, size: int):
+        delay = self.latency + (size / self.bytes_per_second if self.bytes_per_second else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self) -> "FakeClamd":
+        threading.Thread(target=self.serve_forever, name="fake-clamd", daemon=True).start()
+        return self
+
+def random_text(rng: random.Random, size: int) -> str:
+    """Sentences of vocabulary words totalling about size characters"""
+    parts = []
+    total = 0
+    while total < size:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + ". "
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)[:size]
+
+def pdf_bytes(text: str, lines_per_page: int = 50, line_length: int = 90) -> bytes:
+    """A minimal valid PDF showing text in Helvetica, one page per lines_per_page lines"""
+    lines = [text[i:i + line_length] for i in range(0, len(text), line_length)] or [""]
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    kids = []
+    for index, page_lines in enumerate(pages):
+        page_id = 4 + index * 2
+        content_id = page_id + 1
+        kids.append(f"{page_id} 0 R")
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({escape(line)}) '" for line in page_lines) + " ET"
+        stream = stream.encode('latin-1', errors='replace')
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += f"{number} 0 obj\n".encode() + objects[number] + b"\nendobj\n"
+    xref = len(out)
+    count = max(objects) + 1
+    out += f"xref\n0 {count}\n0000000000 65535 f \n".encode()
+    for number in range(1, count):
+        out += f"{offsets[number]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+def png_bytes(rng: random.Random, size: int) -> bytes:
+    """A PNG scan of a text page, with dimensions growing with size"""
+    from PIL import Image, ImageDraw
+    import io
+
+    width = max(200, min(4000, int((size * 2) ** 0.5)))
+    height = max(100, width * 4 // 3)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for y in range(10, height - 20, 16):
+        draw.text((10, y), random_text(rng, max(10, width // 7)), fill=0)
+    # Sensor noise keeps large scans from compressing to almost nothing
+    noise = Image.effect_noise((width, height), 24)
+    image = Image.blend(image, noise, 0.08)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def generate_corpus(directory: str, sizes: list, kinds: list, files_per_size: int = 2, seed: int = 0) -> list:
+    """Write files of every kind and size to directory and return their descriptions
+
+    Kinds are text, json, pdf, image (PNG), binary (random bytes) and
+    infected (text carrying the fake clamd signature). Sizes are targets;
+    PDFs and images end up near, not exactly at, them.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    extensions = {'text': 'txt', 'json': 'json', 'pdf': 'pdf', 'image': 'png', 'binary': 'bin', 'infected': 'txt'}
+    corpus = []
+    for kind in kinds:
+        for size in sizes:
+            if kind == 'infected' and size > 1024 * 1024:
+                continue
+            for copy in range(files_per_size):
+                if kind == 'text':
+                    data = random_text(rng, size).encode()
+                elif kind == 'json':
+                    text = random_text(rng, max(0, size - 64))
+                    data = json.dumps({'id': str(uuid.UUID(int=rng.getrandbits(128))), 'body': text}).encode()
+                elif kind == 'pdf':
+                    # Text objects add roughly a fifth to the content size
+                    data = pdf_bytes(random_text(rng, int(size * 0.8)))
+                elif kind == 'image':
+                    data = png_bytes(rng, size)
+                elif kind == 'binary':
+                    data = rng.randbytes(size)
+                elif kind == 'infected':
+                    data = random_text(rng, size).encode() + INFECTED_MARKER
+                else:
+                    raise ValueError(f"Unknown corpus kind: {kind}")
+                path = os.path.join(directory, f"{kind}_{size}_{copy}.{extensions[kind]}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                corpus.append({'path': path, 'kind': kind, 'target_size': size, 'size': len(data)})
+    with open(os.path.join(directory, "corpus.json"), "w") as f:
+        json.dump({'seed': seed, 'files': corpus}, f, indent=2)
+    logger.info(f"Generated {len(corpus)} corpus files in {directory}")
+    return corpus
+
+def load_corpus(directory: str, sizes: list, kinds: list, files_per_size: int, seed: int) -> list:
+    """Reuse the corpus in directory if it was generated with the same seed, otherwise generate it"""
+    manifest = os.path.join(directory, "corpus.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            saved = json.load(f)
+        files = [entry for entry in saved['files'] if entry['kind'] in kinds and entry['target_size'] in sizes]
+        if saved.get('seed') == seed and files and all(os.path.exists(entry['path']) for entry in files):
+            return files
+    return generate_corpus(directory, sizes, kinds, files_per_size, seed)
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(samples: list) -> dict:
+    """Count, mean, p50/p95/p99 and max of a list of seconds"""
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'max': max(samples)
+    }
+
+def run_metadata(kind: str, args: argparse.Namespace) -> dict:
+    """Where and how a run happened, so results files can be compared"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    options = {key: value for key, value in vars(args).items() if key != 'command'}
+    return {
+        'benchmark': kind,
+        'started_at': datetime.now().isoformat(),
+        'git_commit': commit,
+        'host': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'options': options,
+        'environment': {key: os.environ.get(key) for key in sorted(STAND_IN_ENVIRONMENT)
+                        if key not in ('PGPASSWORD', 'AZURE_STORAGE_CONNECTION_STRING')}
+    }
+
+def write_results(results: dict, output: Optional[str]) -> str:
+    if not output:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join("benchmark-results", f"{results['benchmark']}-{stamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {output}")
+    return output
+
+def run_micro(args: argparse.Namespace) -> dict:
+    """Time each BriskLearningProcessor stage on every corpus file
+
+    Stored rows and uploaded blobs are removed between repetitions (outside
+    the timed sections) so every repetition does the full work.
+    """
+    sizes = [int(size) for size in args.sizes.split(",")]
+    kinds = args.kinds.split(",")
+    corpus = load_corpus(args.corpus, sizes, kinds, args.files_per_size, args.seed)
+
+    fake_clamd = None
+    if args.fake_clamd and 'CLAMAV_HOST' not in os.environ:
+        fake_clamd = FakeClamd(port=0, latency=args.clamd_latency / 1000).start()
+        os.environ['CLAMAV_HOST'] = '127.0.0.1'
+        os.environ['CLAMAV_PORT'] = str(fake_clamd.port)
+
+    module = load_processor_module()
+    processor = module.processor
+    processor.warm_up_embeddings()
+    container = f"benchmark-{uuid.uuid4().hex[:8]}"
+
+    samples = {}
+    volumes = {}
+
+    def record(stage: str, kind: str, seconds: float, size: int):
+        samples.setdefault((stage, kind), []).append(seconds)
+        volume = volumes.setdefault(stage, [0, 0.0])
+        volume[0] += size
+        volume[1] += seconds
+
+    def timed(stage: str, kind: str, size: int, func, *func_args):
+        started = time.perf_counter()
+        value = func(*func_args)
+        record(stage, kind, time.perf_counter() - started, size)
+        return value
+
+    started = time.monotonic()
+    for repetition in range(args.repeat):
+        for entry in corpus:
+            path, kind = entry['path'], entry['kind']
+            ingested = timed('hash', kind, entry['size'], processor.ingest_file, path)
+            timed('dedup', kind, 0, processor.find_existing_file, ingested['file_hash'])
+            file_info = dict(ingested, filename=f"{ingested['file_hash']}_{os.path.basename(path)}",
+                             original_filename=os.path.basename(path), source_type="benchmark",
+                             category=kind, created_by="benchmark", metadata={'benchmark': True})
+            is_clean, _ = timed('scan', kind, entry['size'], processor.scan_file_with_clamav, path, file_info)
+            if not is_clean:
+                continue
+            text = timed('extract', kind, entry['size'], processor.extract_text, path, ingested['file_type'])
+            embedding, chunks = timed('embed', kind, len(text), processor.embed_document, text)
+            if processor.blob_client:
+                file_info['storage_url'] = timed(
+                    'upload', kind, entry['size'], processor.upload_to_azure_storage, path, container, file_info
+                )
+            file_info['scan_status'] = 'clean'
+            timed('store', kind, len(text), processor.store_in_database, file_info, text, embedding, chunks)
+            cleanup(processor, container, ingested['file_hash'])
+        logger.info(f"Micro-benchmark repetition {repetition + 1}/{args.repeat} done")
+    elapsed = time.monotonic() - started
+
+    stages = {}
+    for (stage, kind), values in sorted(samples.items()):
+        stages.setdefault(stage, {'by_kind': {}})['by_kind'][kind] = summarize(values)
+    for stage, summary in stages.items():
+        values = [value for (name, _), kind_values in samples.items() if name == stage for value in kind_values]
+        summary.update(summarize(values))
+        size, seconds = volumes[stage]
+        summary['megabytes_per_second'] = size / seconds / (1024 * 1024) if size and seconds else None
+
+    if processor.blob_client:
+        try:
+            processor.blob_client.delete_container(container)
+        except Exception as e:
+            logger.warning(f"Could not delete benchmark container {container}: {e}")
+    if fake_clamd:
+        fake_clamd.shutdown()
+    processor.text_extractor.close()
+
+    results = run_metadata('micro', args)
+    results.update({
+        'duration': elapsed,
+        'corpus': {
+            'files': len(corpus),
+            'bytes': sum(entry['size'] for entry in corpus),
+            'kinds': dict(Counter(entry['kind'] for entry in corpus))
+        },
+        'stages': stages
+    })
+    return results
+
+def cleanup(processor, container: str, file_hash: str):
+    """Remove a file stored by the micro-benchmark so the next repetition stores it again"""
+    with processor.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM processing_log
+            WHERE file_id IN (SELECT id FROM processed_files WHERE file_hash = %s)
+        """, (file_hash,))
+        cur.execute("DELETE FROM processed_files WHERE file_hash = %s", (file_hash,))
+        cur.close()
+    processor.known_hashes.discard(file_hash)
+    if processor.blob_client:
+        try:
+            processor.blob_client.get_blob_client(
+                container=container, blob=processor.blob_name_for(file_hash)
+            ).delete_blob()
+        except Exception:
+            pass
+
+class LoadHarness:
+    """Drives /upload, /form/submit and /search concurrently and records per-request latency
+
+    Each worker runs a closed loop: pick an operation by weight, send it,
+    record the latency and status, repeat until the deadline. With
+    wait_jobs, an upload also polls its job and records the time until
+    processing finished as upload_complete.
+    """
+
+    def __init__(self, url: str, corpus: list, concurrency: int = 8, duration: float = 60.0,
+                 weights: Optional[dict] = None, search_modes: tuple = ("vector",),
+                 unique_uploads: bool = True, wait_jobs: bool = False, seed: int = 0):
+        self.url = url.rstrip("/")
+        self.corpus = [entry for entry in corpus if entry['kind'] != 'infected'] or corpus
+        self.concurrency = concurrency
+        self.duration = duration
+        self.weights = weights or {'upload': 1, 'form': 1, 'search': 4}
+        self.search_modes = search_modes
+        self.unique_uploads = unique_uploads
+        self.wait_jobs = wait_jobs
+        self.seed = seed
+
+        self._contents = {}
+        self._lock = threading.Lock()
+        self._samples = []
+
+    def _content(self, path: str) -> bytes:
+        if path not in self._contents:
+            with open(path, "rb") as f:
+                self._contents[path] = f.read()
+        return self._contents[path]
+
+    def _record(self, operation: str, started: float, status: int):
+        with self._lock:
+            self._samples.append((operation, time.perf_counter() - started, status))
+
+    def _upload(self, session: "requests.Session", rng: random.Random):
+        entry = rng.choice(self.corpus)
+        content = self._content(entry['path'])
+        if self.unique_uploads:
+            # Trailing bytes change the hash, so the upload is not short-circuited as a duplicate
+            content += f"\n{uuid.uuid4().hex}\n".encode()
+        started = time.perf_counter()
+        response = session.post(
+            f"{self.url}/upload",
+            files={'file': (os.path.basename(entry['path']), content)},
+            data={'category': entry['kind'], 'created_by': 'benchmark'}
+        )
+        self._record('upload', started, response.status_code)
+        if self.wait_jobs and response.status_code == 202:
+            job_id = response.json()['job_id']
+            status = 0
+            while time.perf_counter() - started < self.duration:
+                job = session.get(f"{self.url}/jobs/{job_id}")
+                status = job.status_code
+                if status != 200 or job.json()['status'] in ('completed', 'failed'):
+                    if status == 200 and job.json()['status'] == 'failed':
+                        status = 500
+                    break
+                time.sleep(0.05)
+            self._record('upload_complete', started, status)
+
+    def _form(self, session: "requests.Session", rng: random.Random):
+        started = time.perf_counter()
+        response = session.post(f"{self.url}/form/submit", data={
+            'organization': f"Benchmark {rng.choice(WORDS).title()} {uuid.uuid4().hex[:6]}",
+            'email': 'benchmark@example.com',
+            'description': random_text(rng, rng.randint(200, 2000))
+        })
+        self._record('form', started, response.status_code)
+
+    def _search(self, session: "requests.Session", rng: random.Random):
+        mode = rng.choice(self.search_modes)
+        query = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        started = time.perf_counter()
+        response = session.get(f"{self.url}/search", params={'query': query, 'limit': 10, 'mode': mode})
+        self._record(f"search_{mode}", started, response.status_code)
+
+    def _worker(self, index: int, deadline: float):
+        import requests
+        rng = random.Random(self.seed * 1000 + index)
+        operations = {'upload': self._upload, 'form': self._form, 'search': self._search}
+        names = [name for name in self.weights if self.weights[name] > 0]
+        weights = [self.weights[name] for name in names]
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                operation = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    operations[operation](session, rng)
+                except requests.RequestException as e:
+                    # Connection failures count as errors with status 0
+                    self._record(operation, started, 0)
+                    logger.debug(f"{operation} request failed: {e}")
+
+    def run(self) -> dict:
+        self._samples = []
+        started = time.perf_counter()
+        deadline = started + self.duration
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load") as executor:
+            list(executor.map(lambda index: self._worker(index, deadline), range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        operations = {}
+        for name in sorted(set(operation for operation, _, _ in self._samples)):
+            latencies = [seconds for operation, seconds, _ in self._samples if operation == name]
+            statuses = Counter(status for operation, _, status in self._samples if operation == name)
+            errors = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+            summary = summarize(latencies)
+            summary.update({
+                'throughput': len(latencies) / elapsed,
+                'errors': errors,
+                'status_codes': {str(status): count for status, count in sorted(statuses.items())}
+            })
+            operations[name] = summary
+        return {
+            'duration': elapsed,
+            'requests': len(self._samples),
+            'throughput': len(self._samples) / elapsed if elapsed else 0.0,
+            'operations': operations
+        }
+
+def fetch_metrics(url: str) -> Optional[str]:
+    """The server's Prometheus metrics, stored with load results for later inspection"""
+    import requests
+    try:
+        response = requests.get(f"{url.rstrip('/')}/metrics", timeout=10)
+        return response.text if response.ok else None
+    except requests.RequestException:
+        return None
+
+def run_load(args: argparse.Namespace) -> dict:
+    """Run the load harness against a running file processor"""
+    sizes = [int(size) for size in args.sizes.split(",")]
+    kinds = args.kinds.split(",")
+    corpus = load_corpus(args.corpus, sizes, kinds, args.files_per_size, args.seed)
+    weights = {'upload': args.upload_weight, 'form': args.form_weight, 'search': args.search_weight}
+
+    harness = LoadHarness(
+        args.url,
+        corpus,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        weights=weights,
+        search_modes=tuple(args.search_modes.split(",")),
+        unique_uploads=not args.allow_duplicates,
+        wait_jobs=args.wait_jobs,
+        seed=args.seed
+    )
+    logger.info(f"Load test against {args.url}: {args.concurrency} workers for {args.duration}s, weights {weights}")
+    results = run_metadata('load', args)
+    results.update(harness.run())
+    results['server_metrics'] = fetch_metrics(args.url)
+    return results
+
+def compare_results(baseline_path: str, candidate_path: str) -> list:
+    """Rows of (name, metric, baseline, candidate, change %) for two results files of the same kind"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    if baseline['benchmark'] != candidate['benchmark']:
+        raise ValueError(f"Cannot compare a {baseline['benchmark']} run with a {candidate['benchmark']} run")
+
+    section = 'stages' if baseline['benchmark'] == 'micro' else 'operations'
+    metrics = ('p50', 'p95', 'p99', 'megabytes_per_second') if section == 'stages' else \
+        ('p50', 'p95', 'p99', 'throughput', 'errors')
+    rows = []
+    for name in sorted(set(baseline[section]) & set(candidate[section])):
+        for metric in metrics:
+            before = baseline[section][name].get(metric)
+            after = candidate[section][name].get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else None
+            rows.append((name, metric, before, after, change))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="BriskLearning File Processor benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_corpus_arguments(command_parser):
+        command_parser.add_argument("--corpus", default="benchmark-corpus",
+                                    help="Directory holding the generated corpus")
+        command_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated file sizes in bytes")
+        command_parser.add_argument("--kinds", default=DEFAULT_KINDS,
+                                    help="Comma-separated kinds: text, json, pdf, image, binary, infected")
+        command_parser.add_argument("--files-per-size", type=int, default=2)
+        command_parser.add_argument("--seed", type=int, default=0)
+
+    corpus_parser = commands.add_parser("corpus", help="Generate the benchmark corpus")
+    add_corpus_arguments(corpus_parser)
+
+    clamd_parser = commands.add_parser("fake-clamd", help="Serve a local clamd stand-in")
+    clamd_parser.add_argument("--host", default="0.0.0.0")
+    clamd_parser.add_argument("--port", type=int, default=3310)
+    clamd_parser.add_argument("--latency", type=float, default=2.0, help="Milliseconds added to every scan")
+    clamd_parser.add_argument("--throughput", type=float, default=200.0, help="Simulated scan speed in MB/s")
+    clamd_parser.add_argument("--stream-max", type=int, default=0,
+                              help="Reject streams above this many bytes, like StreamMaxLength (0 for no limit)")
+
+    micro_parser = commands.add_parser("micro", help="Time each processing stage on the corpus")
+    add_corpus_arguments(micro_parser)
+    micro_parser.add_argument("--repeat", type=int, default=3)
+    micro_parser.add_argument("--no-fake-clamd", dest="fake_clamd", action="store_false",
+                              help="Use the clamd at CLAMAV_HOST instead of starting a fake one")
+    micro_parser.add_argument("--clamd-latency", type=float, default=2.0,
+                              help="Milliseconds added to every scan by the fake clamd")
+    micro_parser.add_argument("--output", help="Results file (default: benchmark-results/micro-<time>.json)")
+
+    load_parser = commands.add_parser("load", help="Drive the HTTP API concurrently")
+    add_corpus_arguments(load_parser)
+    load_parser.add_argument("--url", default="http://localhost:8000")
+    load_parser.add_argument("--concurrency", type=int, default=8)
+    load_parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run")
+    load_parser.add_argument("--upload-weight", type=float, default=1.0)
+    load_parser.add_argument("--form-weight", type=float, default=1.0)
+    load_parser.add_argument("--search-weight", type=float, default=4.0)
+    load_parser.add_argument("--search-modes", default="vector,lexical,hybrid")
+    load_parser.add_argument("--allow-duplicates", action="store_true",
+                             help="Upload corpus files unchanged, so repeats are deduplicated")
+    load_parser.add_argument("--wait-jobs", action="store_true",
+                             help="Poll each upload job and also record time until processing finished")
+    load_parser.add_argument("--output", help="Results file (default: benchmark-results/load-<time>.json)")
+
+    compare_parser = commands.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args()
+
+    if args.command == "corpus":
+        generate_corpus(args.corpus, [int(size) for size in args.sizes.split(",")], args.kinds.split(","),
+                        args.files_per_size, args.seed)
+    elif args.command == "fake-clamd":
+        server = FakeClamd(args.host, args.port, latency=args.latency / 1000,
+                           bytes_per_second=args.throughput * 1024 * 1024, stream_max=args.stream_max)
+        logger.info(f"Fake clamd listening on {args.host}:{server.port}")
+        server.serve_forever()
+    elif args.command == "micro":
+        results = run_micro(args)
+        write_results(results, args.output)
+        for stage, summary in results['stages'].items():
+            rate = summary['megabytes_per_second']
+            logger.info(
+                f"{stage}: p50 {summary['p50'] * 1000:.1f}ms, p95 {summary['p95'] * 1000:.1f}ms, "
+                f"p99 {summary['p99'] * 1000:.1f}ms" + (f", {rate:.1f} MB/s" if rate else "")
+            )
+    elif args.command == "load":
+        results = run_load(args)
+        write_results(results, args.output)
+        logger.info(f"{results['requests']} requests, {results['throughput']:.1f} req/s")
+        for name, summary in results['operations'].items():
+            logger.info(
+                f"{name}: {summary['throughput']:.1f} req/s, p50 {summary['p50'] * 1000:.1f}ms, "
+                f"p95 {summary['p95'] * 1000:.1f}ms, p99 {summary['p99'] * 1000:.1f}ms, "
+                f"{summary['errors']} errors"
+            )
+    elif args.command == "compare":
+        for name, metric, before, after, change in compare_results(args.baseline, args.candidate):
+            delta = f"{change:+.1f}%" if change is not None else "n/a"
+            print(f"{name:<20} {metric:<22} {before:>12.4f} {after:>12.4f} {delta:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -4,23 +4,59 @@ BriskLearning File Processor
 Handles file upload, virus scanning, text extraction, and vector storage
 """
 import os
+import argparse
+import fcntl
 import psycopg2
 import requests
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient, ContentSettings
 import magic
 import schedule
 import time
 import json
 import logging
 from datetime import datetime
-from sentence_transformers import SentenceTransformer
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+import numpy as np
+from fastapi import FastAPI, Form, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import uvicorn
-from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Callable, Optional
+import bisect
+import codecs
+import errno
 import hashlib
+import importlib.util
+import io
+import math
+import re
+import resource
+import select
 import shutil
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import multiprocessing
+import queue
+import uuid
+import weakref
+import asyncio
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
 
 # Configure logging
 logging.basicConfig(
@@ -29,16 +65,2134 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Large reads keep per-file syscalls low; the first buffer also feeds MIME sniffing
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Deep pages make the candidate scan grow with offset, so both are bounded
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '100'))
+SEARCH_MAX_OFFSET = int(os.getenv('SEARCH_MAX_OFFSET', '1000'))
+# Leading characters of a document indexed for full-text search (tsvector values are capped at 1 MB)
+SEARCH_TEXT_PREFIX = 100000
+
+# Notified in every transaction that adds searchable documents, with their content hashes as payload
+SEARCH_INVALIDATION_CHANNEL = "search_invalidate"
+# Payloads are limited to 8000 bytes; this many comma-separated SHA-256 hashes fit
+NOTIFY_HASHES_PER_PAYLOAD = 100
+
+# UNIX socket of the embedding server shared by API workers
+DEFAULT_EMBEDDING_SOCKET = "/tmp/file-processor-embeddings.sock"
+
+# Exported ONNX models must reproduce the SentenceTransformer vectors to at least this cosine similarity
+ONNX_MIN_COSINE = 0.99
+EMBEDDING_VALIDATION_TEXTS = [
+    "Introduction to machine learning: course CS101 syllabus and grading policy",
+    "Contact jane.doe@example.com for enrolment questions before 15 March",
+    "quarterly_report_2023_Q4_final.pdf",
+    "The mitochondria is the powerhouse of the cell.",
+    "Invoice #48213 - payment due within 30 days of receipt",
+    "Lecture notes week 7: gradient descent, learning rates and momentum",
+    "Students must submit assignments through the learning portal by midnight.",
+    "BriskLearning onboarding checklist for new instructors"
+]
+
 # Initialize FastAPI app
 app = FastAPI(title="BriskLearning File Processor")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+class FileTooLargeError(Exception):
+    """Raised when a file exceeds the configured upload size limit"""
+
+class ExtractionError(Exception):
+    """Text extraction failed, timed out or exceeded its memory limit"""
+
+class ClamdError(Exception):
+    """Raised when clamd cannot complete a scan"""
+
+class Metrics:
+    """In-process counters and histograms rendered in the Prometheus text format
+    
+    Recording is a dict update under one lock. Gauges are read from the
+    collectors registered with add_collector only when /metrics is scraped.
+    """
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+    
+    def __init__(self, namespace: str = "file_processor", buckets: tuple = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        
+        self._counters = {}
+        # (name, labels) -> [per-bucket counts with +Inf last, sum, count]
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+    
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+    
+    def add_collector(self, collector: Callable):
+        """Register a callable returning (name, labels, value) gauge samples at scrape time"""
+        self._collectors.append(collector)
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def error(self, stage: str, error: BaseException):
+        """Count a failure of a processing stage by exception type"""
+        self.inc('stage_errors_total', stage=stage, exception=type(error).__name__)
+    
+    @contextmanager
+    def stage(self, name: str, timings: Optional[dict] = None):
+        """Time a processing stage, also recording its seconds in timings when given
+        
+        Exceptions escaping the block are counted as errors of the stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(name, e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('stage_duration_seconds', elapsed, stage=name)
+            if timings is not None:
+                timings[name] = round(elapsed, 6)
+    
+    @staticmethod
+    def stats_gauges(component: str, stats: dict, **labels) -> list:
+        """Turn the numeric entries of a stats() dict into gauge samples named component_key"""
+        return [
+            (f"{component}_{key}", labels, float(value))
+            for key, value in stats.items()
+            if isinstance(value, (int, float))
+        ]
+    
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}"
+    
+    @staticmethod
+    def _labels(labels, extra: tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for key, value in pairs
+        )
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+    
+    @staticmethod
+    def _value(value: float) -> str:
+        if value == math.inf:
+            return "+Inf"
+        return repr(float(value)) if isinstance(value, float) else str(value)
+    
+    def _header(self, lines: list, name: str, kind: str):
+        if name in self._help:
+            lines.append(f"# HELP {self._name(name)} {self._help[name]}")
+        lines.append(f"# TYPE {self._name(name)} {kind}")
+    
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(buckets), total, count)) for key, (buckets, total, count) in self._histograms.items()
+            )
+        
+        lines = []
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                self._header(lines, name, "counter")
+                previous = name
+            lines.append(f"{self._name(name)}{self._labels(labels)} {self._value(value)}")
+        
+        bounds = self.buckets + (math.inf,)
+        for (name, labels), (buckets, total, count) in histograms:
+            if name != previous:
+                self._header(lines, name, "histogram")
+                previous = name
+            cumulative = 0
+            for bound, bucket in zip(bounds, buckets):
+                cumulative += bucket
+                le = (('le', self._value(bound)),)
+                lines.append(f"{self._name(name)}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{self._name(name)}_sum{self._labels(labels)} {self._value(total)}")
+            lines.append(f"{self._name(name)}_count{self._labels(labels)} {count}")
+        
+        gauges = {}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__qualname__', collector)} failed: {e}")
+        for name in sorted(gauges):
+            self._header(lines, name, "gauge")
+            for labels, value in gauges[name]:
+                lines.append(f"{self._name(name)}{self._labels(labels)} {self._value(value)}")
+        
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe('stage_duration_seconds', "Seconds spent in each file processing stage")
+metrics.describe('stage_errors_total', "Processing stage failures by exception type")
+metrics.describe('bytes_total', "Bytes read or sent by each processing stage")
+metrics.describe('extracted_characters_total', "Characters of text extracted from files")
+metrics.describe('files_total', "Files processed by outcome")
+metrics.describe('jobs', "Processing jobs by status")
+
+def file_outcome(result: dict) -> str:
+    """Classify a process_file result as processed, duplicate, quarantined or failed"""
+    if result.get('duplicate'):
+        return 'duplicate'
+    if result.get('success'):
+        return 'processed'
+    if result.get('scan_status') == 'infected':
+        return 'quarantined'
+    return 'failed'
+
+class DatabasePool:
+    """Thread-safe PostgreSQL connection pool with validated checkouts"""
+
+    def __init__(self, config: dict, minconn: int = 1, maxconn: int = 10,
+                 timeout: float = 30.0, validate_after: float = 30.0):
+        self.config = config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # psycopg2 pools raise when exhausted; the semaphore makes callers wait instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # Keyed by the connection itself: ids can be reused once a closed connection is collected
+        self._last_used = weakref.WeakKeyDictionary()
+        self._idle = weakref.WeakSet()
+        self._in_use = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'discarded': 0
+        }
+
+    def _get_pool(self):
+        """Create the underlying pool on first use so startup survives an unreachable database"""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    pool = pg_pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, **self.config
+                    )
+                    # The pool opens minconn connections up front; count them as idle
+                    opened = [pool.getconn() for _ in range(self.minconn)]
+                    for conn in opened:
+                        pool.putconn(conn)
+                        self._idle.add(conn)
+                    self._pool = pool
+                    logger.info(f"Database pool created (min={self.minconn}, max={self.maxconn})")
+        return self._pool
+
+    def _is_usable(self, conn) -> bool:
+        """Validate a pooled connection before handing it out"""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(conn)
+        if last_used is not None and time.monotonic() - last_used < self.validate_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            return False
+
+    def _getconn(self, pool):
+        conn = pool.getconn()
+        with self._lock:
+            self._idle.discard(conn)
+            self._in_use += 1
+        return conn
+
+    def _putconn(self, pool, conn, close: bool = False):
+        """Return a connection; psycopg2 closes it instead of keeping it beyond minconn idle ones"""
+        try:
+            pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                if not conn.closed:
+                    self._idle.add(conn)
+
+    def _discard(self, pool, conn):
+        self._last_used.pop(conn, None)
+        with self._lock:
+            self._stats['discarded'] += 1
+        try:
+            self._putconn(pool, conn, close=True)
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commits on success, rolls back on error"""
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['waits'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise TimeoutError(f"Timed out after {self.timeout}s waiting for a database connection")
+        waited = time.monotonic() - started
+
+        conn = None
+        try:
+            pool = self._get_pool()
+            # One retry covers a connection the server dropped while it sat idle
+            for _ in range(2):
+                conn = self._getconn(pool)
+                if self._is_usable(conn):
+                    break
+                self._discard(pool, conn)
+                conn = None
+            if conn is None:
+                raise psycopg2.OperationalError("No usable database connection available")
+
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+        finally:
+            if conn is not None:
+                if conn.closed:
+                    self._discard(pool, conn)
+                else:
+                    self._last_used[conn] = time.monotonic()
+                    self._putconn(pool, conn)
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Return pool usage counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            in_use = self._in_use
+            idle = sum(1 for conn in self._idle if not conn.closed)
+        checkouts = stats['checkouts']
+        stats.update({
+            'min_size': self.minconn,
+            'max_size': self.maxconn,
+            'in_use': in_use,
+            'idle': idle,
+            'wait_time_avg': stats['wait_time_total'] / checkouts if checkouts else 0.0
+        })
+        return stats
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
+            self._idle = weakref.WeakSet()
+
+class ClamdClient:
+    """clamd client that streams files with INSTREAM over reusable sessions
+
+    Files are sent in length-prefixed chunks, so clamd never needs access to
+    the shared volume. Idle IDSESSION connections are kept for reuse and the
+    number of concurrent scans is capped. Small files found clean are
+    remembered by hash for clean_cache_ttl seconds. Files larger than
+    stream_max, clamd's StreamMaxLength, cannot be scanned and raise
+    ClamdError, like every other scan failure.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 60.0, max_concurrency: int = 4,
+                 chunk_size: int = 1024 * 1024, session_idle: float = 25.0,
+                 clean_cache_size: int = 10000, clean_cache_max_file_size: int = 1024 * 1024,
+                 clean_cache_ttl: float = 3600.0, stream_max: int = 25 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        # clamd drops sessions idle longer than its IdleTimeout (30s by default)
+        self.session_idle = session_idle
+        self.clean_cache_size = clean_cache_size
+        self.clean_cache_max_file_size = clean_cache_max_file_size
+        self.clean_cache_ttl = clean_cache_ttl
+        self.stream_max = stream_max
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._clean = OrderedDict()
+        self._stats = {
+            'scans': 0,
+            'cache_hits': 0,
+            'infected': 0,
+            'errors': 0,
+            'connections_opened': 0,
+            'scan_time_total': 0.0
+        }
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            sock.sendall(b"zIDSESSION\0")
+        except OSError:
+            sock.close()
+            raise
+        with self._lock:
+            self._stats['connections_opened'] += 1
+        return sock
+
+    def _checkout(self) -> tuple[socket.socket, bool]:
+        """Return an idle session if one is fresh enough, otherwise open a new one"""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                sock, last_used = self._idle.pop()
+                if now - last_used < self.session_idle:
+                    return sock, True
+                self._close(sock)
+        return self._connect(), False
+
+    def _checkin(self, sock: socket.socket):
+        with self._lock:
+            self._idle.append((sock, time.monotonic()))
+
+    def _close(self, sock: socket.socket):
+        try:
+            sock.sendall(b"zEND\0")
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _read_reply(self, sock: socket.socket) -> str:
+        data = b""
+        while not data.endswith(b"\0"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ClamdError("clamd closed the connection")
+            data += chunk
+        reply = data[:-1].decode('utf-8', errors='replace')
+        # Session replies are prefixed with the request number, e.g. "3: stream: OK"
+        prefix, sep, rest = reply.partition(': ')
+        return rest if sep and prefix.isdigit() else reply
+
+    def _instream(self, sock: socket.socket, stream) -> str:
+        sock.sendall(b"zINSTREAM\0")
+        for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+            sock.sendall(struct.pack("!I", len(chunk)))
+            sock.sendall(chunk)
+        sock.sendall(struct.pack("!I", 0))
+        return self._read_reply(sock)
+
+    def scan_stream(self, stream) -> tuple[bool, str]:
+        """Scan a seekable binary stream; returns (is_clean, message)"""
+        start = stream.tell()
+        with self._slots:
+            started = time.monotonic()
+            for attempt in range(2):
+                try:
+                    sock, reused = self._checkout()
+                except OSError as e:
+                    with self._lock:
+                        self._stats['errors'] += 1
+                    raise ClamdError(f"clamd unreachable: {e}")
+                try:
+                    reply = self._instream(sock, stream)
+                except (OSError, ClamdError) as e:
+                    self._close(sock)
+                    # A reused session may have been dropped by clamd; retry on a fresh one
+                    if reused and attempt == 0:
+                        stream.seek(start)
+                        continue
+                    with self._lock:
+                        self._stats['errors'] += 1
+                    raise ClamdError(f"clamd scan failed: {e}")
+                break
+
+            if reply.endswith("ERROR"):
+                # clamd closes the session after an error
+                self._close(sock)
+                with self._lock:
+                    self._stats['errors'] += 1
+                raise ClamdError(reply)
+            self._checkin(sock)
+
+        with self._lock:
+            self._stats['scans'] += 1
+            self._stats['scan_time_total'] += time.monotonic() - started
+            if reply.endswith("FOUND"):
+                self._stats['infected'] += 1
+
+        if reply.endswith("FOUND"):
+            signature = reply[len("stream: "):-len(" FOUND")] if reply.startswith("stream: ") else reply
+            return False, f"Infected: {signature}"
+        return True, "Clean"
+
+    def scan_file(self, file_path: str, file_hash: Optional[str] = None,
+                  file_size: Optional[int] = None) -> tuple[bool, str]:
+        """Scan a file, skipping small files recently found clean"""
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        if file_size > self.stream_max:
+            # clamd would answer "INSTREAM size limit exceeded" after receiving the whole file
+            with self._lock:
+                self._stats['errors'] += 1
+            raise ClamdError(
+                f"File of {file_size} bytes exceeds clamd's StreamMaxLength of {self.stream_max} bytes"
+            )
+        cacheable = file_hash is not None and file_size <= self.clean_cache_max_file_size
+
+        if cacheable:
+            with self._lock:
+                scanned_at = self._clean.get(file_hash)
+                if scanned_at is not None and time.monotonic() - scanned_at < self.clean_cache_ttl:
+                    self._clean.move_to_end(file_hash)
+                    self._stats['cache_hits'] += 1
+                    return True, "Clean (cached)"
+
+        with open(file_path, "rb") as f:
+            is_clean, message = self.scan_stream(f)
+        metrics.inc('bytes_total', file_size, stage='scan')
+
+        if is_clean and cacheable:
+            with self._lock:
+                self._clean[file_hash] = time.monotonic()
+                self._clean.move_to_end(file_hash)
+                while len(self._clean) > self.clean_cache_size:
+                    self._clean.popitem(last=False)
+        return is_clean, message
+
+    def scan_many(self, files: list) -> list:
+        """Scan (file_path, file_hash, file_size) tuples in parallel up to the concurrency cap
+
+        Returns a (is_clean, message) tuple per file; raises ClamdError if
+        any file could not be scanned.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(lambda item: self.scan_file(*item), files))
+
+    def ping(self) -> bool:
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+                sock.sendall(b"zPING\0")
+                return self._read_reply(sock) == "PONG"
+        except (OSError, ClamdError):
+            return False
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock, _ in idle:
+            self._close(sock)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'idle_sessions': len(self._idle),
+                'max_concurrency': self.max_concurrency,
+                'clean_cache_entries': len(self._clean)
+            })
+        return stats
+
+class UploadAdmission:
+    """Caps in-flight uploads, their bytes and the disk they may fill
+    
+    A request reserves its Content-Length when admitted; bytes streamed
+    beyond that (or without one) are reserved as they arrive. A request
+    that is alone in flight is always admitted, so one file larger than
+    the byte budget can still be uploaded. Rejections raise HTTPException:
+    413 for oversize bodies, 429 when the caps are reached and 503 when
+    the upload would leave less than min_free_bytes on disk.
+    """
+    
+    def __init__(self, directory: str, max_request_size: int, max_inflight: int = 16,
+                 max_inflight_bytes: int = 1024 * 1024 * 1024, min_free_bytes: int = 512 * 1024 * 1024,
+                 retry_after: int = 10):
+        self.directory = directory
+        self.max_request_size = max_request_size
+        self.max_inflight = max_inflight
+        self.max_inflight_bytes = max_inflight_bytes
+        self.min_free_bytes = min_free_bytes
+        self.retry_after = retry_after
+        
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._inflight_bytes = 0
+        self._stats = {
+            'admitted': 0,
+            'rejected_too_large': 0,
+            'rejected_busy': 0,
+            'rejected_disk': 0
+        }
+    
+    def _reject(self, reason: str, status_code: int, detail: str):
+        self._stats[f'rejected_{reason}'] += 1
+        headers = None if status_code == 413 else {'Retry-After': str(self.retry_after)}
+        raise HTTPException(status_code=status_code, detail=detail, headers=headers)
+    
+    def _free_bytes(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self.directory).free
+        except OSError:
+            return None
+    
+    def admit(self, declared: Optional[int]) -> dict:
+        """Reserve a slot and the declared body size, returning the ticket to pass to consume and release"""
+        free = self._free_bytes()
+        with self._lock:
+            if declared is not None and declared > self.max_request_size:
+                self._reject('too_large', 413, f"Request body exceeds the {self.max_request_size} byte limit")
+            reserved = declared or 0
+            if self._inflight and (self._inflight >= self.max_inflight
+                                   or self._inflight_bytes + reserved > self.max_inflight_bytes):
+                self._reject('busy', 429, "Too many uploads in progress")
+            # Reserved bytes of other uploads are not on disk yet
+            if free is not None and free - self._inflight_bytes - reserved < self.min_free_bytes:
+                self._reject('disk', 503, "Not enough free disk space for uploads")
+            self._inflight += 1
+            self._inflight_bytes += reserved
+            self._stats['admitted'] += 1
+        return {'reserved': reserved, 'received': 0}
+    
+    def consume(self, ticket: dict, size: int):
+        """Count streamed body bytes, reserving those beyond the declared size"""
+        ticket['received'] += size
+        if ticket['received'] <= ticket['reserved']:
+            return
+        with self._lock:
+            if ticket['received'] > self.max_request_size:
+                self._reject('too_large', 413, f"Request body exceeds the {self.max_request_size} byte limit")
+            extra = ticket['received'] - ticket['reserved']
+            if self._inflight > 1 and self._inflight_bytes + extra > self.max_inflight_bytes:
+                self._reject('busy', 429, "Too many upload bytes in progress")
+            self._inflight_bytes += extra
+            ticket['reserved'] += extra
+    
+    def release(self, ticket: dict):
+        with self._lock:
+            self._inflight -= 1
+            self._inflight_bytes -= ticket['reserved']
+    
+    def stats(self) -> dict:
+        free = self._free_bytes()
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'inflight': self._inflight,
+                'inflight_bytes': self._inflight_bytes,
+                'max_inflight': self.max_inflight,
+                'max_inflight_bytes': self.max_inflight_bytes,
+                'disk_free_bytes': free,
+                'min_free_bytes': self.min_free_bytes
+            })
+        return stats
+
+class UploadAdmissionMiddleware:
+    """ASGI middleware applying an UploadAdmission to upload requests
+    
+    Runs before the multipart body is read, so rejections based on
+    Content-Length cost no reads. Bytes are counted as the endpoint streams
+    them in.
+    """
+    
+    def __init__(self, app, admission: UploadAdmission, paths: tuple = ("/upload",)):
+        self.app = app
+        self.admission = admission
+        self.paths = paths
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        declared = None
+        for name, value in scope['headers']:
+            if name == b'content-length':
+                try:
+                    declared = int(value)
+                except ValueError:
+                    pass
+                break
+        try:
+            ticket = self.admission.admit(declared)
+        except HTTPException as e:
+            logger.warning(f"Upload rejected ({e.status_code}): {e.detail}")
+            response = JSONResponse({'detail': e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+        
+        async def counted_receive():
+            message = await receive()
+            if message['type'] == 'http.request':
+                # Raised into the endpoint's body stream; FastAPI turns it into the response
+                self.admission.consume(ticket, len(message.get('body', b'')))
+            return message
+        
+        try:
+            await self.app(scope, counted_receive, send)
+        finally:
+            self.admission.release(ticket)
+
+class StreamDigest:
+    """SHA-256, MIME type and size of a stream fed in pieces, optionally copied to out
+
+    The type is sniffed from the first READ_BUFFER_SIZE bytes, however the
+    stream is split. Crossing max_size raises FileTooLargeError.
+    """
+
+    def __init__(self, out=None, max_size: Optional[int] = None):
+        self.out = out
+        self.max_size = max_size
+        self.file_size = 0
+        self.file_type = None
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+
+    def update(self, chunk: bytes):
+        self.file_size += len(chunk)
+        if self.max_size is not None and self.file_size > self.max_size:
+            raise FileTooLargeError(f"File exceeds the {self.max_size} byte limit")
+        if self.file_type is None:
+            self._head += chunk[:READ_BUFFER_SIZE - len(self._head)]
+            if len(self._head) == READ_BUFFER_SIZE:
+                self._sniff()
+        self._hash.update(chunk)
+        if self.out is not None:
+            self.out.write(chunk)
+
+    def _sniff(self):
+        self.file_type = magic.from_buffer(bytes(self._head), mime=True)
+        self._head = bytearray()
+
+    def result(self) -> dict:
+        if self.file_type is None:
+            self._sniff()
+        return {
+            'file_hash': self._hash.hexdigest(),
+            'file_type': self.file_type,
+            'file_size': self.file_size
+        }
+
+class MultipartUpload:
+    """Parses a multipart/form-data body as it arrives, writing the file part straight to disk
+
+    The file is hashed, sniffed and size-checked on its way to
+    directory/temp_<uuid>_<name>, so it is written once and an oversize
+    file fails with FileTooLargeError as soon as it crosses max_size.
+    Other parts are kept as text fields. Malformed bodies raise
+    HTTPException; discard() removes whatever was written.
+    """
+
+    def __init__(self, content_type: str, directory, max_size: int, file_field: str = "file",
+                 max_field_size: int = 65536):
+        media_type, options = parse_options_header(content_type)
+        if media_type != b'multipart/form-data' or not options.get(b'boundary'):
+            raise HTTPException(status_code=422, detail="Expected a multipart/form-data body")
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.file_field = file_field
+        self.max_field_size = max_field_size
+        self.fields = {}
+        self.filename = None
+        self.path = None
+        self.ingested = None
+
+        self._out = None
+        self._digest = None
+        self._field = None
+        self._value = bytearray()
+        self._headers = {}
+        self._header = [b"", b""]
+        self._complete = False
+        self._parser = MultipartParser(options[b'boundary'], {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': lambda data, start, end: self._append_header(0, data[start:end]),
+            'on_header_value': lambda data, start, end: self._append_header(1, data[start:end]),
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+            'on_end': self._on_end
+        })
+
+    def write(self, data: bytes):
+        try:
+            self._parser.write(data)
+        except MultipartParseError as e:
+            raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+
+    def finish(self):
+        """Check that the body was complete and held the file"""
+        if not self._complete:
+            raise HTTPException(status_code=400, detail="Incomplete multipart body")
+        if self.ingested is None:
+            raise HTTPException(status_code=422, detail=f"Missing file field '{self.file_field}'")
+
+    def discard(self):
+        """Close and remove the file written so far"""
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._field = None
+        self._digest = None
+
+    def _append_header(self, index: int, data: bytes):
+        self._header[index] += data
+
+    def _on_header_end(self):
+        name, value = self._header
+        self._headers[name.lower()] = value
+        self._header = [b"", b""]
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition'))
+        name = options.get(b'name', b'').decode('utf-8', 'replace')
+        filename = options.get(b'filename')
+        if filename is None:
+            self._field = name
+            self._value = bytearray()
+        elif name == self.file_field and self.path is None:
+            # Queued files wait on disk, so the name must not collide with other uploads
+            self.filename = os.path.basename(filename.decode('utf-8', 'replace'))
+            self.path = self.directory / f"temp_{uuid.uuid4().hex}_{self.filename}"
+            self._out = open(self.path, "wb", buffering=READ_BUFFER_SIZE)
+            self._digest = StreamDigest(self._out, self.max_size)
+
+    def _on_part_data(self, data, start: int, end: int):
+        if self._digest is not None:
+            self._digest.update(data[start:end])
+        elif self._field is not None:
+            self._value += data[start:end]
+            if len(self._value) > self.max_field_size:
+                raise HTTPException(status_code=413, detail=f"Form field '{self._field}' is too large")
+
+    def _on_part_end(self):
+        if self._digest is not None:
+            self._out.close()
+            self._out = None
+            self.ingested = self._digest.result()
+            metrics.inc('bytes_total', self.ingested['file_size'], stage='hash')
+            self._digest = None
+        elif self._field is not None:
+            self.fields[self._field] = self._value.decode('utf-8', 'replace')
+            self._field = None
+
+    def _on_end(self):
+        self._complete = True
+
+class KnownHashCache:
+    """Remembers stored content hashes: an LRU of hash -> file_id plus a Bloom filter
+
+    The Bloom filter answers "definitely not stored" without a database round
+    trip while it is ready: loaded with every existing hash and kept current
+    with the hashes other processes announce. Until then, and for any
+    possible match, callers fall back to the database.
+    """
+
+    def __init__(self, max_entries: int = 10000, bloom_bits: int = 1 << 23, bloom_hashes: int = 6):
+        if not 1 <= bloom_hashes <= 8:
+            raise ValueError("bloom_hashes must be between 1 and 8")
+        self.max_entries = max_entries
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self.ready = False
+
+        self._entries = OrderedDict()
+        self._bits = bytearray((bloom_bits + 7) // 8)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'bloom_negatives': 0}
+
+    def _positions(self, file_hash: str):
+        # SHA-256 digests are already uniform, so slices of them serve as the Bloom hashes
+        digest = bytes.fromhex(file_hash)
+        for i in range(self.bloom_hashes):
+            yield int.from_bytes(digest[i * 4:i * 4 + 4], 'big') % self.bloom_bits
+
+    def add(self, file_hash: str, file_id: Optional[int] = None):
+        with self._lock:
+            for pos in self._positions(file_hash):
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            if file_id is not None:
+                self._entries[file_hash] = file_id
+                self._entries.move_to_end(file_hash)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def discard(self, file_hash: str):
+        """Forget the file id of a deleted file; its Bloom filter bits stay, costing one database lookup"""
+        with self._lock:
+            self._entries.pop(file_hash, None)
+
+    def get(self, file_hash: str) -> Optional[int]:
+        """Return the cached file id for a hash"""
+        with self._lock:
+            file_id = self._entries.get(file_hash)
+            if file_id is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(file_hash)
+            self._stats['hits'] += 1
+            return file_id
+
+    def might_contain(self, file_hash: str) -> bool:
+        """False only when the hash is certainly not stored"""
+        if not self.ready:
+            return True
+        with self._lock:
+            found = all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(file_hash))
+            if not found:
+                self._stats['bloom_negatives'] += 1
+            return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bloom_ready': self.ready
+            })
+        return stats
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ttl seconds
+    
+    A max_entries of 0 disables the cache.
+    """
+    
+    def __init__(self, max_entries: int = 1000, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+    
+    def get(self, key):
+        """Return the cached value, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+    
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            })
+        return stats
+
+# Bump when extractor output changes, so cached extractions are not reused
+EXTRACTOR_VERSION = "v1"
+EXTRACTORS = {}
+# Executable each extractor runs, if any
+EXTRACTOR_COMMANDS = {}
+
+def register_extractor(*mime_types: str, command: Optional[str] = None):
+    """Register a generator yielding a file's text a page (or buffer) at a time
+    
+    A type ending in "/*" matches every subtype without its own extractor.
+    An extractor with a command is skipped when that executable is not
+    installed.
+    """
+    def register(func):
+        for mime_type in mime_types:
+            EXTRACTORS[mime_type] = func
+        if command:
+            EXTRACTOR_COMMANDS[func] = command
+        return func
+    return register
+
+def find_extractor(mime_type: str) -> Optional[Callable]:
+    return EXTRACTORS.get(mime_type) or EXTRACTORS.get(mime_type.split('/')[0] + '/*')
+
+@register_extractor('text/*', 'application/json', 'application/xml')
+def extract_plain_text(file_path: str):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(READ_BUFFER_SIZE)
+            if not block:
+                break
+            yield decoder.decode(block)
+    yield decoder.decode(b'', final=True)
+
+@register_extractor('application/pdf')
+def extract_pdf(file_path: str):
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    for page in reader.pages:
+        yield (page.extract_text() or '') + "\n\n"
+
+@register_extractor('image/*', command='tesseract')
+def extract_image(file_path: str):
+    import pytesseract
+    from PIL import Image, ImageSequence
+    with Image.open(file_path) as image:
+        # Multi-page TIFFs and animated images are OCRed frame by frame
+        for frame in ImageSequence.Iterator(image):
+            yield pytesseract.image_to_string(frame.convert('RGB')) + "\n\n"
+
+def _detach_inherited_fds(keep: int):
+    """Point every descriptor above stderr except keep at /dev/null"""
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for name in os.listdir('/proc/self/fd'):
+        fd = int(name)
+        if fd > 2 and fd not in (keep, devnull):
+            try:
+                os.dup2(devnull, fd)
+            except OSError:
+                pass
+    os.close(devnull)
+
+def _extraction_worker(conn, memory_limit: int):
+    """Sandbox loop: receive (path, MIME type) tasks and stream ('text', piece) messages back"""
+    # Own process group, so killing the worker also kills OCR subprocesses
+    os.setsid()
+    # The fork copied the server's client sockets and database connections; release them, so
+    # only the parent can use or close them (/dev/null keeps stray writes from reaching reused fds)
+    _detach_inherited_fds(conn.fileno())
+    if memory_limit:
+        # Cap growth beyond what the worker already maps; the limit is inherited by subprocesses
+        with open('/proc/self/statm') as f:
+            mapped = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        resource.setrlimit(resource.RLIMIT_AS, (mapped + memory_limit, mapped + memory_limit))
+    
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        file_path, file_type = task
+        try:
+            for piece in find_extractor(file_type)(file_path):
+                if piece:
+                    conn.send(('text', piece))
+            conn.send(('done', None))
+        except MemoryError:
+            conn.send(('fatal', "Extraction exceeded the memory limit"))
+            return
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+class TextExtractor:
+    """Runs registered extractors in sandboxed worker processes, caching results by content hash
+    
+    Workers are forked lazily, keep no descriptor of the server but their
+    pipe, and are capped at memory_limit bytes of extra address space. A
+    file that overruns timeout, exhausts memory or crashes its worker
+    fails on its own and the worker is replaced. Text streams back a piece
+    at a time and is cut off at max_chars. Finished extractions are
+    written to cache_dir, shared by every process.
+    """
+    
+    def __init__(self, workers: int = 2, timeout: float = 120.0, memory_limit: int = 1 << 30,
+                 max_chars: int = 10000000, max_tasks_per_worker: int = 200,
+                 cache_dir: Optional[str] = None, cache_max_bytes: int = 1 << 30):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_chars = max_chars
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        
+        # Forked rather than spawned: a spawned child would re-import this module and build a processor.
+        # Workers only run extractors and exchange pipe messages, and OCR runs tesseract through
+        # subprocess, which closes every other descriptor in the exec'd child
+        self._context = multiprocessing.get_context("fork")
+        # Files of types whose command is missing get the placeholder text instead of failing
+        self._unavailable = set()
+        for func, command in EXTRACTOR_COMMANDS.items():
+            if shutil.which(command) is None:
+                self._unavailable.add(func)
+                types = ', '.join(sorted(mime_type for mime_type, f in EXTRACTORS.items() if f is func))
+                logger.warning(f"{command} is not installed; {types} files are stored without extracted text")
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._cache_writes = 0
+        self._stats = {
+            'extractions': 0,
+            'cache_hits': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'truncated': 0,
+            'workers_started': 0
+        }
+    
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+    
+    def _start_worker(self) -> dict:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_extraction_worker, args=(child_conn, self.memory_limit), name="text-extractor", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self._count('workers_started')
+        return {'process': process, 'conn': parent_conn, 'tasks': 0}
+    
+    def _stop_worker(self, worker: dict):
+        try:
+            os.killpg(worker['process'].pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        worker['process'].join(timeout=5)
+        worker['conn'].close()
+    
+    def _acquire(self) -> dict:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker['process'].is_alive():
+                    return worker
+                worker['conn'].close()
+        return self._start_worker()
+    
+    def _release(self, worker: dict, reusable: bool):
+        worker['tasks'] += 1
+        if reusable and worker['tasks'] < self.max_tasks_per_worker:
+            with self._lock:
+                self._idle.append(worker)
+        else:
+            self._stop_worker(worker)
+    
+    def stream(self, file_path: str, file_type: str):
+        """Yield the text of a file piece by piece from a sandboxed worker"""
+        with self._slots:
+            worker = self._acquire()
+            reusable = False
+            try:
+                worker['conn'].send((file_path, file_type))
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not worker['conn'].poll(remaining):
+                        self._count('timeouts')
+                        raise ExtractionError(f"Extraction timed out after {self.timeout:.0f}s")
+                    try:
+                        kind, payload = worker['conn'].recv()
+                    except EOFError:
+                        raise ExtractionError("Extraction worker died (memory limit or crash)")
+                    if kind == 'text':
+                        yield payload
+                    elif kind == 'done':
+                        reusable = True
+                        return
+                    else:
+                        reusable = kind == 'error'
+                        raise ExtractionError(payload)
+            finally:
+                # A worker abandoned mid-file (timeout, crash, early stop) is killed, not reused
+                self._release(worker, reusable)
+    
+    def extract(self, file_path: str, file_type: str, file_hash: Optional[str] = None) -> str:
+        """Return the text of a file, from the cache when this content was extracted before"""
+        cached = self._cache_read(file_hash)
+        if cached is not None:
+            self._count('cache_hits')
+            return cached
+        extractor = find_extractor(file_type)
+        if extractor is None or extractor in self._unavailable:
+            return f"[Binary file: {os.path.basename(file_path)}]"
+        
+        self._count('extractions')
+        pieces = []
+        size = 0
+        stream = self.stream(file_path, file_type)
+        try:
+            for piece in stream:
+                if size + len(piece) > self.max_chars:
+                    pieces.append(piece[:self.max_chars - size])
+                    self._count('truncated')
+                    logger.warning(f"Extracted text of {file_path} truncated at {self.max_chars} characters")
+                    break
+                pieces.append(piece)
+                size += len(piece)
+        except ExtractionError:
+            self._count('failures')
+            raise
+        finally:
+            stream.close()
+        
+        text = ''.join(pieces)
+        self._cache_write(file_hash, text)
+        return text
+    
+    def _cache_path(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, EXTRACTOR_VERSION, file_hash[:2], f"{file_hash}.txt")
+    
+    def _cache_read(self, file_hash: Optional[str]) -> Optional[str]:
+        if not self.cache_dir or not file_hash:
+            return None
+        path = self._cache_path(file_hash)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Extraction cache read failed for {file_hash}: {e}")
+            return None
+        # Recently used entries survive pruning
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return text
+    
+    def _cache_write(self, file_hash: Optional[str], text: str):
+        if not self.cache_dir or not file_hash:
+            return
+        path = self._cache_path(file_hash)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Extraction cache write failed for {file_hash}: {e}")
+            return
+        with self._lock:
+            self._cache_writes += 1
+            prune = self._cache_writes % 50 == 0
+        if prune:
+            self._prune_cache()
+    
+    def _prune_cache(self):
+        """Delete the least recently used cache files until the cache is under 90% of its budget"""
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        if total <= self.cache_max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.cache_max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            self._stop_worker(worker)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle_workers'] = len(self._idle)
+        stats.update({
+            'workers': self.workers,
+            'timeout': self.timeout,
+            'memory_limit_mb': self.memory_limit // (1 << 20),
+            'extractors': sorted(mime_type for mime_type, func in EXTRACTORS.items() if func not in self._unavailable)
+        })
+        return stats
+
+class EmbeddingBackend(ABC):
+    """Turns batches of texts into normalised embedding rows
+    
+    The model is loaded on first use or by warm_up(), so importing and
+    constructing a backend is cheap. state moves from 'not_loaded' through
+    'loading' to 'ready', or to 'failed' if loading raised. model_id names
+    the model whose vectors the backend produces; backends running the same
+    model share it.
+    """
+    
+    name = "base"
+    model_id = None
+    
+    def __init__(self):
+        self.state = "not_loaded"
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+    
+    @abstractmethod
+    def _load(self):
+        """Load the model; runs once, under the backend's lock"""
+    
+    @abstractmethod
+    def _encode(self, texts: list) -> np.ndarray:
+        """Embed a batch of texts with the loaded model"""
+    
+    @abstractmethod
+    def _tokenizer(self):
+        """Tokenizer of the loaded model"""
+    
+    def ensure_loaded(self):
+        if self.state == "ready":
+            return
+        with self._lock:
+            if self.state == "ready":
+                return
+            if self.state == "failed":
+                raise RuntimeError(f"Embedding backend {self.name} failed to load: {self.error}")
+            self.state = "loading"
+            started = time.monotonic()
+            try:
+                self._load()
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                logger.error(f"Failed to load {self.name} embedding backend: {e}")
+                raise
+            self.load_seconds = time.monotonic() - started
+            self.state = "ready"
+            logger.info(f"Loaded {self.name} embedding backend in {self.load_seconds:.1f}s")
+    
+    def encode(self, texts: list) -> np.ndarray:
+        self.ensure_loaded()
+        return self._encode(texts)
+    
+    @property
+    def tokenizer(self):
+        """Hugging Face tokenizer of the model, used for token-based chunking"""
+        self.ensure_loaded()
+        return self._tokenizer()
+    
+    def warm_up(self):
+        """Load the model and run one encode so the first request pays no setup cost"""
+        self.encode(["warm up"])
+    
+    def stats(self) -> dict:
+        return {
+            'backend': self.name,
+            'model': self.model_id,
+            'state': self.state,
+            'error': self.error,
+            'load_seconds': self.load_seconds
+        }
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """fp32 PyTorch inference through sentence-transformers"""
+    
+    name = "sentence-transformers"
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        super().__init__()
+        self.model_name = model_name
+        self.model_id = model_name
+        self._model = None
+    
+    def _load(self):
+        # Imported here: torch alone takes seconds to import
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(self.model_name, device="cpu")
+    
+    def _encode(self, texts: list) -> np.ndarray:
+        if not texts:
+            # encode() rejects a batch size of 0
+            return np.zeros((0, self._model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return self._model.encode(texts, batch_size=len(texts))
+    
+    def _tokenizer(self):
+        return self._model.tokenizer
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """ONNX Runtime inference of a model written by export_onnx_model
+    
+    Reproduces the sentence-transformers pipeline (transformer, mean
+    pooling over the attention mask, L2 normalisation) without torch.
+    """
+    
+    name = "onnx"
+    
+    def __init__(self, model_dir: str, threads: int = 0):
+        super().__init__()
+        self.model_dir = model_dir
+        self.threads = threads
+        self.max_seq_length = 256
+        self._session = None
+        self._hf_tokenizer = None
+        self._input_names = []
+        # Named after the model it was exported from, whose vectors it reproduces
+        self.model_id = os.path.basename(os.path.normpath(model_dir))
+        try:
+            with open(os.path.join(model_dir, "embedding_config.json")) as f:
+                self.model_id = json.load(f).get('model', self.model_id)
+        except (OSError, ValueError):
+            pass
+    
+    def _load(self):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        
+        config_path = os.path.join(self.model_dir, "embedding_config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                self.max_seq_length = json.load(f).get('max_seq_length', self.max_seq_length)
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self._session = ort.InferenceSession(
+            os.path.join(self.model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [model_input.name for model_input in self._session.get_inputs()]
+        self._hf_tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+    
+    def _encode(self, texts: list) -> np.ndarray:
+        encoded = self._hf_tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in self._input_names}
+        hidden = self._session.run(None, feeds)[0]
+        mask = encoded['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    
+    def _tokenizer(self):
+        return self._hf_tokenizer
+
+class StubEmbeddingBackend(EmbeddingBackend):
+    """Deterministic hashed bag-of-words vectors for offline benchmarks and local runs
+    
+    Needs no model files. Texts sharing words get similar vectors, so search
+    still returns plausible results. delay simulates model cost per text.
+    """
+    
+    name = "stub"
+    
+    def __init__(self, dimensions: int = 384, delay: float = 0.0):
+        super().__init__()
+        self.dimensions = dimensions
+        self.delay = delay
+        self.model_id = f"stub-{dimensions}"
+    
+    def _load(self):
+        pass
+    
+    def _encode(self, texts: list) -> np.ndarray:
+        if self.delay:
+            time.sleep(self.delay * len(texts))
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+                index = int.from_bytes(digest[:4], "little") % self.dimensions
+                vectors[row, index] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+    
+    def _tokenizer(self):
+        # Token chunking falls back to whitespace-separated words
+        return None
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("connection closed mid-frame")
+        received += count
+    return bytes(data)
+
+def send_frame(sock: socket.socket, header: dict, payload: bytes = b""):
+    """Send a JSON header and a binary payload, each prefixed by its length"""
+    encoded = json.dumps(header).encode()
+    sock.sendall(struct.pack("!II", len(encoded), len(payload)) + encoded + payload)
+
+def recv_frame(sock: socket.socket) -> tuple[dict, bytes]:
+    header_size, payload_size = struct.unpack("!II", _recv_exact(sock, 8))
+    header = json.loads(_recv_exact(sock, header_size))
+    return header, _recv_exact(sock, payload_size)
+
+class RemoteEmbeddingBackend(EmbeddingBackend):
+    """Client of an EmbeddingServer: the model is loaded and run in the server process only
+    
+    Each thread keeps its own connection. Loading waits up to wait seconds
+    for the server to report its backend ready.
+    """
+    
+    name = "remote"
+    
+    def __init__(self, socket_path: str = DEFAULT_EMBEDDING_SOCKET, timeout: float = 60.0, wait: float = 300.0):
+        super().__init__()
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.wait = wait
+        self.remote_backend = None
+        self._model_id = None
+        self._has_tokenizer = False
+        self._local = threading.local()
+    
+    @property
+    def model_id(self) -> Optional[str]:
+        # Known to the server before its model loads; None while it is unreachable
+        if self._model_id is None:
+            try:
+                self._model_id = self._call({'op': 'status'})[0]['model']
+            except (OSError, RuntimeError):
+                pass
+        return self._model_id
+    
+    def _call(self, request: dict) -> tuple[dict, bytes]:
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None)
+            reused = sock is not None
+            if sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                try:
+                    sock.connect(self.socket_path)
+                except OSError:
+                    sock.close()
+                    raise
+                self._local.sock = sock
+            try:
+                send_frame(sock, request)
+                header, payload = recv_frame(sock)
+                break
+            except OSError as e:
+                self._local.sock = None
+                sock.close()
+                # A kept connection may belong to a server that has since restarted
+                if not (reused and isinstance(e, ConnectionError)) or attempt:
+                    raise
+        if 'exception' in header:
+            raise RuntimeError(f"Embedding server: {header['exception']}")
+        return header, payload
+    
+    def _load(self):
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                status, _ = self._call({'op': 'status'})
+            except OSError as e:
+                status = {'state': 'unreachable', 'error': str(e)}
+            if status['state'] == 'ready':
+                self.remote_backend = status['backend']
+                self._model_id = status['model']
+                self._has_tokenizer = status['tokenizer']
+                return
+            if status['state'] == 'failed':
+                raise RuntimeError(f"Embedding server backend failed to load: {status['error']}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"Embedding server at {self.socket_path} not ready after {self.wait:.0f}s ({status['state']})"
+                )
+            time.sleep(0.5)
+    
+    def _encode(self, texts: list) -> np.ndarray:
+        header, payload = self._call({'op': 'encode', 'texts': texts})
+        return np.frombuffer(payload, dtype=np.float32).reshape(header['rows'], header['dims'])
+    
+    def _offsets(self, text: str, **kwargs) -> dict:
+        # Called like a Hugging Face tokenizer by _iter_token_spans
+        header, _ = self._call({'op': 'offsets', 'text': text})
+        return {'offset_mapping': header['offsets']}
+    
+    def _tokenizer(self):
+        return self._offsets if self._has_tokenizer else None
+    
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({'socket': self.socket_path, 'remote_backend': self.remote_backend})
+        return stats
+
+def create_embedding_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """Build the embedding backend named by EMBEDDING_BACKEND (not yet loaded)"""
+    name = name or os.getenv('EMBEDDING_BACKEND', 'sentence-transformers')
+    if name == "sentence-transformers":
+        return SentenceTransformerBackend(os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+    if name == "onnx":
+        return OnnxEmbeddingBackend(
+            os.getenv('EMBEDDING_ONNX_PATH', '/models/all-MiniLM-L6-v2-onnx'),
+            threads=int(os.getenv('EMBEDDING_THREADS', '0'))
+        )
+    if name == "stub":
+        return StubEmbeddingBackend(delay=float(os.getenv('EMBEDDING_STUB_DELAY_MS', '0')) / 1000)
+    if name == "remote":
+        return RemoteEmbeddingBackend(
+            os.getenv('EMBEDDING_SERVER_SOCKET', DEFAULT_EMBEDDING_SOCKET),
+            timeout=float(os.getenv('EMBEDDING_SERVER_TIMEOUT', '60')),
+            wait=float(os.getenv('EMBEDDING_SERVER_WAIT', '300'))
+        )
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Lowest cosine similarity between matching rows of two embedding matrices"""
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    dots = (reference * candidate).sum(axis=1)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return float((dots / np.clip(norms, 1e-12, None)).min())
+
+def export_onnx_model(output_dir: str, model_name: str = "all-MiniLM-L6-v2", quantize: bool = True) -> dict:
+    """Export a sentence-transformers model to ONNX, optionally int8-quantized, and validate it
+    
+    Raises ValueError if the exported model's embeddings fall below
+    ONNX_MIN_COSINE against the original model.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if quantize:
+        # onnxruntime's quantization tools import the onnx package; fail before the slow export
+        if importlib.util.find_spec("onnx") is None:
+            raise RuntimeError("Quantizing needs the onnx package; install onnx from "
+                               "requirements.txt or export with --no-quantize")
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    
+    source = SentenceTransformer(model_name, device="cpu")
+    transformer = source[0].auto_model
+    tokenizer = source.tokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+    
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    model_path = os.path.join(output_dir, "model.onnx")
+    axes = {0: 'batch', 1: 'sequence'}
+    torch.onnx.export(
+        transformer,
+        tuple(sample[name] for name in input_names),
+        fp32_path,
+        input_names=input_names,
+        output_names=['last_hidden_state'],
+        dynamic_axes=dict({name: axes for name in input_names}, last_hidden_state=axes),
+        opset_version=14
+    )
+    if quantize:
+        # Dynamic quantization: int8 weights, activations quantized per batch at run time
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+    
+    with open(os.path.join(output_dir, "embedding_config.json"), "w") as f:
+        json.dump({'model': model_name, 'max_seq_length': source.max_seq_length, 'quantized': quantize}, f)
+    
+    exported = OnnxEmbeddingBackend(output_dir)
+    agreement = cosine_agreement(
+        source.encode(EMBEDDING_VALIDATION_TEXTS), exported.encode(EMBEDDING_VALIDATION_TEXTS)
+    )
+    if agreement < ONNX_MIN_COSINE:
+        raise ValueError(f"Exported model agrees only to cosine {agreement:.4f} (need {ONNX_MIN_COSINE})")
+    return {
+        'path': model_path,
+        'quantized': quantize,
+        'size_mb': round(os.path.getsize(model_path) / 2 ** 20, 1),
+        'min_cosine': round(agreement, 5)
+    }
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux only)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def process_memory(pid: int) -> dict:
+    """RSS and PSS of a process in bytes (Linux only)
+    
+    PSS divides each shared page between the processes mapping it, so PSS
+    values of processes can be added up while RSS values cannot.
+    """
+    memory = {'rss': None, 'pss': None}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                field, _, value = line.partition(':')
+                if field in ('Rss', 'Pss'):
+                    memory[field.lower()] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return memory
+
+def child_pids(pid: int) -> list:
+    """Direct children of a process, whichever thread started them (Linux only)"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after its closing parenthesis
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+def benchmark_embedding_backend(name: str, texts: list, batch_size: int = 32, queries: int = 100) -> dict:
+    """Measure one backend's load time, memory and encode speed; run it in a fresh process"""
+    rss_start = rss_bytes()
+    started = time.perf_counter()
+    backend = create_embedding_backend(name)
+    backend.warm_up()
+    startup = time.perf_counter() - started
+    rss_loaded = rss_bytes()
+    
+    started = time.perf_counter()
+    for offset in range(0, len(texts), batch_size):
+        backend.encode(texts[offset:offset + batch_size])
+    throughput = len(texts) / (time.perf_counter() - started)
+    
+    latencies = []
+    for text in texts[:queries]:
+        started = time.perf_counter()
+        backend.encode([text])
+        latencies.append((time.perf_counter() - started) * 1000)
+    
+    return {
+        'backend': name,
+        'startup_s': round(startup, 2),
+        'rss_mb': round(rss_loaded / 2 ** 20, 1) if rss_loaded else None,
+        'model_rss_mb': round((rss_loaded - rss_start) / 2 ** 20, 1) if rss_loaded and rss_start else None,
+        'texts_per_s': round(throughput, 1),
+        'query_p50_ms': round(percentile(latencies, 50), 2),
+        'query_p99_ms': round(percentile(latencies, 99), 2),
+        'vectors': np.asarray(backend.encode(EMBEDDING_VALIDATION_TEXTS)).tolist()
+    }
+
+class EmbeddingBatcher:
+    """Coalesces concurrent encode requests into batched model calls"""
+    
+    def __init__(self, backend: EmbeddingBackend, max_batch_size: int = 32, max_wait: float = 0.005):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'batches': 0,
+            'errors': 0,
+            'max_batch_size_seen': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'encode_time_total': 0.0,
+            'encode_time_max': 0.0
+        }
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue text for encoding; the future resolves to the embedding as a list"""
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> list:
+        return self.submit(text).result(timeout=timeout)
+
+    def encode_many(self, texts: list, timeout: Optional[float] = None) -> list:
+        """Encode several texts; they are batched alongside other callers' requests"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout=timeout) for future in futures]
+
+    async def encode_async(self, text: str) -> list:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            # Keep collecting until the batch is full or the oldest request has waited long enough
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: list):
+        started = time.monotonic()
+        texts = [text for text, _, _ in batch]
+        try:
+            vectors = self.backend.encode(texts)
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.monotonic()
+
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector.tolist())
+
+        encode_time = finished - started
+        waits = [started - enqueued for _, _, enqueued in batch]
+        with self._lock:
+            self._stats['requests'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['max_batch_size_seen'] = max(self._stats['max_batch_size_seen'], len(batch))
+            self._stats['queue_wait_total'] += sum(waits)
+            self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], max(waits))
+            self._stats['encode_time_total'] += encode_time
+            self._stats['encode_time_max'] = max(self._stats['encode_time_max'], encode_time)
+
+    def stats(self) -> dict:
+        """Return batch size and latency counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        requests = stats['requests']
+        batches = stats['batches']
+        stats.update({
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'pending': self._queue.qsize(),
+            'avg_batch_size': requests / batches if batches else 0.0,
+            'queue_wait_avg': stats['queue_wait_total'] / requests if requests else 0.0,
+            'encode_time_avg': stats['encode_time_total'] / batches if batches else 0.0
+        })
+        return stats
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """Answers status, encode and offsets requests on one worker connection"""
+    
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                request, _ = recv_frame(self.request)
+            except (OSError, ValueError):
+                return
+            op = request.get('op')
+            try:
+                if op == 'status':
+                    send_frame(self.request, server.status())
+                elif op == 'encode':
+                    vectors = np.asarray(server.batcher.encode_many(request['texts']), dtype=np.float32)
+                    rows, dims = vectors.shape if vectors.size else (0, 0)
+                    send_frame(self.request, {'rows': rows, 'dims': dims}, vectors.tobytes())
+                elif op == 'offsets':
+                    encoded = server.backend.tokenizer(
+                        request['text'], add_special_tokens=False, return_offsets_mapping=True, verbose=False
+                    )
+                    send_frame(self.request, {'offsets': [list(span) for span in encoded['offset_mapping']]})
+                else:
+                    send_frame(self.request, {'exception': f"Unknown operation: {op}"})
+            except OSError:
+                return
+            except Exception as e:
+                send_frame(self.request, {'exception': str(e)})
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    """Serves one embedding backend to every API worker over a UNIX socket
+    
+    Requests from all workers are coalesced by a single EmbeddingBatcher, so
+    the model is loaded, and its memory paid for, in this process only.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, socket_path: str, backend: EmbeddingBackend, max_batch_size: int = 32,
+                 max_wait: float = 0.005):
+        # A socket left behind by a previous server would make bind fail
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+        os.chmod(socket_path, 0o600)
+        self.socket_path = socket_path
+        self.backend = backend
+        self.batcher = EmbeddingBatcher(backend, max_batch_size=max_batch_size, max_wait=max_wait)
+    
+    def status(self) -> dict:
+        status = self.backend.stats()
+        status.update({
+            'pid': os.getpid(),
+            'tokenizer': self.backend.state == "ready" and self.backend.tokenizer is not None,
+            'batcher': self.batcher.stats()
+        })
+        return status
+
+def run_embedding_server(socket_path: str, backend_name: Optional[str] = None):
+    """Load the embedding backend and serve it until the parent process exits"""
+    backend = create_embedding_backend(backend_name)
+    server = EmbeddingServer(
+        socket_path,
+        backend,
+        max_batch_size=int(os.getenv('EMBED_BATCH_MAX', '32')),
+        max_wait=float(os.getenv('EMBED_BATCH_WAIT_MS', '5')) / 1000
+    )
+    parent = os.getppid()
+    
+    def watch_parent():
+        # Never outlive the API server that started us, even if it was killed
+        while os.getppid() == parent:
+            time.sleep(2)
+        server.shutdown()
+    
+    def warm_up():
+        try:
+            backend.warm_up()
+        except Exception as e:
+            logger.error(f"Embedding server warm-up failed: {e}")
+    
+    threading.Thread(target=watch_parent, name="parent-watch", daemon=True).start()
+    threading.Thread(target=warm_up, name="embedding-warm-up", daemon=True).start()
+    logger.info(f"Embedding server ({backend.name}) listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+
+def _iter_token_spans(text: str, tokenizer=None, slab: int = 65536):
+    """Yield (start, end) character offsets of tokens, tokenizing a slab at a time"""
+    pos = 0
+    length = len(text)
+    while pos < length:
+        end = min(pos + slab, length)
+        if end < length:
+            cut = max(text.rfind(' ', pos, end), text.rfind('\n', pos, end))
+            if cut > pos:
+                end = cut
+        piece = text[pos:end]
+        if tokenizer is not None:
+            offsets = tokenizer(
+                piece, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+            )['offset_mapping']
+        else:
+            offsets = ((m.start(), m.end()) for m in re.finditer(r'\S+', piece))
+        for start, stop in offsets:
+            if stop > start:
+                yield pos + start, pos + stop
+        pos = end
+
+def iter_chunk_spans(text: str, size: int, overlap: int, unit: str = "tokens", tokenizer=None):
+    """Yield (start, end) character offsets of overlapping chunks of text
+
+    With unit="tokens" chunks hold `size` tokens from the model tokenizer (or
+    whitespace-separated words when no tokenizer is given); with unit="chars"
+    they hold up to `size` characters, preferring to break on whitespace.
+    """
+    if overlap >= size:
+        raise ValueError("Chunk overlap must be smaller than chunk size")
+
+    if unit == "chars":
+        length = len(text)
+        start = 0
+        while start < length:
+            end = min(start + size, length)
+            if end < length:
+                cut = max(text.rfind(' ', start + size * 4 // 5, end),
+                          text.rfind('\n', start + size * 4 // 5, end))
+                if cut > start:
+                    end = cut
+            yield start, end
+            if end >= length:
+                break
+            start = max(end - overlap, start + 1)
+        return
+
+    if unit != "tokens":
+        raise ValueError(f"Unknown chunk unit: {unit}")
+
+    window = []
+    pending = 0
+    for span in _iter_token_spans(text, tokenizer):
+        window.append(span)
+        pending += 1
+        if len(window) == size:
+            yield window[0][0], window[-1][1]
+            del window[:size - overlap]
+            pending = 0
+    if pending:
+        yield window[0][0], window[-1][1]
+
+def format_vector(values) -> str:
+    """Render an embedding in pgvector's text format"""
+    return '[' + ','.join(f"{v:.7g}" for v in values) + ']'
+
+# Binary COPY framing: signature, flags and header extension length, then an end-of-data marker
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+# Rows sent per COPY statement, bounding the buffer built in memory
+COPY_PAGE_ROWS = int(os.getenv('DB_COPY_PAGE_ROWS', '5000'))
+
+def pg_int4(value: Optional[int]) -> Optional[bytes]:
+    return None if value is None else struct.pack("!i", value)
+
+def pg_int8(value: Optional[int]) -> Optional[bytes]:
+    return None if value is None else struct.pack("!q", value)
+
+def notify_stored(cur, file_hashes: list = ()):
+    """Announce stored documents and their content hashes to every listening process
+    
+    The notifications are delivered when the transaction commits.
+    """
+    if not file_hashes:
+        cur.execute("SELECT pg_notify(%s, '')", (SEARCH_INVALIDATION_CHANNEL,))
+    for offset in range(0, len(file_hashes), NOTIFY_HASHES_PER_PAYLOAD):
+        payload = ",".join(file_hashes[offset:offset + NOTIFY_HASHES_PER_PAYLOAD])
+        cur.execute("SELECT pg_notify(%s, %s)", (SEARCH_INVALIDATION_CHANNEL, payload))
+
+def pg_text(value: Optional[str]) -> Optional[bytes]:
+    return None if value is None else value.encode('utf-8')
+
+def pg_vector(values) -> Optional[bytes]:
+    """Encode an embedding in pgvector's binary format: dimensions, a reserved word, float4 values"""
+    if values is None:
+        return None
+    return struct.pack(f"!hh{len(values)}f", len(values), 0, *values)
+
+def copy_binary(cur, table: str, columns: list, rows, page_size: int = COPY_PAGE_ROWS):
+    """Load rows of binary-encoded field values with COPY ... FORMAT BINARY"""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT BINARY)"
+    row_header = struct.pack("!h", len(columns))
+    null = struct.pack("!i", -1)
+    page = [PGCOPY_HEADER]
+    page_rows = 0
+    for row in rows:
+        page.append(row_header)
+        for value in row:
+            if value is None:
+                page.append(null)
+            else:
+                page.append(struct.pack("!i", len(value)))
+                page.append(value)
+        page_rows += 1
+        if page_rows >= page_size:
+            page.append(PGCOPY_TRAILER)
+            cur.copy_expert(sql, io.BytesIO(b"".join(page)))
+            page = [PGCOPY_HEADER]
+            page_rows = 0
+    if page_rows:
+        page.append(PGCOPY_TRAILER)
+        cur.copy_expert(sql, io.BytesIO(b"".join(page)))
+
+def is_serving_process() -> bool:
+    """True in the main process and in API worker processes
+    
+    Pool workers (bulk ingestion, job processes, the embedding server) are
+    helpers and skip background maintenance.
+    """
+    parent = multiprocessing.parent_process()
+    if parent is None:
+        return True
+    # Set by serve_api before uvicorn starts its workers
+    return os.getenv('API_SUPERVISOR_PID') == str(parent.pid)
 
 class BriskLearningProcessor:
     def __init__(self):
@@ -51,39 +2205,170 @@ class BriskLearningProcessor:
             'port': os.getenv('PGPORT', '5432')
         }
         
+        # Connection pool configuration
+        self.db_pool = DatabasePool(
+            self.postgres_config,
+            minconn=int(os.getenv('PG_POOL_MIN', '1')),
+            maxconn=int(os.getenv('PG_POOL_MAX', '10')),
+            timeout=float(os.getenv('PG_POOL_TIMEOUT', '30')),
+            validate_after=float(os.getenv('PG_POOL_VALIDATE_AFTER', '30'))
+        )
+        
         # Azure Storage configuration
         self.storage_account = os.getenv('AZURE_STORAGE_ACCOUNT')
         self.storage_key = os.getenv('AZURE_STORAGE_KEY')
         
-        if self.storage_account and self.storage_key:
+        # A connection string (e.g. for the Azurite emulator) takes precedence
+        self.storage_connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+        
+        # Blobs above the single-put size are uploaded as parallel blocks
+        blob_options = {
+            'max_block_size': int(os.getenv('AZURE_UPLOAD_BLOCK_SIZE', str(4 * 1024 * 1024))),
+            'max_single_put_size': int(os.getenv('AZURE_UPLOAD_SINGLE_PUT_SIZE', str(8 * 1024 * 1024)))
+        }
+        self.blob_upload_concurrency = int(os.getenv('AZURE_UPLOAD_MAX_CONCURRENCY', '4'))
+        
+        if self.storage_connection_string:
+            self.blob_client = BlobServiceClient.from_connection_string(
+                self.storage_connection_string, **blob_options
+            )
+        elif self.storage_account and self.storage_key:
             self.blob_client = BlobServiceClient(
                 account_url=f"https://{self.storage_account}.blob.core.windows.net",
-                credential=self.storage_key
+                credential=self.storage_key,
+                **blob_options
             )
         else:
             logger.warning("Azure Storage credentials not provided")
             self.blob_client = None
         
-        # ClamAV configuration
+        # Uploads run here so they overlap with extraction and embedding
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('AZURE_UPLOAD_WORKERS', '4')),
+            thread_name_prefix="blob-upload"
+        )
+        self._containers = set()
+        
+        # Reject files over 100MB by default
+        self.max_file_size = int(os.getenv('MAX_FILE_SIZE', str(100 * 1024 * 1024)))
+        
+        # ClamAV configuration; StreamMaxLength in the shipped clamd.conf matches MAX_FILE_SIZE
         self.clamav_host = os.getenv('CLAMAV_HOST', 'clamav')
         self.clamav_port = int(os.getenv('CLAMAV_PORT', '3310'))
+        if os.getenv('CLAMAV_ENABLED', 'true').lower() == 'true':
+            self.clamav = ClamdClient(
+                self.clamav_host,
+                self.clamav_port,
+                timeout=float(os.getenv('CLAMAV_TIMEOUT', '60')),
+                max_concurrency=int(os.getenv('CLAMAV_MAX_CONCURRENCY', '4')),
+                clean_cache_ttl=float(os.getenv('CLAMAV_CLEAN_CACHE_TTL', '3600')),
+                stream_max=int(os.getenv('CLAMAV_STREAM_MAX', str(self.max_file_size)))
+            )
+        else:
+            logger.warning("ClamAV scanning disabled; only size and type checks will run")
+            self.clamav = None
+        if self.clamav and self.max_file_size > self.clamav.stream_max:
+            logger.warning(f"MAX_FILE_SIZE ({self.max_file_size}) exceeds CLAMAV_STREAM_MAX "
+                           f"({self.clamav.stream_max}); larger files will fail their scan. Raise "
+                           f"StreamMaxLength in clamd.conf and CLAMAV_STREAM_MAX together")
         
         # Environment
         self.environment = os.getenv('ENVIRONMENT', 'dev')
         
-        # Initialize sentence transformer for embeddings
-        try:
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-            logger.info("Sentence transformer model loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load sentence transformer: {e}")
-            self.model = None
+        # Uploads beyond these limits are turned away before their bodies are read
+        self.upload_admission = UploadAdmission(
+            "/shared-files/incoming",
+            # Multipart boundaries and form fields come on top of the file itself
+            max_request_size=self.max_file_size + int(os.getenv('UPLOAD_FORM_OVERHEAD', '65536')),
+            max_inflight=int(os.getenv('UPLOAD_MAX_INFLIGHT', '16')),
+            max_inflight_bytes=int(os.getenv('UPLOAD_MAX_INFLIGHT_MB', '1024')) * 1024 * 1024,
+            min_free_bytes=int(os.getenv('UPLOAD_DISK_MIN_FREE_MB', '512')) * 1024 * 1024,
+            retry_after=int(os.getenv('UPLOAD_RETRY_AFTER', '10'))
+        )
+        
+        # Text extraction runs in sandboxed worker processes
+        self.text_extractor = TextExtractor(
+            workers=int(os.getenv('EXTRACT_WORKERS', '2')),
+            timeout=float(os.getenv('EXTRACT_TIMEOUT', '120')),
+            memory_limit=int(os.getenv('EXTRACT_MEMORY_LIMIT_MB', '1024')) * 1024 * 1024,
+            max_chars=int(os.getenv('EXTRACT_MAX_CHARS', '10000000')),
+            cache_dir=os.getenv('EXTRACT_CACHE_DIR', '/shared-files/.extract-cache') or None,
+            cache_max_bytes=int(os.getenv('EXTRACT_CACHE_MAX_MB', '1024')) * 1024 * 1024
+        )
+        
+        # Embedding model; loaded on first use or by the server's warm-up so startup is not blocked
+        self.embedding_backend = create_embedding_backend()
+        # Stored with every vector next to the model; bump it when chunking or preprocessing changes
+        self.embedding_version = int(os.getenv('EMBEDDING_VERSION', '1'))
+        
+        # Document chunking configuration
+        self.chunk_unit = os.getenv('CHUNK_UNIT', 'tokens')
+        self.chunk_size = int(os.getenv('CHUNK_SIZE', '200'))
+        self.chunk_overlap = int(os.getenv('CHUNK_OVERLAP', '40'))
+        self.search_candidate_multiplier = int(os.getenv('SEARCH_CANDIDATE_MULTIPLIER', '10'))
+        # Filters matching at most this many files are searched exactly instead of through the vector index
+        self.search_prefilter_max_files = int(os.getenv('SEARCH_PREFILTER_MAX_FILES', '1000'))
+        # Full-text configuration baked into the generated search_vector columns
+        self.text_search_config = os.getenv('TEXT_SEARCH_CONFIG', 'english')
+        if not re.fullmatch(r"[a-z_]+", self.text_search_config):
+            raise ValueError(f"Invalid TEXT_SEARCH_CONFIG: {self.text_search_config}")
+        # Generated full-text columns found by init_database; searches compute the missing ones per row
+        self.tsvector_columns = None
+        self.search_rrf_k = int(os.getenv('SEARCH_RRF_K', '60'))
+        
+        # Batch concurrent encode calls into single model invocations
+        self.embedding_batcher = EmbeddingBatcher(
+            self.embedding_backend,
+            max_batch_size=int(os.getenv('EMBED_BATCH_MAX', '32')),
+            max_wait=float(os.getenv('EMBED_BATCH_WAIT_MS', '5')) / 1000
+        )
+        
+        # Vector index configuration
+        self.index_manager = VectorIndexManager(
+            self,
+            index_type=os.getenv('VECTOR_INDEX_TYPE', 'ivfflat'),
+            ivfflat_min_rows=int(os.getenv('IVFFLAT_MIN_ROWS', '10000')),
+            ivfflat_rebuild_factor=float(os.getenv('IVFFLAT_REBUILD_FACTOR', '2')),
+            probes=int(os.getenv('IVFFLAT_PROBES', '10')),
+            hnsw_m=int(os.getenv('HNSW_M', '16')),
+            hnsw_ef_construction=int(os.getenv('HNSW_EF_CONSTRUCTION', '64')),
+            ef_search=int(os.getenv('HNSW_EF_SEARCH', '40')),
+            storage=os.getenv('VECTOR_INDEX_STORAGE', 'vector'),
+            rerank_multiplier=int(os.getenv('VECTOR_RERANK_MULTIPLIER', '0')) or None,
+            maintain_interval=float(os.getenv('VECTOR_INDEX_MAINTAIN_INTERVAL', '3600'))
+        )
+        
+        # Content hashes already stored, for early duplicate detection
+        self.known_hashes = KnownHashCache(
+            max_entries=int(os.getenv('DEDUP_CACHE_SIZE', '10000')),
+            bloom_bits=int(os.getenv('DEDUP_BLOOM_BITS', str(1 << 23)))
+        )
+        
+        # Repeated queries skip the model, and repeated searches the database
+        self.query_embeddings = TTLCache(
+            max_entries=int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '1000')),
+            ttl=float(os.getenv('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+        )
+        self.search_results = TTLCache(
+            max_entries=int(os.getenv('SEARCH_RESULT_CACHE_SIZE', '500')),
+            ttl=float(os.getenv('SEARCH_RESULT_CACHE_TTL', '60'))
+        )
+        # Bumped whenever documents are added; results are cached under the version they were read at
+        self.search_version = 0
+        # Results are only cached while change notifications from other processes are being received
+        self.search_invalidation_live = False
+        metrics.add_collector(self.collect_metrics)
         
-        # Initialize database
-        self.init_database()
+        # Pool workers are short-lived helpers; only serving processes migrate and warm the Bloom filter
+        if is_serving_process():
+            self.init_database()
+            # Vector indexes are managed separately: ivfflat must not be trained on an empty table
+            threading.Thread(target=self.index_manager.maintain_periodically, name="vector-indexes",
+                             daemon=True).start()
+            threading.Thread(target=self.listen_for_changes, name="search-invalidation", daemon=True).start()
     
     def get_db_connection(self):
-        """Get database connection"""
+        """Get a dedicated (unpooled) database connection"""
         try:
             conn = psycopg2.connect(**self.postgres_config)
             return conn
@@ -91,231 +2376,1283 @@ class BriskLearningProcessor:
             logger.error(f"Database connection failed: {e}")
             raise
     
-    def init_database(self):
-        """Initialize database tables and extensions"""
-        try:
-            conn = self.get_db_connection()
+    def db_connection(self):
+        """Check out a pooled database connection as a context manager"""
+        return self.db_pool.connection()
+    
+    def ping_database(self):
+        """Run a trivial query on a pooled connection; blocks while the pool is exhausted"""
+        with self.db_connection() as conn:
             cur = conn.cursor()
-            
-            # Create extensions
-            cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-            
-            # Create main processed files table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS processed_files (
-                    id SERIAL PRIMARY KEY,
-                    file_hash VARCHAR(64) UNIQUE,
-                    filename VARCHAR(255) NOT NULL,
-                    original_filename VARCHAR(255),
-                    file_type VARCHAR(100),
-                    file_size BIGINT,
-                    environment VARCHAR(50),
-                    processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    text_content TEXT,
-                    embedding vector(384),
-                    source_type VARCHAR(50),
-                    category VARCHAR(100),
-                    scan_status VARCHAR(50),
-                    scan_date TIMESTAMP,
-                    storage_url TEXT,
-                    metadata JSONB,
-                    created_by VARCHAR(100),
-                    status VARCHAR(50) DEFAULT 'processed'
-                );
-            """)
-            
-            # Create index for vector similarity search
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS processed_files_embedding_idx 
-                ON processed_files USING ivfflat (embedding vector_cosine_ops);
-            """)
-            
-            # Create file processing log table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS processing_log (
-                    id SERIAL PRIMARY KEY,
-                    file_id INTEGER REFERENCES processed_files(id),
-                    action VARCHAR(100),
-                    status VARCHAR(50),
-                    message TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    environment VARCHAR(50)
-                );
-            """)
-            
-            conn.commit()
+            cur.execute("SELECT 1")
             cur.close()
-            conn.close()
-            logger.info("Database initialized successfully")
+    
+    # Arbitrary constant identifying the schema migration advisory lock
+    SCHEMA_LOCK_ID = 738200
+    
+    # Generated full-text columns and the expressions they hold; file names rank above body text.
+    # Names are split on punctuation, which the parser would otherwise keep in one token ("q3-report.pdf")
+    TSVECTOR_COLUMNS = {
+        ('processed_files', 'search_vector'): (
+            "setweight(to_tsvector({config}, regexp_replace(coalesce({alias}original_filename, '') || ' ' || "
+            "coalesce({alias}filename, ''), '[[:punct:]]+', ' ', 'g')), 'A') || "
+            "setweight(to_tsvector({config}, left(coalesce({alias}text_content, ''), {prefix})), 'B')"
+        ),
+        ('processed_files', 'filename_vector'): (
+            "setweight(to_tsvector({config}, regexp_replace(coalesce({alias}original_filename, '') || ' ' || "
+            "coalesce({alias}filename, ''), '[[:punct:]]+', ' ', 'g')), 'A')"
+        ),
+        ('document_chunks', 'search_vector'): "setweight(to_tsvector({config}, {alias}content), 'B')"
+    }
+    
+    def tsvector_expression(self, table: str, column: str, alias: str = "",
+                            config: Optional[str] = None) -> str:
+        """SQL computing a generated full-text column; config defaults to the configured one as a literal"""
+        return self.TSVECTOR_COLUMNS[(table, column)].format(
+            config=config or f"'{self.text_search_config}'", alias=alias, prefix=SEARCH_TEXT_PREFIX
+        )
+    
+    def _load_tsvector_columns(self, cur) -> set:
+        cur.execute("""
+            SELECT table_name, column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND data_type = 'tsvector'
+        """)
+        return set(self.TSVECTOR_COLUMNS) & set(cur.fetchall())
+    
+    def _schema_objects(self, cur) -> dict:
+        """Extensions, tables, (table, column) pairs, indexes and constraints of the current schema"""
+        cur.execute("SELECT extname FROM pg_extension")
+        extensions = {row[0] for row in cur.fetchall()}
+        cur.execute("""
+            SELECT table_name, column_name FROM information_schema.columns
+            WHERE table_schema = current_schema()
+        """)
+        columns = set(cur.fetchall())
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+        indexes = {row[0] for row in cur.fetchall()}
+        cur.execute("""
+            SELECT c.conname FROM pg_constraint c JOIN pg_namespace n ON n.oid = c.connamespace
+            WHERE n.nspname = current_schema()
+        """)
+        constraints = {row[0] for row in cur.fetchall()}
+        return {
+            'extensions': extensions,
+            'tables': {table for table, _ in columns},
+            'columns': columns,
+            'indexes': indexes,
+            'constraints': constraints
+        }
+    
+    def init_database(self, rewrite: bool = False, lock_timeout: Optional[str] = None) -> list:
+        """Create missing extensions, tables, columns and indexes
+        
+        The catalog is read first and only missing objects are created, so a
+        process starting against a current schema takes no table locks, and
+        DDL gives up after lock_timeout instead of queueing searches behind
+        it. Changes that rewrite or index a populated table are only made
+        with rewrite (the migrate command, which also raises on failure);
+        otherwise they are returned as pending.
+        """
+        lock_timeout = lock_timeout or os.getenv('DB_MIGRATION_LOCK_TIMEOUT', '5s')
+        pending = []
+        try:
+            with self.db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT set_config('lock_timeout', %s, true)", (lock_timeout,))
+                # Processes starting together would only queue behind each other's DDL
+                if rewrite:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s), true", (self.SCHEMA_LOCK_ID,))
+                else:
+                    cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (self.SCHEMA_LOCK_ID,))
+                if not cur.fetchone()[-1]:
+                    logger.info("Another process is migrating the database schema")
+                    self.tsvector_columns = self._load_tsvector_columns(cur)
+                    self.index_manager.check_storage(cur)
+                    cur.close()
+                    return pending
+                schema = self._schema_objects(cur)
+                populated = set()
+                for table in ('processed_files', 'document_chunks'):
+                    if table in schema['tables']:
+                        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+                        if cur.fetchone()[0]:
+                            populated.add(table)
+                
+                def missing_column(table: str, column: str) -> bool:
+                    return (table, column) not in schema['columns']
+                
+                def may_rewrite(table: str, change: str) -> bool:
+                    # Generated columns rewrite the table and index builds block writes, both under lock
+                    if rewrite or table not in populated:
+                        return True
+                    pending.append(f"{table}: {change}")
+                    return False
+                
+                # Create extensions
+                if 'vector' not in schema['extensions']:
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+                self.index_manager.check_storage(cur)
+                
+                # Create main processed files table
+                if 'processed_files' not in schema['tables']:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS processed_files (
+                            id SERIAL PRIMARY KEY,
+                            file_hash VARCHAR(64) UNIQUE,
+                            filename VARCHAR(255) NOT NULL,
+                            original_filename VARCHAR(255),
+                            file_type VARCHAR(100),
+                            file_size BIGINT,
+                            environment VARCHAR(50),
+                            processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            text_content TEXT,
+                            embedding vector(384),
+                            source_type VARCHAR(50),
+                            category VARCHAR(100),
+                            scan_status VARCHAR(50),
+                            scan_date TIMESTAMP,
+                            storage_url TEXT,
+                            metadata JSONB,
+                            created_by VARCHAR(100),
+                            status VARCHAR(50) DEFAULT 'processed'
+                        );
+                    """)
+                
+                # Filter columns for search
+                for column in ('category', 'source_type', 'environment'):
+                    index = f"processed_files_{column}_idx"
+                    if index not in schema['indexes'] and may_rewrite('processed_files', f"index {index}"):
+                        cur.execute(f"CREATE INDEX IF NOT EXISTS {index} ON processed_files ({column})")
+
+                # Full-text search column; file names rank above body text
+                if missing_column('processed_files', 'search_vector') and \
+                        may_rewrite('processed_files', "generated column search_vector"):
+                    cur.execute(f"""
+                        ALTER TABLE processed_files ADD COLUMN IF NOT EXISTS search_vector tsvector
+                        GENERATED ALWAYS AS ({self.tsvector_expression('processed_files', 'search_vector')}) STORED;
+                    """)
+                    schema['columns'].add(('processed_files', 'search_vector'))
+                if 'processed_files_search_idx' not in schema['indexes'] and \
+                        may_rewrite('processed_files', "index processed_files_search_idx"):
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS processed_files_search_idx
+                        ON processed_files USING gin (search_vector);
+                    """)
+                # File names on their own, so chunked documents match at file level on their names only
+                if missing_column('processed_files', 'filename_vector') and \
+                        may_rewrite('processed_files', "generated column filename_vector"):
+                    cur.execute(f"""
+                        ALTER TABLE processed_files ADD COLUMN IF NOT EXISTS filename_vector tsvector
+                        GENERATED ALWAYS AS ({self.tsvector_expression('processed_files', 'filename_vector')}) STORED;
+                    """)
+                    schema['columns'].add(('processed_files', 'filename_vector'))
+                if 'processed_files_filename_idx' not in schema['indexes'] and \
+                        may_rewrite('processed_files', "index processed_files_filename_idx"):
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS processed_files_filename_idx
+                        ON processed_files USING gin (filename_vector);
+                    """)
+                
+                # Create file processing log table
+                if 'processing_log' not in schema['tables']:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS processing_log (
+                            id SERIAL PRIMARY KEY,
+                            file_id INTEGER REFERENCES processed_files(id),
+                            action VARCHAR(100),
+                            status VARCHAR(50),
+                            message TEXT,
+                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            environment VARCHAR(50)
+                        );
+                    """)
+                # Seconds spent in each stage before the file was stored
+                if missing_column('processing_log', 'stage_timings'):
+                    cur.execute("ALTER TABLE processing_log ADD COLUMN IF NOT EXISTS stage_timings JSONB")
+                
+                # Create per-chunk embedding table
+                if 'document_chunks' not in schema['tables']:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS document_chunks (
+                            id BIGSERIAL PRIMARY KEY,
+                            file_id INTEGER NOT NULL REFERENCES processed_files(id) ON DELETE CASCADE,
+                            chunk_index INTEGER NOT NULL,
+                            char_start INTEGER,
+                            char_end INTEGER,
+                            content TEXT NOT NULL,
+                            embedding vector(384),
+                            environment VARCHAR(50)
+                        );
+                    """)
+                if missing_column('document_chunks', 'search_vector') and \
+                        may_rewrite('document_chunks', "generated column search_vector"):
+                    cur.execute(f"""
+                        ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS search_vector tsvector
+                        GENERATED ALWAYS AS ({self.tsvector_expression('document_chunks', 'search_vector')}) STORED;
+                    """)
+                    schema['columns'].add(('document_chunks', 'search_vector'))
+                if 'document_chunks_search_idx' not in schema['indexes'] and \
+                        may_rewrite('document_chunks', "index document_chunks_search_idx"):
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS document_chunks_search_idx
+                        ON document_chunks USING gin (search_vector);
+                    """)
+                self.tsvector_columns = set(self.TSVECTOR_COLUMNS) & schema['columns']
+                
+                # Model and version of every stored vector. Rows from before versioning were made by
+                # EMBEDDING_MODEL; a constant default is added without rewriting the tables
+                legacy_model = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+                for table in ('processed_files', 'document_chunks'):
+                    if missing_column(table, 'embedding_model'):
+                        cur.execute(f"""
+                            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(200)
+                            NOT NULL DEFAULT %s
+                        """, (legacy_model,))
+                    if missing_column(table, 'embedding_version'):
+                        cur.execute(f"""
+                            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding_version INTEGER NOT NULL DEFAULT 1
+                        """)
+                # A document keeps one set of chunks per version while it is re-embedded
+                if 'document_chunks_version_key' not in schema['indexes'] and \
+                        may_rewrite('document_chunks', "index document_chunks_version_key"):
+                    cur.execute("""
+                        CREATE UNIQUE INDEX IF NOT EXISTS document_chunks_version_key
+                        ON document_chunks (file_id, embedding_model, embedding_version, chunk_index);
+                    """)
+                    schema['indexes'].add('document_chunks_version_key')
+                # The old per-file key only goes once its replacement exists
+                if 'document_chunks_file_id_chunk_index_key' in schema['constraints'] and \
+                        'document_chunks_version_key' in schema['indexes']:
+                    cur.execute("""
+                        ALTER TABLE document_chunks DROP CONSTRAINT IF EXISTS document_chunks_file_id_chunk_index_key
+                    """)
+                
+                # Create background job table
+                if 'processing_jobs' not in schema['tables']:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS processing_jobs (
+                            id VARCHAR(36) PRIMARY KEY,
+                            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                            stage VARCHAR(50),
+                            progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+                            file_path TEXT NOT NULL,
+                            file_info JSONB,
+                            file_hash VARCHAR(64),
+                            original_filename VARCHAR(255),
+                            category VARCHAR(100),
+                            source_type VARCHAR(50),
+                            created_by VARCHAR(100),
+                            result JSONB,
+                            error TEXT,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            environment VARCHAR(50),
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            started_at TIMESTAMP,
+                            finished_at TIMESTAMP
+                        );
+                    """)
+                if 'processing_jobs_status_idx' not in schema['indexes']:
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS processing_jobs_status_idx
+                        ON processing_jobs (environment, status);
+                    """)
+                # At most one in-flight job per content hash
+                if 'processing_jobs_inflight_hash_idx' not in schema['indexes']:
+                    cur.execute("""
+                        CREATE UNIQUE INDEX IF NOT EXISTS processing_jobs_inflight_hash_idx
+                        ON processing_jobs (file_hash) WHERE status IN ('queued', 'running');
+                    """)
+                
+                cur.close()
+            if pending:
+                logger.warning(f"Database schema changes pending on populated tables; run the migrate command: "
+                               f"{'; '.join(pending)}")
+            else:
+                logger.info("Database initialized successfully")
             
         except Exception as e:
             logger.error(f"Database initialization failed: {e}")
+            if rewrite:
+                raise
+        return pending
+    
+    def load_known_hashes(self):
+        """Load every stored hash into the Bloom filter"""
+        try:
+            count = 0
+            with self.db_connection() as conn:
+                cur = conn.cursor(name='known_hashes')
+                cur.itersize = 10000
+                cur.execute("SELECT file_hash FROM processed_files WHERE file_hash IS NOT NULL")
+                for (file_hash,) in cur:
+                    self.known_hashes.add(file_hash)
+                    count += 1
+                cur.close()
+            self.known_hashes.ready = True
+            logger.info(f"Loaded {count} known file hashes")
+        except Exception as e:
+            logger.error(f"Failed to load known file hashes: {e}")
+    
+    def collect_metrics(self) -> list:
+        """Pool, cache, extractor and embedding gauges for /metrics"""
+        components = [
+            ('db_pool', self.db_pool.stats()),
+            ('embedding_batcher', self.embedding_batcher.stats()),
+            ('text_extractor', self.text_extractor.stats()),
+            ('dedup_cache', self.known_hashes.stats()),
+            ('query_embedding_cache', self.query_embeddings.stats()),
+            ('search_result_cache', self.search_results.stats()),
+            ('upload_admission', self.upload_admission.stats())
+        ]
+        if self.clamav:
+            components.append(('clamav', self.clamav.stats()))
+        gauges = []
+        for component, stats in components:
+            gauges.extend(Metrics.stats_gauges(component, stats))
+        backend = self.embedding_backend.stats()
+        gauges.append(('embedding_model_ready', {'backend': backend['backend']}, float(self.embeddings_ready)))
+        if backend['load_seconds'] is not None:
+            gauges.append(('embedding_model_load_seconds', {'backend': backend['backend']}, backend['load_seconds']))
+        return gauges
+    
+    def invalidate_search_results(self):
+        """Make every cached search result stale"""
+        self.search_version += 1
+        self.search_results.clear()
+    
+    def listen_for_changes(self):
+        """Invalidate cached search results and learn stored hashes whenever any process commits documents
+        
+        The Bloom filter is (re)loaded after each LISTEN, so no hash stored
+        in between is missed, and is not trusted while disconnected.
+        """
+        while True:
+            conn = None
+            try:
+                conn = self.get_db_connection()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {SEARCH_INVALIDATION_CHANNEL}")
+                cur.close()
+                # Anything committed while we were not listening is unknown
+                self.load_known_hashes()
+                self.invalidate_search_results()
+                self.search_invalidation_live = True
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        for notify in conn.notifies:
+                            for file_hash in notify.payload.split(","):
+                                if file_hash:
+                                    self.known_hashes.add(file_hash)
+                        conn.notifies.clear()
+                        self.invalidate_search_results()
+            except Exception as e:
+                self.search_invalidation_live = False
+                self.known_hashes.ready = False
+                self.invalidate_search_results()
+                logger.warning(f"Search cache invalidation listener failed, retrying: {e}")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+    
+    def find_existing_file(self, file_hash: str) -> Optional[int]:
+        """Return the id of an already stored file with this content hash"""
+        file_id = self.known_hashes.get(file_hash)
+        if file_id is not None:
+            return file_id
+        if not self.known_hashes.might_contain(file_hash):
+            return None
+        
+        with self.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM processed_files WHERE file_hash = %s", (file_hash,))
+            row = cur.fetchone()
+            cur.close()
+        
+        if row:
+            self.known_hashes.add(file_hash, row[0])
+            return row[0]
+        return None
     
     def calculate_file_hash(self, file_path: str) -> str:
         """Calculate SHA-256 hash of file"""
         hash_sha256 = hashlib.sha256()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()
     
-    def scan_file_with_clamav(self, file_path: str) -> tuple[bool, str]:
-        """Scan file using ClamAV daemon"""
+    def _ingest(self, source) -> dict:
+        """Hash, sniff and measure a stream in one pass"""
+        digest = StreamDigest()
+        for chunk in iter(lambda: source.read(READ_BUFFER_SIZE), b""):
+            digest.update(chunk)
+        metrics.inc('bytes_total', digest.file_size, stage='hash')
+        return digest.result()
+    
+    def ingest_file(self, file_path: str) -> dict:
+        """Hash, sniff and measure a file already on disk in a single read"""
+        with open(file_path, "rb", buffering=0) as f:
+            return self._ingest(f)
+    
+    def scan_file_with_clamav(self, file_path: str, file_info: Optional[dict] = None) -> tuple[bool, str]:
+        """Scan file using ClamAV daemon; file_info avoids re-reading size and type
+        
+        Only files that fail the checks or that clamd reports infected are not
+        clean. A scan that could not complete raises ClamdError, so the file
+        fails processing instead of being quarantined; the job reports the
+        error and its upload is deleted.
+        """
         try:
-            # For now, simulate ClamAV scanning since the actual integration needs more setup
-            # In production, you would use clamd or make HTTP requests to ClamAV
-            
-            # Check file size (reject files over 100MB)
-            file_size = os.path.getsize(file_path)
-            if file_size > 100 * 1024 * 1024:
+            # Check file size
+            file_size = file_info['file_size'] if file_info else os.path.getsize(file_path)
+            if file_size > self.max_file_size:
                 return False, "File too large"
             
             # Check file type
-            file_type = magic.from_file(file_path, mime=True)
+            file_type = file_info['file_type'] if file_info else magic.from_file(file_path, mime=True)
             suspicious_types = ['application/x-executable', 'application/x-dosexec']
             if file_type in suspicious_types:
                 return False, "Suspicious file type"
             
-            # Simulate successful scan
-            logger.info(f"File {file_path} passed virus scan (simulated)")
-            return True, "Clean"
+            if not self.clamav:
+                logger.info(f"File {file_path} passed size and type checks (ClamAV disabled)")
+                return True, "Clean"
+            
+            # Stream the file to clamd
+            is_clean, message = self.clamav.scan_file(
+                file_path,
+                file_hash=file_info['file_hash'] if file_info else None,
+                file_size=file_size
+            )
+            if is_clean:
+                logger.info(f"File {file_path} passed virus scan")
+            return is_clean, message
             
         except Exception as e:
+            # Counted as a scan stage error by the caller's metrics.stage
             logger.error(f"ClamAV scan failed for {file_path}: {e}")
-            return False, f"Scan error: {str(e)}"
+            if isinstance(e, ClamdError):
+                raise
+            raise ClamdError(f"Scan error: {e}") from e
     
-    def extract_text(self, file_path: str) -> str:
-        """Extract text from various file types"""
+    def extract_text(self, file_path: str, file_type: Optional[str] = None, file_hash: Optional[str] = None) -> str:
+        """Extract text with the extractor registered for the file type
+        
+        Extraction runs in a sandboxed worker process; with file_hash, text
+        already extracted from identical content is reused.
+        """
         try:
-            file_type = magic.from_file(file_path, mime=True)
-            
-            if file_type.startswith('text/'):
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    return f.read()
-            elif file_type == 'application/pdf':
-                # For PDF extraction, you'd typically use PyPDF2 or similar
-                # For now, return placeholder
-                return f"[PDF content from {os.path.basename(file_path)}]"
-            elif file_type.startswith('image/'):
-                # For OCR, you'd use pytesseract
-                return f"[Image content from {os.path.basename(file_path)}]"
-            else:
-                return f"[Binary file: {os.path.basename(file_path)}]"
-                
+            if file_type is None:
+                file_type = magic.from_file(file_path, mime=True)
+            text = self.text_extractor.extract(file_path, file_type, file_hash)
+            metrics.inc('extracted_characters_total', len(text))
+            return text
         except Exception as e:
+            metrics.error('extract', e)
             logger.error(f"Text extraction failed for {file_path}: {e}")
             return f"[Text extraction failed: {str(e)}]"
     
+    @property
+    def embeddings_available(self) -> bool:
+        """False only once the embedding model has failed to load"""
+        return self.embedding_backend.state != "failed"
+    
+    @property
+    def embeddings_ready(self) -> bool:
+        return self.embedding_backend.state == "ready"
+    
+    @property
+    def embedding_model(self) -> Optional[str]:
+        return self.embedding_backend.model_id
+    
+    def embedding_identity(self, required: bool = True) -> tuple[str, int]:
+        """(model, version) recorded with new vectors; searches compare only vectors of the same pair
+        
+        Raises RuntimeError if the model is unknown (a remote backend whose
+        server is unreachable), unless required is False.
+        """
+        model = self.embedding_model
+        if model is None:
+            if required:
+                raise RuntimeError(f"Embedding model of the {self.embedding_backend.name} backend is unknown")
+            # Only rows without vectors are stored under this label
+            model = "unknown"
+        return model, self.embedding_version
+    
+    def warm_up_embeddings(self):
+        """Load the embedding model ahead of the first request"""
+        try:
+            self.embedding_backend.warm_up()
+        except Exception as e:
+            logger.error(f"Embedding warm-up failed: {e}")
+    
     def generate_embeddings(self, text: str) -> Optional[list]:
         """Generate vector embeddings from text"""
-        if not self.model:
-            logger.warning("Sentence transformer model not available")
+        if not self.embeddings_available:
+            logger.warning("Embedding model not available")
             return None
         
         try:
-            embedding = self.model.encode(text)
-            return embedding.tolist()
+            return self.embedding_batcher.encode(text)
         except Exception as e:
+            metrics.error('embed', e)
             logger.error(f"Embedding generation failed: {e}")
             return None
     
-    def upload_to_azure_storage(self, file_path: str, container_name: str = "processed") -> Optional[str]:
-        """Upload file to Azure Storage"""
+    async def generate_embeddings_async(self, text: str) -> Optional[list]:
+        """Generate vector embeddings without blocking the event loop"""
+        if not self.embeddings_available:
+            logger.warning("Embedding model not available")
+            return None
+        
+        try:
+            return await self.embedding_batcher.encode_async(text)
+        except Exception as e:
+            metrics.error('embed', e)
+            logger.error(f"Embedding generation failed: {e}")
+            return None
+    
+    async def embed_query_async(self, query: str) -> Optional[list]:
+        """Embed a search query, reusing the embedding of a recently seen identical query"""
+        cached = self.query_embeddings.get(query)
+        if cached is not None:
+            return list(cached)
+        embedding = await self.generate_embeddings_async(query)
+        if embedding:
+            # float32 keeps each entry at 1.5 KB
+            self.query_embeddings.put(query, array('f', embedding))
+        return embedding
+    
+    def chunk_text(self, text: str) -> list:
+        """Split text into overlapping (start, end) character spans"""
+        tokenizer = self.embedding_backend.tokenizer if self.chunk_unit == "tokens" else None
+        return list(iter_chunk_spans(
+            text, self.chunk_size, self.chunk_overlap, unit=self.chunk_unit, tokenizer=tokenizer
+        ))
+    
+    def embed_document(self, text: str) -> tuple[Optional[list], list]:
+        """Embed every chunk of a document
+
+        Returns the document embedding (the normalised mean of its chunk
+        embeddings) and a list of chunk dicts with character offsets and
+        embeddings.
+        """
+        if not self.embeddings_available:
+            logger.warning("Embedding model not available")
+            return None, []
+        
+        try:
+            spans = self.chunk_text(text)
+            chunks = []
+            totals = None
+            # Submit a few batches at a time so huge documents don't queue every chunk at once
+            window = self.embedding_batcher.max_batch_size * 4
+            for offset in range(0, len(spans), window):
+                group = spans[offset:offset + window]
+                vectors = self.embedding_batcher.encode_many([text[start:end] for start, end in group])
+                for (start, end), vector in zip(group, vectors):
+                    chunks.append({
+                        'chunk_index': len(chunks),
+                        'char_start': start,
+                        'char_end': end,
+                        'embedding': array('f', vector)
+                    })
+                    if totals is None:
+                        totals = list(vector)
+                    else:
+                        for i, value in enumerate(vector):
+                            totals[i] += value
+            
+            if not chunks:
+                return None, []
+            norm = math.sqrt(sum(value * value for value in totals)) or 1.0
+            return [value / norm for value in totals], chunks
+        except Exception as e:
+            metrics.error('embed', e)
+            logger.error(f"Embedding generation failed: {e}")
+            return None, []
+    
+    def blob_name_for(self, file_hash: str) -> str:
+        """Content-addressed blob name, so identical content is stored once"""
+        return f"{self.environment}/sha256/{file_hash[:2]}/{file_hash}"
+    
+    def _ensure_container(self, container_name: str):
+        if container_name in self._containers:
+            return
+        try:
+            self.blob_client.create_container(container_name)
+        except ResourceExistsError:
+            pass
+        self._containers.add(container_name)
+    
+    def upload_to_azure_storage(self, file_path: str, container_name: str = "processed",
+                                file_info: Optional[dict] = None) -> Optional[str]:
+        """Upload file to Azure Storage, skipping content that is already stored"""
         if not self.blob_client:
             logger.warning("Azure Storage client not available")
             return None
         
+        timings = file_info.get('stage_timings') if file_info else None
         try:
-            filename = os.path.basename(file_path)
-            blob_name = f"{self.environment}/{datetime.now().strftime('%Y/%m/%d')}/{filename}"
-            
-            blob_client = self.blob_client.get_blob_client(
-                container=container_name, 
-                blob=blob_name
-            )
-            
-            with open(file_path, "rb") as data:
-                blob_client.upload_blob(data, overwrite=True)
-            
-            return blob_client.url
-            
+            with metrics.stage('upload', timings):
+                return self._upload_blob(file_path, container_name, file_info)
         except Exception as e:
             logger.error(f"Azure Storage upload failed: {e}")
             return None
     
-    def store_in_database(self, file_info: dict, text_content: str, embedding: Optional[list]) -> Optional[int]:
-        """Store file information and embeddings in PostgreSQL"""
-        try:
-            conn = self.get_db_connection()
-            cur = conn.cursor()
-            
-            # Check if file already exists
+    def _upload_blob(self, file_path: str, container_name: str, file_info: Optional[dict]) -> str:
+        file_hash = file_info['file_hash'] if file_info else self.calculate_file_hash(file_path)
+
+        blob_client = self.blob_client.get_blob_client(
+            container=container_name,
+            blob=self.blob_name_for(file_hash)
+        )
+
+        if blob_client.exists():
+            logger.info(f"Blob for {file_hash} already exists, skipping upload")
+            return blob_client.url
+
+        self._ensure_container(container_name)
+
+        upload_options = {}
+        if file_info:
+            upload_options['content_settings'] = ContentSettings(content_type=file_info['file_type'])
+            if file_info.get('original_filename'):
+                upload_options['metadata'] = {'original_filename': quote(file_info['original_filename'])}
+
+        with open(file_path, "rb") as data:
+            length = os.fstat(data.fileno()).st_size
+            try:
+                blob_client.upload_blob(
+                    data,
+                    length=length,
+                    overwrite=False,
+                    max_concurrency=self.blob_upload_concurrency,
+                    **upload_options
+                )
+            except ResourceExistsError:
+                # Uploaded concurrently by another worker; the content is identical
+                pass
+        metrics.inc('bytes_total', length, stage='upload')
+
+        return blob_client.url
+    
+    def submit_upload(self, file_path: str, container_name: str = "processed",
+                      file_info: Optional[dict] = None) -> Future:
+        """Start upload_to_azure_storage in the background; the future resolves to the URL"""
+        return self.upload_executor.submit(self.upload_to_azure_storage, file_path, container_name, file_info)
+    
+    def _insert_file(self, cur, file_info: dict, text_content: str, embedding: Optional[list],
+                     chunks: Optional[list] = None) -> tuple[int, bool]:
+        """Insert a file, its log row and its chunks on an open cursor; returns (file_id, created)"""
+        # Check if file already exists
+        cur.execute(
+            "SELECT id FROM processed_files WHERE file_hash = %s",
+            (file_info['file_hash'],)
+        )
+        existing = cur.fetchone()
+        
+        if existing:
+            return existing[0], False
+        
+        # Insert new record; a concurrent insert of the same content wins the race
+        embedding_model, embedding_version = self.embedding_identity(required=embedding is not None)
+        cur.execute("""
+            INSERT INTO processed_files 
+            (file_hash, filename, original_filename, file_type, file_size, 
+             environment, text_content, embedding, source_type, category, 
+             scan_status, scan_date, storage_url, metadata, created_by,
+             embedding_model, embedding_version)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (file_hash) DO NOTHING
+            RETURNING id
+        """, (
+            file_info['file_hash'],
+            file_info['filename'],
+            file_info.get('original_filename', file_info['filename']),
+            file_info['file_type'],
+            file_info['file_size'],
+            self.environment,
+            text_content,
+            embedding,
+            file_info.get('source_type', 'upload'),
+            file_info.get('category', 'document'),
+            file_info.get('scan_status', 'clean'),
+            datetime.now(),
+            file_info.get('storage_url'),
+            json.dumps(file_info.get('metadata', {})),
+            file_info.get('created_by', 'system'),
+            embedding_model,
+            embedding_version
+        ))
+        
+        inserted = cur.fetchone()
+        if not inserted:
             cur.execute(
                 "SELECT id FROM processed_files WHERE file_hash = %s",
                 (file_info['file_hash'],)
             )
-            existing = cur.fetchone()
+            return cur.fetchone()[0], False
+        file_id = inserted[0]
+        
+        # Log the processing
+        cur.execute("""
+            INSERT INTO processing_log (file_id, action, status, message, environment, stage_timings)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (
+            file_id,
+            'file_processed',
+            'success',
+            f"File {file_info['filename']} processed successfully",
+            self.environment,
+            json.dumps(file_info['stage_timings']) if file_info.get('stage_timings') else None
+        ))
+        
+        # Store chunk embeddings
+        if chunks:
+            self._copy_chunks(cur, [(file_id, text_content, chunks)])
+        
+        # Delivered to every listening process when the transaction commits
+        notify_stored(cur, [file_info['file_hash']])
+        
+        return file_id, True
+    
+    def _copy_chunks(self, cur, documents: list):
+        """COPY the chunks of (file_id, text_content, chunks) documents in binary format"""
+        environment = pg_text(self.environment)
+        embedding_model, embedding_version = self.embedding_identity()
+        embedding_model = pg_text(embedding_model)
+        embedding_version = pg_int4(embedding_version)
+        copy_binary(cur, "document_chunks", [
+            'file_id', 'chunk_index', 'char_start', 'char_end', 'content', 'embedding', 'environment',
+            'embedding_model', 'embedding_version'
+        ], (
+            (
+                pg_int4(file_id),
+                pg_int4(chunk['chunk_index']),
+                pg_int4(chunk['char_start']),
+                pg_int4(chunk['char_end']),
+                pg_text(text_content[chunk['char_start']:chunk['char_end']]),
+                pg_vector(chunk['embedding']),
+                environment,
+                embedding_model,
+                embedding_version
+            )
+            for file_id, text_content, chunks in documents
+            for chunk in chunks
+        ))
+    
+    def store_in_database(self, file_info: dict, text_content: str, embedding: Optional[list],
+                          chunks: Optional[list] = None) -> Optional[int]:
+        """Store file information, embeddings and chunk embeddings in PostgreSQL"""
+        try:
+            with self.db_connection() as conn:
+                cur = conn.cursor()
+                file_id, created = self._insert_file(cur, file_info, text_content, embedding, chunks)
+                cur.close()
             
-            if existing:
+            self.known_hashes.add(file_info['file_hash'], file_id)
+            if created:
+                self.invalidate_search_results()
+                logger.info(f"Stored file {file_info['filename']} in database with ID {file_id}")
+            else:
                 logger.info(f"File {file_info['filename']} already processed")
+            return file_id
+            
+        except Exception as e:
+            metrics.error('store', e)
+            logger.error(f"Database storage failed: {e}")
+            return None
+    
+    def store_many(self, records: list) -> list:
+        """Store prepared files with a few bulk statements in one transaction
+
+        Each record holds file_info, text_content, embedding and chunks as
+        returned by prepare_file. File rows are binary-COPYed into a staging
+        table and inserted with ON CONFLICT (file_hash) DO NOTHING, log rows
+        go in with one multi-row INSERT and chunks are binary-COPYed.
+
+        Returns one {'file_id', 'status'} dict per record, where status is
+        'new', 'duplicate' or 'failed'. If the batch fails, the files are
+        stored one by one instead.
+        """
+        if not records:
+            return []
+        
+        try:
+            with metrics.stage('store_batch'), self.db_connection() as conn:
+                cur = conn.cursor()
+                stored = self._store_batch(cur, records)
                 cur.close()
-                conn.close()
-                return existing[0]
+        except Exception as e:
+            logger.warning(f"Batch storage of {len(records)} files failed, storing individually: {e}")
+            stored = []
+            for r in records:
+                try:
+                    with self.db_connection() as conn:
+                        cur = conn.cursor()
+                        file_id, created = self._insert_file(
+                            cur, r['file_info'], r['text_content'], r['embedding'], r['chunks']
+                        )
+                        cur.close()
+                    stored.append({'file_id': file_id, 'status': 'new' if created else 'duplicate'})
+                except Exception as e:
+                    metrics.error('store', e)
+                    logger.error(f"Database storage failed for {r['file_info']['filename']}: {e}")
+                    stored.append({'file_id': None, 'status': 'failed'})
+        
+        for record, outcome in zip(records, stored):
+            if outcome['file_id']:
+                self.known_hashes.add(record['file_info']['file_hash'], outcome['file_id'])
+        new_count = sum(1 for outcome in stored if outcome['status'] == 'new')
+        if new_count:
+            self.invalidate_search_results()
+        logger.info(f"Stored batch of {len(records)} files ({new_count} new)")
+        return stored
+    
+    def _store_batch(self, cur, records: list) -> list:
+        # Only the first record of each hash is inserted; repeats resolve to its id
+        first_by_hash = {}
+        for index, r in enumerate(records):
+            first_by_hash.setdefault(r['file_info']['file_hash'], index)
+        unique = sorted(first_by_hash.values())
+        
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS staging_files (
+                batch_index INTEGER,
+                file_hash VARCHAR(64),
+                filename VARCHAR(255),
+                original_filename VARCHAR(255),
+                file_type VARCHAR(100),
+                file_size BIGINT,
+                text_content TEXT,
+                embedding vector,
+                source_type VARCHAR(50),
+                category VARCHAR(100),
+                scan_status VARCHAR(50),
+                scan_date TEXT,
+                storage_url TEXT,
+                metadata TEXT,
+                created_by VARCHAR(100)
+            ) ON COMMIT DELETE ROWS
+        """)
+        scan_date = pg_text(datetime.now().isoformat())
+        copy_binary(cur, "staging_files", [
+            'batch_index', 'file_hash', 'filename', 'original_filename', 'file_type', 'file_size',
+            'text_content', 'embedding', 'source_type', 'category', 'scan_status', 'scan_date',
+            'storage_url', 'metadata', 'created_by'
+        ], (
+            (
+                pg_int4(index),
+                pg_text(info['file_hash']),
+                pg_text(info['filename']),
+                pg_text(info.get('original_filename', info['filename'])),
+                pg_text(info['file_type']),
+                pg_int8(info['file_size']),
+                pg_text(records[index]['text_content']),
+                pg_vector(records[index]['embedding']),
+                pg_text(info.get('source_type', 'upload')),
+                pg_text(info.get('category', 'document')),
+                pg_text(info.get('scan_status', 'clean')),
+                scan_date,
+                pg_text(info.get('storage_url')),
+                pg_text(json.dumps(info.get('metadata', {}))),
+                pg_text(info.get('created_by', 'system'))
+            )
+            for index in unique
+            for info in (records[index]['file_info'],)
+        ))
+        
+        cur.execute("""
+            INSERT INTO processed_files 
+            (file_hash, filename, original_filename, file_type, file_size, 
+             environment, text_content, embedding, source_type, category, 
+             scan_status, scan_date, storage_url, metadata, created_by,
+             embedding_model, embedding_version)
+            SELECT file_hash, filename, original_filename, file_type, file_size,
+                   %s, text_content, embedding, source_type, category,
+                   scan_status, scan_date::timestamp, storage_url, metadata::jsonb, created_by,
+                   %s, %s
+            FROM staging_files
+            ORDER BY batch_index
+            ON CONFLICT (file_hash) DO NOTHING
+            RETURNING id, file_hash
+        """, (self.environment,) + self.embedding_identity(
+            required=any(records[index]['embedding'] is not None for index in unique)
+        ))
+        new_ids = dict((file_hash, file_id) for file_id, file_hash in cur.fetchall())
+        
+        ids = dict(new_ids)
+        missing = [file_hash for file_hash in first_by_hash if file_hash not in new_ids]
+        if missing:
+            cur.execute(
+                "SELECT id, file_hash FROM processed_files WHERE file_hash = ANY(%s)",
+                (missing,)
+            )
+            ids.update((file_hash, file_id) for file_id, file_hash in cur.fetchall())
+        
+        inserted = [records[index] for index in unique if records[index]['file_info']['file_hash'] in new_ids]
+        if inserted:
+            # Log the processing
+            execute_values(cur, """
+                INSERT INTO processing_log (file_id, action, status, message, environment, stage_timings)
+                VALUES %s
+            """, [
+                (
+                    new_ids[r['file_info']['file_hash']],
+                    'file_processed',
+                    'success',
+                    f"File {r['file_info']['filename']} processed successfully",
+                    self.environment,
+                    json.dumps(r['file_info']['stage_timings']) if r['file_info'].get('stage_timings') else None
+                )
+                for r in inserted
+            ], page_size=1000)
             
-            # Insert new record
-            cur.execute("""
-                INSERT INTO processed_files 
-                (file_hash, filename, original_filename, file_type, file_size, 
-                 environment, text_content, embedding, source_type, category, 
-                 scan_status, scan_date, storage_url, metadata, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                file_info['file_hash'],
-                file_info['filename'],
-                file_info.get('original_filename', file_info['filename']),
-                file_info['file_type'],
-                file_info['file_size'],
-                self.environment,
-                text_content,
-                embedding,
-                file_info.get('source_type', 'upload'),
-                file_info.get('category', 'document'),
-                file_info.get('scan_status', 'clean'),
-                datetime.now(),
-                file_info.get('storage_url'),
-                json.dumps(file_info.get('metadata', {})),
-                file_info.get('created_by', 'system')
-            ))
+            # Store chunk embeddings
+            self._copy_chunks(cur, [
+                (new_ids[r['file_info']['file_hash']], r['text_content'], r['chunks'])
+                for r in inserted if r['chunks']
+            ])
             
-            file_id = cur.fetchone()[0]
+            notify_stored(cur, [r['file_info']['file_hash'] for r in inserted])
+        
+        return [
+            {
+                'file_id': ids[r['file_info']['file_hash']],
+                'status': 'new' if (
+                    r['file_info']['file_hash'] in new_ids and first_by_hash[r['file_info']['file_hash']] == index
+                ) else 'duplicate'
+            }
+            for index, r in enumerate(records)
+        ]
+    
+    SEARCH_FILTERS = ('category', 'source_type', 'environment')
+    SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+    
+    def search_documents(self, query_embedding: Optional[list], limit: int = 5, probes: Optional[int] = None,
+                         ef_search: Optional[int] = None, filters: Optional[dict] = None,
+                         offset: int = 0, query_text: Optional[str] = None, mode: str = "vector",
+                         vector_weight: float = 1.0, lexical_weight: float = 1.0) -> list:
+        """Rank documents by their best matching chunk
+
+        mode 'vector' ranks chunks by cosine distance, 'lexical' by full-text
+        rank of query_text, and 'hybrid' runs both in one statement and fuses
+        them with reciprocal rank fusion weighted by vector_weight and
+        lexical_weight. Only chunks and embeddings of the configured model and
+        embedding version take part. Documents stored before chunking was
+        introduced have no chunks and are ranked on their document embedding
+        and text instead.
+        probes and ef_search override the index search settings for this
+        query. filters restricts results by category, source_type and
+        environment; offset skips that many documents for pagination.
+        """
+        if mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        use_vector = mode != "lexical"
+        use_lexical = mode != "vector"
+
+        filters = {key: value for key, value in (filters or {}).items()
+                   if key in self.SEARCH_FILTERS and value is not None}
+        window = offset + limit
+        candidates = window * self.search_candidate_multiplier
+        params = dict(filters, query=format_vector(query_embedding) if use_vector else None,
+                      text=query_text, config=self.text_search_config, candidates=candidates,
+                      window=window, limit=limit, offset=offset,
+                      rrf_k=self.search_rrf_k, vector_weight=vector_weight, lexical_weight=lexical_weight,
+                      embedding_model=self.embedding_model, embedding_version=self.embedding_version)
+        file_filter = " AND ".join(f"f.{key} = %({key})s" for key in filters) or "TRUE"
+        # Vectors of other models or versions (kept while a backfill runs) are never compared.
+        # Lexical searches may run before a remote model is known; they then match any version
+        chunk_version = "TRUE"
+        file_version = "TRUE"
+        if params['embedding_model'] is not None:
+            chunk_version = "c.embedding_model = %(embedding_model)s AND c.embedding_version = %(embedding_version)s"
+            file_version = "f.embedding_model = %(embedding_model)s AND f.embedding_version = %(embedding_version)s"
+        file_join = "JOIN processed_files f ON f.id = c.file_id" if filters else ""
+        # ORDER BY on the bare distance lets the planner walk the vector index;
+        # adding 0 forces an exact sort over the pre-filtered rows
+        chunk_order = "c.embedding <=> %(query)s::vector"
+        tsquery = "websearch_to_tsquery(%(config)s::regconfig, %(text)s)"
+        
+        with self.db_connection() as conn:
+            cur = conn.cursor()
+            if use_lexical and self.tsvector_columns is None:
+                self.tsvector_columns = self._load_tsvector_columns(cur)
             
-            # Log the processing
-            cur.execute("""
-                INSERT INTO processing_log (file_id, action, status, message, environment)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (
-                file_id,
-                'file_processed',
-                'success',
-                f"File {file_info['filename']} processed successfully",
-                self.environment
-            ))
+            def tsvector(table: str, column: str, alias: str) -> str:
+                # Computed per row, without an index, until the migrate command has added the column
+                if (table, column) in self.tsvector_columns:
+                    return f"{alias}{column}"
+                return self.tsvector_expression(table, column, alias, config="%(config)s::regconfig")
             
-            conn.commit()
-            cur.close()
-            conn.close()
+            exact = False
+            if filters:
+                cur.execute(f"""
+                    SELECT count(*) FROM (
+                        SELECT 1 FROM processed_files f WHERE {file_filter} LIMIT %(cap)s
+                    ) matching
+                """, dict(params, cap=self.search_prefilter_max_files + 1))
+                matching = cur.fetchone()[0]
+                if matching == 0:
+                    cur.close()
+                    return []
+                if matching <= self.search_prefilter_max_files:
+                    exact = True
+                    chunk_order = f"({chunk_order}) + 0"
             
-            logger.info(f"Stored file {file_info['filename']} in database with ID {file_id}")
-            return file_id
+            chunk_source = f"""document_chunks c
+                     {file_join}
+                     WHERE c.embedding IS NOT NULL AND {chunk_version} AND {file_filter}"""
+            file_source = f"""processed_files f
+                     WHERE f.embedding IS NOT NULL AND {file_version} AND {file_filter}
+                       AND NOT EXISTS (SELECT 1 FROM document_chunks c WHERE c.file_id = f.id AND {chunk_version})"""
+            scanned = candidates
+            coarse = self.index_manager.coarse_distance
+            if coarse("c.embedding", "%(query)s") and not exact:
+                # Compact storage: the index ranks quantized vectors (the coarse pass), then the
+                # best coarse candidates are re-ranked exactly on the full-precision vectors
+                multiplier = self.index_manager.rerank_multiplier
+                params.update(coarse_candidates=candidates * multiplier, coarse_window=window * multiplier)
+                scanned = candidates * multiplier
+                chunk_source = f"""(SELECT c.file_id, c.chunk_index, c.content, c.embedding
+                      FROM {chunk_source}
+                      ORDER BY {coarse("c.embedding", "%(query)s")}
+                      LIMIT %(coarse_candidates)s) c"""
+                chunk_order = "distance"
+                file_source = f"""(SELECT f.id, f.text_content, f.embedding
+                      FROM {file_source}
+                      ORDER BY {coarse("f.embedding", "%(query)s")}
+                      LIMIT %(coarse_window)s) f"""
+            if use_vector:
+                # Broad filters, and rows of other embedding versions during a backfill, are rejected
+                # after the index scan; let it keep scanning past them
+                self.index_manager.apply_search_settings(cur, probes, ef_search, scanned, iterative=True)
             
-        except Exception as e:
-            logger.error(f"Database storage failed: {e}")
-            return None
+            # substr() detoasts only the leading slice, so full texts never leave the table
+            ctes = []
+            if use_vector:
+                ctes.append(f"""
+                vector_candidates AS (
+                    (SELECT c.file_id, c.chunk_index, substr(c.content, 1, 201) AS preview,
+                            c.embedding <=> %(query)s::vector AS distance
+                     FROM {chunk_source}
+                     ORDER BY {chunk_order}
+                     LIMIT %(candidates)s)
+                    UNION ALL
+                    (SELECT f.id AS file_id, NULL AS chunk_index, substr(f.text_content, 1, 201) AS preview,
+                            f.embedding <=> %(query)s::vector AS distance
+                     FROM {file_source}
+                     ORDER BY distance
+                     LIMIT %(window)s)
+                ), vector_hits AS (
+                    SELECT file_id, chunk_index, preview, distance,
+                           row_number() OVER (ORDER BY distance, file_id) AS rank
+                    FROM (SELECT DISTINCT ON (file_id) file_id, chunk_index, preview, distance
+                          FROM vector_candidates
+                          ORDER BY file_id, distance) best
+                )""")
+            if use_lexical:
+                # Every match is ranked before the best are kept. Chunked documents match on their
+                # chunks, and at file level on their names only; documents without chunks match on
+                # their text and names. Each branch has its own full-text index
+                chunk_vector = tsvector('document_chunks', 'search_vector', 'c.')
+                filename_vector = tsvector('processed_files', 'filename_vector', 'f.')
+                file_vector = tsvector('processed_files', 'search_vector', 'f.')
+                chunked = f"SELECT 1 FROM document_chunks c WHERE c.file_id = f.id AND {chunk_version}"
+                ctes.append(f"""
+                lexical_candidates AS (
+                    (SELECT c.file_id, c.chunk_index, substr(c.content, 1, 201) AS preview,
+                            ts_rank_cd({chunk_vector}, {tsquery}) AS score
+                     FROM document_chunks c
+                     {file_join}
+                     WHERE {chunk_vector} @@ {tsquery} AND {chunk_version} AND {file_filter}
+                     ORDER BY score DESC
+                     LIMIT %(candidates)s)
+                    UNION ALL
+                    (SELECT f.id AS file_id, NULL AS chunk_index, substr(f.text_content, 1, 201) AS preview,
+                            ts_rank_cd({filename_vector}, {tsquery}) AS score
+                     FROM processed_files f
+                     WHERE {filename_vector} @@ {tsquery} AND {file_filter} AND EXISTS ({chunked})
+                     ORDER BY score DESC
+                     LIMIT %(window)s)
+                    UNION ALL
+                    (SELECT f.id AS file_id, NULL AS chunk_index, substr(f.text_content, 1, 201) AS preview,
+                            ts_rank_cd({file_vector}, {tsquery}) AS score
+                     FROM processed_files f
+                     WHERE {file_vector} @@ {tsquery} AND {file_filter} AND NOT EXISTS ({chunked})
+                     ORDER BY score DESC
+                     LIMIT %(window)s)
+                ), lexical_hits AS (
+                    SELECT file_id, chunk_index, preview, score,
+                           row_number() OVER (ORDER BY score DESC, file_id) AS rank
+                    FROM (SELECT DISTINCT ON (file_id) file_id, chunk_index, preview, score
+                          FROM lexical_candidates
+                          ORDER BY file_id, score DESC, chunk_index NULLS LAST) best
+                )""")
+
+            if mode == "vector":
+                ranked = """
+                ranked AS (
+                    SELECT file_id, chunk_index, preview, distance, 1 - distance AS score
+                    FROM vector_hits
+                )"""
+            elif mode == "lexical":
+                ranked = """
+                ranked AS (
+                    SELECT file_id, chunk_index, preview, NULL::float8 AS distance, score
+                    FROM lexical_hits
+                )"""
+            else:
+                # Reciprocal rank fusion; the preview comes from whichever side contributed more
+                ranked = """
+                fused AS (
+                    SELECT coalesce(v.file_id, l.file_id) AS file_id, v.distance,
+                           coalesce(%(vector_weight)s / (%(rrf_k)s + v.rank), 0) AS vector_score,
+                           coalesce(%(lexical_weight)s / (%(rrf_k)s + l.rank), 0) AS lexical_score,
+                           v.chunk_index AS vector_chunk, v.preview AS vector_preview,
+                           l.chunk_index AS lexical_chunk, l.preview AS lexical_preview
+                    FROM vector_hits v
+                    FULL OUTER JOIN lexical_hits l ON l.file_id = v.file_id
+                ), ranked AS (
+                    SELECT file_id,
+                           CASE WHEN lexical_score > vector_score THEN lexical_chunk ELSE vector_chunk END AS chunk_index,
+                           CASE WHEN lexical_score > vector_score THEN lexical_preview ELSE vector_preview END AS preview,
+                           distance, vector_score + lexical_score AS score
+                    FROM fused
+                )"""
+            ctes.append(ranked)
+
+            with_clause = ",".join(ctes)
+            cur.execute(f"""
+                WITH {with_clause}
+                SELECT f.id, f.filename, f.original_filename, r.preview, r.distance,
+                       f.processed_date, f.category, f.source_type, r.chunk_index, r.score
+                FROM ranked r
+                JOIN processed_files f ON f.id = r.file_id
+                ORDER BY r.score DESC, r.file_id
+                LIMIT %(limit)s OFFSET %(offset)s
+            """, params)
+            rows = cur.fetchall()
+            cur.close()
+        
+        return [
+            {
+                'id': r[0],
+                'filename': r[1],
+                'original_filename': r[2],
+                'text_preview': (r[3][:200] + "..." if len(r[3]) > 200 else r[3]) if r[3] else '',
+                'similarity': float(r[4]) if r[4] is not None else None,
+                'score': float(r[9]),
+                'processed_date': r[5].isoformat() if r[5] else None,
+                'category': r[6],
+                'source_type': r[7],
+                'matched_chunk': r[8]
+            }
+            for r in rows
+        ]
+    
+    def prepare_file(self, file_path: str, original_filename: str, category: str = "document",
+                     source_type: str = "upload", created_by: str = "user",
+                     progress: Optional[Callable[[str], None]] = None,
+                     ingested: Optional[dict] = None) -> dict:
+        """Run every stage before storage: hash, dedup, scan, upload, extract and embed
+
+        Returns a dict whose 'status' is 'duplicate' (with 'file_id'),
+        'infected' (with 'file_info' and 'message') or 'ready' (with
+        'file_info', 'text_content', 'embedding' and 'chunks'). The file
+        itself is left in place for the caller to move.
+        """
+        def report(stage: str):
+            if progress:
+                progress(stage)
+        
+        # Seconds per stage, stored with the processing log entry
+        timings = {}
+        
+        # Calculate file hash, type and size
+        if not ingested:
+            report('hash')
+            with metrics.stage('hash', timings):
+                ingested = self.ingest_file(file_path)
+        file_hash = ingested['file_hash']
+        
+        # Skip every later stage for content that is already stored
+        with metrics.stage('dedup', timings):
+            existing_id = self.find_existing_file(file_hash)
+        if existing_id:
+            return {'status': 'duplicate', 'file_id': existing_id, 'stage_timings': timings}
+        
+        # Get file info
+        file_info = {
+            'filename': f"{file_hash}_{original_filename}",
+            'original_filename': original_filename,
+            'file_hash': file_hash,
+            'file_type': ingested['file_type'],
+            'file_size': ingested['file_size'],
+            'source_type': source_type,
+            'category': category,
+            'created_by': created_by,
+            'metadata': {
+                'processed_at': datetime.now().isoformat(),
+                'environment': self.environment
+            },
+            'stage_timings': timings
+        }
+        
+        # Scan with ClamAV
+        report('scan')
+        with metrics.stage('scan', timings):
+            is_clean, scan_message = self.scan_file_with_clamav(file_path, file_info)
+        file_info['scan_status'] = 'clean' if is_clean else 'infected'
+        
+        if not is_clean:
+            return {'status': 'infected', 'file_info': file_info, 'message': scan_message,
+                    'stage_timings': timings}
+        
+        # Upload to Azure Storage while text is extracted and embedded
+        upload = self.submit_upload(file_path, "processed", file_info)
+        
+        # Extract text
+        report('extract')
+        with metrics.stage('extract', timings):
+            text_content = self.extract_text(file_path, file_info['file_type'], file_hash)
+        
+        # Generate chunk embeddings
+        report('embed')
+        with metrics.stage('embed', timings):
+            embedding, chunks = self.embed_document(text_content)
+        
+        # Wait for the upload to finish; the upload itself is timed as 'upload'
+        report('upload')
+        with metrics.stage('upload_wait', timings):
+            file_info['storage_url'] = upload.result()
+        
+        return {
+            'status': 'ready',
+            'file_info': file_info,
+            'text_content': text_content,
+            'embedding': embedding,
+            'chunks': chunks,
+            'stage_timings': timings
+        }
     
     def process_file(self, file_path: str, original_filename: str, category: str = "document", 
-                    source_type: str = "upload", created_by: str = "user") -> dict:
-        """Main file processing workflow"""
+                    source_type: str = "upload", created_by: str = "user",
+                    progress: Optional[Callable[[str], None]] = None,
+                    ingested: Optional[dict] = None) -> dict:
+        """Main file processing workflow
+
+        progress(stage) is called as each stage starts. ingested is the hash,
+        type and size recorded while the file was written; without it the
+        file is read once to compute them.
+        """
         result = {
             'success': False,
             'file_id': None,
@@ -323,53 +3660,49 @@ class BriskLearningProcessor:
             'scan_status': 'pending'
         }
         
+        started = time.perf_counter()
         try:
             logger.info(f"Processing file: {original_filename}")
             
-            # Calculate file hash
-            file_hash = self.calculate_file_hash(file_path)
+            prepared = self.prepare_file(
+                file_path,
+                original_filename,
+                category=category,
+                source_type=source_type,
+                created_by=created_by,
+                progress=progress,
+                ingested=ingested
+            )
+            result['stage_timings'] = prepared['stage_timings']
             
-            # Get file info
-            file_info = {
-                'filename': f"{file_hash}_{original_filename}",
-                'original_filename': original_filename,
-                'file_hash': file_hash,
-                'file_type': magic.from_file(file_path, mime=True),
-                'file_size': os.path.getsize(file_path),
-                'source_type': source_type,
-                'category': category,
-                'created_by': created_by,
-                'metadata': {
-                    'processed_at': datetime.now().isoformat(),
-                    'environment': self.environment
-                }
-            }
+            if prepared['status'] == 'duplicate':
+                os.remove(file_path)
+                result['success'] = True
+                result['file_id'] = prepared['file_id']
+                result['duplicate'] = True
+                result['scan_status'] = 'skipped'
+                result['message'] = "File already processed"
+                logger.info(f"File {original_filename} is a duplicate of file ID {prepared['file_id']}")
+                return result
             
-            # Scan with ClamAV
-            is_clean, scan_message = self.scan_file_with_clamav(file_path)
-            file_info['scan_status'] = 'clean' if is_clean else 'infected'
+            file_info = prepared['file_info']
             result['scan_status'] = file_info['scan_status']
             
-            if not is_clean:
+            if prepared['status'] == 'infected':
                 # Move to quarantine
                 quarantine_path = f"/shared-files/quarantine/{file_info['filename']}"
                 shutil.move(file_path, quarantine_path)
-                result['message'] = f"File quarantined: {scan_message}"
-                logger.warning(f"File {original_filename} quarantined: {scan_message}")
+                result['message'] = f"File quarantined: {prepared['message']}"
+                logger.warning(f"File {original_filename} quarantined: {prepared['message']}")
                 return result
             
-            # Extract text
-            text_content = self.extract_text(file_path)
-            
-            # Generate embeddings
-            embedding = self.generate_embeddings(text_content)
-            
-            # Upload to Azure Storage
-            storage_url = self.upload_to_azure_storage(file_path, "processed")
-            file_info['storage_url'] = storage_url
-            
             # Store in database
-            file_id = self.store_in_database(file_info, text_content, embedding)
+            if progress:
+                progress('store')
+            with metrics.stage('store', result['stage_timings']):
+                file_id = self.store_in_database(
+                    file_info, prepared['text_content'], prepared['embedding'], prepared['chunks']
+                )
             
             if file_id:
                 # Move to processed folder
@@ -385,43 +3718,1271 @@ class BriskLearningProcessor:
                 result['message'] = "Database storage failed"
                 
         except Exception as e:
+            metrics.error('process', e)
             logger.error(f"File processing failed for {original_filename}: {e}")
             result['message'] = f"Processing failed: {str(e)}"
+        finally:
+            metrics.observe('stage_duration_seconds', time.perf_counter() - started, stage='total')
+            metrics.inc('files_total', outcome=file_outcome(result))
         
         return result
 
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class VectorIndexManager:
+    """Creates, tunes and rebuilds the approximate-nearest-neighbour indexes
+
+    ivfflat indexes are only built once a table holds ivfflat_min_rows rows,
+    with lists derived from the row count, and are rebuilt when the table has
+    grown by ivfflat_rebuild_factor since the last build. HNSW indexes need no
+    training and are built straight away. Serving processes repeat the check
+    every maintain_interval seconds, since uploads grow the tables without a
+    bulk run.
+
+    storage picks what the index holds: the full vectors ('vector'), half
+    precision copies ('halfvec', half the size) or binary-quantized bits
+    ('bit', 1/32 of the size). Compact indexes only serve a coarse pass;
+    searches fetch rerank_multiplier times the candidates from them and
+    re-rank those on the full-precision vectors kept in the table. They
+    need pgvector 0.7.0; on older versions check_storage falls back to
+    full vectors.
+    """
+
+    INDEXES = {
+        'processed_files': 'processed_files_embedding_idx',
+        'document_chunks': 'document_chunks_embedding_idx'
+    }
+    STORAGES = ('vector', 'halfvec', 'bit')
+    # Candidates fetched by the coarse pass per candidate kept, unless configured
+    RERANK_MULTIPLIERS = {'vector': 1, 'halfvec': 2, 'bit': 10}
+    # pgvector release that added halfvec and binary_quantize
+    COMPACT_STORAGE_VERSION = (0, 7, 0)
+    # Arbitrary constant identifying the index maintenance advisory lock
+    LOCK_ID = 738201
+
+    def __init__(self, processor, index_type: str = "ivfflat", ivfflat_min_rows: int = 10000,
+                 ivfflat_rebuild_factor: float = 2.0, probes: int = 10, hnsw_m: int = 16,
+                 hnsw_ef_construction: int = 64, ef_search: int = 40, storage: str = "vector",
+                 rerank_multiplier: Optional[int] = None, dimensions: int = 384,
+                 maintain_interval: float = 3600.0):
+        if index_type not in ("ivfflat", "hnsw"):
+            raise ValueError(f"Unknown vector index type: {index_type}")
+        if storage not in self.STORAGES:
+            raise ValueError(f"Unknown vector index storage: {storage}")
+        self.processor = processor
+        self.index_type = index_type
+        self.storage = storage
+        self.rerank_multiplier = rerank_multiplier or self.RERANK_MULTIPLIERS[storage]
+        self.dimensions = dimensions
+        self.ivfflat_min_rows = ivfflat_min_rows
+        self.ivfflat_rebuild_factor = ivfflat_rebuild_factor
+        self.probes = probes
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.ef_search = ef_search
+        self.maintain_interval = maintain_interval
+        self._version = None
+
+    @staticmethod
+    def ideal_lists(rows: int) -> int:
+        """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+        if rows <= 1000000:
+            return max(1, rows // 1000)
+        return int(math.sqrt(rows))
+
+    def index_expression(self, column: str = "embedding") -> tuple[str, str]:
+        """Indexed expression and operator class for the storage mode"""
+        if self.storage == "halfvec":
+            return f"({column}::halfvec({self.dimensions}))", "halfvec_cosine_ops"
+        if self.storage == "bit":
+            return f"(binary_quantize({column})::bit({self.dimensions}))", "bit_hamming_ops"
+        return column, "vector_cosine_ops"
+
+    def coarse_distance(self, column: str, query: str, storage: Optional[str] = None) -> Optional[str]:
+        """Distance matching a compact index, for ORDER BY in the coarse pass; None for full vectors"""
+        storage = storage or self.storage
+        if storage == "halfvec":
+            return f"({column}::halfvec({self.dimensions})) <=> {query}::halfvec({self.dimensions})"
+        if storage == "bit":
+            return f"(binary_quantize({column})::bit({self.dimensions})) <~> binary_quantize({query}::vector)"
+        return None
+
+    def pgvector_version(self, cur) -> Optional[tuple]:
+        """Installed pgvector version; None until the extension exists"""
+        if self._version is None:
+            cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cur.fetchone()
+            if row:
+                self._version = tuple(int(part) for part in re.findall(r"\d+", row[0])[:3])
+        return self._version
+    
+    def supports_iterative_scan(self, cur) -> bool:
+        """Whether the installed pgvector (0.8.0+) can keep scanning an index past filtered-out rows"""
+        return (self.pgvector_version(cur) or ()) >= (0, 8, 0)
+    
+    def supports_storage(self, cur, storage: str) -> bool:
+        """Whether the installed pgvector has the types a storage mode indexes"""
+        if storage == "vector":
+            return True
+        return (self.pgvector_version(cur) or ()) >= self.COMPACT_STORAGE_VERSION
+    
+    def check_storage(self, cur):
+        """Fall back to full vectors when pgvector is too old for the configured storage"""
+        version = self.pgvector_version(cur)
+        if version is None or self.supports_storage(cur, self.storage):
+            return
+        logger.warning(
+            f"Vector index storage {self.storage} needs pgvector "
+            f"{'.'.join(map(str, self.COMPACT_STORAGE_VERSION))} or later (installed: "
+            f"{'.'.join(map(str, version))}); indexing full vectors instead"
+        )
+        self.storage = "vector"
+        self.rerank_multiplier = 1
+    
+    def apply_search_settings(self, cur, probes: Optional[int] = None, ef_search: Optional[int] = None,
+                              candidates: int = 0, iterative: bool = False):
+        """Set ivfflat.probes and hnsw.ef_search for the current transaction
+        
+        With iterative, filtered index scans continue until enough rows pass
+        the filter (where pgvector supports it).
+        """
+        probes = max(1, probes or self.probes)
+        # HNSW returns at most ef_search rows, so it must cover the candidate count (pgvector caps it at 1000)
+        ef_search = min(1000, max(ef_search or self.ef_search, candidates))
+        cur.execute(
+            "SELECT set_config('ivfflat.probes', %s, true), set_config('hnsw.ef_search', %s, true)",
+            (str(probes), str(ef_search))
+        )
+        if iterative and self.supports_iterative_scan(cur):
+            # Results are re-sorted afterwards, so relaxed ordering is enough
+            cur.execute(
+                "SELECT set_config('ivfflat.iterative_scan', 'relaxed_order', true), "
+                "set_config('hnsw.iterative_scan', 'relaxed_order', true)"
+            )
+
+    def _describe(self, cur, index_name: str) -> Optional[dict]:
+        cur.execute("""
+            SELECT am.amname, c.reloptions, obj_description(c.oid, 'pg_class'), pg_get_indexdef(c.oid)
+            FROM pg_class c
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE c.relname = %s AND c.relkind = 'i'
+        """, (index_name,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        options = dict(option.split('=', 1) for option in (row[1] or []))
+        # The comment records the row count the index was built at
+        built_rows = 0
+        if row[2] and row[2].startswith('rows='):
+            built_rows = int(row[2][len('rows='):])
+        storage = "vector"
+        if "binary_quantize" in row[3]:
+            storage = "bit"
+        elif "halfvec" in row[3]:
+            storage = "halfvec"
+        return {'method': row[0], 'options': options, 'built_rows': built_rows, 'storage': storage}
+
+    def _row_count(self, cur, table: str) -> int:
+        cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", (table,))
+        row = cur.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+        # Never analysed
+        cur.execute(f"SELECT count(*) FROM {table}")
+        return cur.fetchone()[0]
+
+    def _index_sql(self, table: str, index_name: str, rows: int, concurrently: bool = True) -> str:
+        expression, operator_class = self.index_expression()
+        create = "CREATE INDEX CONCURRENTLY" if concurrently else "CREATE INDEX"
+        if self.index_type == "hnsw":
+            return (f"{create} {index_name} ON {table} "
+                    f"USING hnsw ({expression} {operator_class}) "
+                    f"WITH (m = {self.hnsw_m}, ef_construction = {self.hnsw_ef_construction})")
+        return (f"{create} {index_name} ON {table} "
+                f"USING ivfflat ({expression} {operator_class}) WITH (lists = {self.ideal_lists(rows)})")
+
+    def _build(self, cur, table: str, index_name: str, rows: int, replace: bool):
+        """Build the index under a temporary name, then swap it in"""
+        new_name = f"{index_name}_new"
+        # Leftover from an interrupted build
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}")
+        started = time.monotonic()
+        cur.execute(self._index_sql(table, new_name, rows))
+        cur.execute("BEGIN")
+        try:
+            if replace:
+                cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+            cur.execute(f"ALTER INDEX {new_name} RENAME TO {index_name}")
+            cur.execute(f"COMMENT ON INDEX {index_name} IS %s", (f"rows={rows}",))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        logger.info(f"Built {self.index_type} index {index_name} ({self.storage}) on {rows} rows "
+                    f"in {time.monotonic() - started:.1f}s")
+
+    def ensure(self, cur, table: str, force: bool = False) -> str:
+        """Create, rebuild or drop one table's vector index as needed; returns the action taken"""
+        index_name = self.INDEXES[table]
+        current = self._describe(cur, index_name)
+        rows = self._row_count(cur, table)
+
+        # Switching storage mode rebuilds the index like switching index type does
+        matches = current is not None and current['storage'] == self.storage
+        if self.index_type == "hnsw":
+            if matches and current['method'] == "hnsw" and not force:
+                return "unchanged"
+            self._build(cur, table, index_name, rows, replace=current is not None)
+            return "built"
+
+        if rows < self.ivfflat_min_rows:
+            if current and current['method'] == "ivfflat":
+                # Centroids trained on a near-empty table hurt recall; exact scans are fast at this size
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+                logger.info(f"Dropped untrained ivfflat index {index_name} ({rows} rows)")
+                return "dropped"
+            return "unchanged"
+
+        if matches and current['method'] == "ivfflat" and not force:
+            if current['built_rows'] and rows < current['built_rows'] * self.ivfflat_rebuild_factor:
+                return "unchanged"
+        self._build(cur, table, index_name, rows, replace=current is not None)
+        return "built"
+
+    def maintain(self, force: bool = False) -> dict:
+        """Bring every vector index in line with the configuration"""
+        actions = {}
+        try:
+            conn = self.processor.get_db_connection()
+        except Exception as e:
+            logger.error(f"Vector index maintenance skipped: {e}")
+            return actions
+
+        try:
+            # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (self.LOCK_ID,))
+            if not cur.fetchone()[0]:
+                logger.info("Vector index maintenance already running elsewhere")
+                return actions
+            try:
+                self.check_storage(cur)
+                for table in self.INDEXES:
+                    actions[table] = self.ensure(cur, table, force=force)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (self.LOCK_ID,))
+            cur.close()
+        except Exception as e:
+            logger.error(f"Vector index maintenance failed: {e}")
+        finally:
+            conn.close()
+        return actions
+
+    def maintain_periodically(self):
+        """Run maintain now and then every maintain_interval seconds; 0 runs it once
+
+        Every serving process runs this; the advisory lock taken by maintain
+        lets one of them build at a time, and the check is two catalog
+        lookups per table when nothing needs rebuilding.
+        """
+        while True:
+            self.maintain()
+            if self.maintain_interval <= 0:
+                return
+            time.sleep(self.maintain_interval)
+
+    def _timed_queries(self, cur, queries: list, k: int, storage: str = "vector",
+                       multiplier: int = 1) -> tuple[list, list]:
+        sql = "SELECT id FROM vector_index_benchmark ORDER BY embedding <=> %(query)s::vector LIMIT %(k)s"
+        coarse = self.coarse_distance("embedding", "%(query)s", storage=storage)
+        if coarse:
+            # Coarse pass on the compact index, exact re-ranking of its candidates
+            sql = f"""
+                SELECT id FROM (
+                    SELECT id, embedding FROM vector_index_benchmark ORDER BY {coarse} LIMIT %(coarse)s
+                ) candidates
+                ORDER BY embedding <=> %(query)s::vector LIMIT %(k)s
+            """
+        results = []
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            cur.execute(sql, {'query': format_vector(query), 'k': k, 'coarse': k * multiplier})
+            ids = [row[0] for row in cur.fetchall()]
+            latencies.append((time.perf_counter() - started) * 1000)
+            results.append(ids)
+        return results, latencies
+
+    def benchmark(self, sizes: list, queries: int = 100, k: int = 10, source: str = "random",
+                  index_types: Optional[list] = None, dimensions: int = 384, storages: Optional[list] = None,
+                  multipliers: Optional[list] = None) -> list:
+        """Measure index size, recall@k against exact search and query latency for each index setting
+
+        Vectors are random unit vectors, or real chunk embeddings when source
+        is "chunks". Compact storages are measured with each re-rank
+        multiplier in multipliers (default: the configured one). Everything
+        runs in a temporary table on a dedicated connection.
+        """
+        index_types = index_types or ["ivfflat", "hnsw"]
+        storages = storages or ["vector"]
+        report = []
+        conn = self.processor.get_db_connection()
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            unsupported = [storage for storage in storages if not self.supports_storage(cur, storage)]
+            if unsupported:
+                logger.warning(f"Skipping storages the installed pgvector lacks: {', '.join(unsupported)}")
+                storages = [storage for storage in storages if storage not in unsupported]
+            rng = np.random.default_rng(42)
+            for size in sizes:
+                cur.execute("DROP TABLE IF EXISTS vector_index_benchmark")
+                cur.execute(f"""
+                    CREATE TEMP TABLE vector_index_benchmark (
+                        id SERIAL PRIMARY KEY,
+                        embedding vector({dimensions})
+                    )
+                """)
+                if source == "chunks":
+                    cur.execute("""
+                        INSERT INTO vector_index_benchmark (embedding)
+                        SELECT embedding FROM document_chunks WHERE embedding IS NOT NULL LIMIT %s
+                    """, (size,))
+                    cur.execute("SELECT embedding::text FROM vector_index_benchmark ORDER BY random() LIMIT %s",
+                                (queries,))
+                    # Perturb real vectors so queries are near, but not identical to, stored rows
+                    sample = np.array([json.loads(row[0]) for row in cur.fetchall()], dtype=np.float32)
+                    query_vectors = sample + rng.normal(0, 0.05, sample.shape).astype(np.float32)
+                else:
+                    vectors = rng.normal(size=(size, dimensions)).astype(np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                    copy_binary(cur, "vector_index_benchmark", ['embedding'],
+                                ((pg_vector(vector.tolist()),) for vector in vectors))
+                    query_vectors = rng.normal(size=(queries, dimensions)).astype(np.float32)
+                cur.execute("ANALYZE vector_index_benchmark")
+                cur.execute("SELECT count(*) FROM vector_index_benchmark")
+                rows = cur.fetchone()[0]
+                query_list = [vector.tolist() for vector in query_vectors]
+
+                # Ground truth from an exact scan
+                exact, exact_latencies = self._timed_queries(cur, query_list, k)
+                report.append({
+                    'rows': rows, 'index': 'exact', 'storage': 'vector', 'setting': None, 'recall': 1.0,
+                    'p50_ms': percentile(exact_latencies, 50), 'p99_ms': percentile(exact_latencies, 99),
+                    'build_s': 0.0, 'index_mb': 0.0
+                })
+
+                for index_type, storage in [(index_type, storage) for index_type in index_types
+                                            for storage in storages]:
+                    builder = VectorIndexManager(
+                        self.processor, index_type=index_type, hnsw_m=self.hnsw_m,
+                        hnsw_ef_construction=self.hnsw_ef_construction, storage=storage, dimensions=dimensions
+                    )
+                    started = time.monotonic()
+                    cur.execute(builder._index_sql(
+                        "vector_index_benchmark", "vector_index_benchmark_idx", rows, concurrently=False
+                    ))
+                    build_time = time.monotonic() - started
+                    cur.execute("SELECT pg_relation_size('vector_index_benchmark_idx')")
+                    index_mb = round(cur.fetchone()[0] / 2 ** 20, 2)
+                    if index_type == "hnsw":
+                        settings = [('hnsw.ef_search', value) for value in (20, 40, 80, 160, 320)]
+                    else:
+                        settings = [('ivfflat.probes', value) for value in (1, 5, 10, 20, 40)]
+                    storage_multipliers = [1]
+                    if storage != "vector":
+                        storage_multipliers = multipliers or [self.rerank_multiplier if storage == self.storage
+                                                              else self.RERANK_MULTIPLIERS[storage]]
+
+                    for (name, value), multiplier in [(setting, multiplier) for setting in settings
+                                                      for multiplier in storage_multipliers]:
+                        if name == "hnsw.ef_search":
+                            # As in searches, ef_search covers every coarse candidate
+                            value = min(1000, max(value, k * multiplier))
+                        cur.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+                        approximate, latencies = builder._timed_queries(cur, query_list, k, storage, multiplier)
+                        recall = sum(
+                            len(set(found) & set(truth)) for found, truth in zip(approximate, exact)
+                        ) / float(k * len(exact))
+                        setting = f"{name}={value}"
+                        if storage != "vector":
+                            setting += f" x{multiplier}"
+                        report.append({
+                            'rows': rows, 'index': index_type, 'storage': storage, 'setting': setting,
+                            'recall': round(recall, 4),
+                            'p50_ms': percentile(latencies, 50), 'p99_ms': percentile(latencies, 99),
+                            'build_s': round(build_time, 2), 'index_mb': index_mb
+                        })
+                    cur.execute("DROP INDEX vector_index_benchmark_idx")
+            cur.execute("DROP TABLE IF EXISTS vector_index_benchmark")
+            cur.close()
+        finally:
+            conn.close()
+        return report
+
+class JobQueue:
+    """Postgres-backed queue that runs process_file jobs on a bounded worker pool"""
+
+    def __init__(self, processor: BriskLearningProcessor, workers: int = 2,
+                 executor_type: str = "thread", stale_after: float = 3600.0):
+        if executor_type not in ("thread", "process"):
+            raise ValueError(f"Unknown job executor type: {executor_type}")
+        self.processor = processor
+        self.workers = workers
+        self.executor_type = executor_type
+        self.stale_after = stale_after
+        self.executor = None
+
+    def start(self):
+        """Start the worker pool and re-queue work left over from a previous run"""
+        if self.executor is not None:
+            return
+        if self.executor_type == "process":
+            # Spawned workers import this module and build their own processor and pool
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="job-worker"
+            )
+        logger.info(f"Job queue started with {self.workers} {self.executor_type} workers")
+        self.recover()
+
+    def shutdown(self, wait: bool = True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def create_job(self, file_path: str, original_filename: str, category: str = "document",
+                   source_type: str = "upload", created_by: str = "user",
+                   ingested: Optional[dict] = None) -> tuple[str, bool]:
+        """Persist a queued job and return (job_id, created)
+
+        When a job for the same content is already queued or running, that
+        job's id is returned with created=False instead of adding another.
+        """
+        job_id = str(uuid.uuid4())
+        file_hash = ingested['file_hash'] if ingested else None
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            # The in-flight job can finish between the conflict and the lookup; retry once
+            for _ in range(2):
+                cur.execute("""
+                    INSERT INTO processing_jobs
+                    (id, file_path, file_info, file_hash, original_filename, category,
+                     source_type, created_by, environment)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (file_hash) WHERE status IN ('queued', 'running') DO NOTHING
+                    RETURNING id
+                """, (
+                    job_id,
+                    file_path,
+                    json.dumps(ingested) if ingested else None,
+                    file_hash,
+                    original_filename,
+                    category,
+                    source_type,
+                    created_by,
+                    self.processor.environment
+                ))
+                if cur.fetchone():
+                    cur.close()
+                    return job_id, True
+                
+                cur.execute("""
+                    SELECT id FROM processing_jobs
+                    WHERE file_hash = %s AND status IN ('queued', 'running')
+                """, (file_hash,))
+                existing = cur.fetchone()
+                if existing:
+                    cur.close()
+                    return existing[0], False
+            cur.close()
+        raise RuntimeError(f"Could not queue job for file hash {file_hash}")
+
+    def submit(self, job_id: str):
+        """Hand a persisted job to the worker pool"""
+        if self.executor is None:
+            raise RuntimeError("Job queue is not running")
+        future = self.executor.submit(run_processing_job, job_id)
+
+        def job_done(f):
+            if f.cancelled():
+                return
+            if f.exception():
+                logger.error(f"Job {job_id} crashed: {f.exception()}")
+            elif self.executor_type == "process" and f.result():
+                # Metrics recorded in a worker process stay there; replay the outcome here
+                result = f.result()
+                for stage, seconds in (result.get('stage_timings') or {}).items():
+                    metrics.observe('stage_duration_seconds', seconds, stage=stage)
+                metrics.inc('files_total', outcome=file_outcome(result))
+
+        future.add_done_callback(job_done)
+    
+    def collect_metrics(self) -> list:
+        """Queued and running job counts for /metrics"""
+        counts = {'queued': 0, 'running': 0}
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT status, count(*) FROM processing_jobs
+                WHERE environment = %s AND status IN ('queued', 'running')
+                GROUP BY status
+            """, (self.processor.environment,))
+            counts.update(cur.fetchall())
+            cur.close()
+        return [('jobs', {'status': status}, count) for status, count in sorted(counts.items())]
+
+    def recover(self):
+        """Re-submit queued jobs and jobs whose worker stopped updating them"""
+        try:
+            with self.processor.db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    UPDATE processing_jobs
+                    SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                    WHERE environment = %s AND status = 'running'
+                      AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """, (self.processor.environment, self.stale_after))
+                cur.execute("""
+                    SELECT id FROM processing_jobs
+                    WHERE environment = %s AND status = 'queued'
+                    ORDER BY created_at
+                """, (self.processor.environment,))
+                job_ids = [row[0] for row in cur.fetchall()]
+                cur.execute(
+                    "SELECT file_path FROM processing_jobs WHERE status IN ('queued', 'running')"
+                )
+                pending_paths = {row[0] for row in cur.fetchall()}
+                cur.close()
+        except Exception as e:
+            logger.error(f"Job recovery failed: {e}")
+            return
+
+        for job_id in job_ids:
+            self.submit(job_id)
+        if job_ids:
+            logger.info(f"Re-queued {len(job_ids)} pending jobs")
+        self._remove_orphaned_uploads(pending_paths)
+
+    def _remove_orphaned_uploads(self, pending_paths: set):
+        """Delete old upload files that no queued or running job will process"""
+        directory = self.processor.upload_admission.directory
+        cutoff = time.time() - self.stale_after
+        removed = 0
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if (not entry.name.startswith('temp_') or entry.path in pending_paths
+                            or not entry.is_file(follow_symlinks=False)
+                            or entry.stat().st_mtime > cutoff):
+                        continue
+                    self._discard(entry.path)
+                    removed += 1
+        except OSError as e:
+            logger.warning(f"Could not clean up orphaned uploads in {directory}: {e}")
+        if removed:
+            logger.info(f"Removed {removed} orphaned upload files from {directory}")
+
+    def _discard(self, file_path: str):
+        """Delete the upload of a job that ended failed; nothing retries it"""
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            # Quarantined, or already gone
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove {file_path}: {e}")
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Return the current state of a job"""
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, status, stage, progress, original_filename, category,
+                       result, error, attempts, created_at, started_at, finished_at
+                FROM processing_jobs
+                WHERE id = %s
+            """, (job_id,))
+            row = cur.fetchone()
+            cur.close()
+
+        if not row:
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[1],
+            'stage': row[2],
+            'progress': row[3],
+            'original_filename': row[4],
+            'category': row[5],
+            'result': row[6],
+            'error': row[7],
+            'attempts': row[8],
+            'created_at': row[9].isoformat() if row[9] else None,
+            'started_at': row[10].isoformat() if row[10] else None,
+            'finished_at': row[11].isoformat() if row[11] else None
+        }
+
+    def _claim(self, job_id: str) -> Optional[tuple]:
+        """Atomically move a queued job to running so it is only processed once"""
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE processing_jobs
+                SET status = 'running', attempts = attempts + 1,
+                    started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'queued'
+                RETURNING file_path, original_filename, category, source_type, created_by, file_info
+            """, (job_id,))
+            row = cur.fetchone()
+            cur.close()
+        return row
+
+    def _merge_stage(self, cur, job_id: str, stage: str, fields: dict):
+        cur.execute("""
+            UPDATE processing_jobs
+            SET progress = progress || jsonb_build_object(
+                    %s::text, COALESCE(progress->%s, '{}'::jsonb) || %s::jsonb
+                ),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (stage, stage, json.dumps(fields), job_id))
+
+    def _record_stage(self, job_id: str, stage: str, previous: Optional[str]):
+        """Mark the previous stage done and the new stage running"""
+        now = datetime.now().isoformat()
+        try:
+            with self.processor.db_connection() as conn:
+                cur = conn.cursor()
+                if previous:
+                    self._merge_stage(cur, job_id, previous, {'status': 'done', 'finished_at': now})
+                self._merge_stage(cur, job_id, stage, {'status': 'running', 'started_at': now})
+                cur.execute(
+                    "UPDATE processing_jobs SET stage = %s WHERE id = %s",
+                    (stage, job_id)
+                )
+                cur.close()
+        except Exception as e:
+            # Progress is informational; never fail the job because of it
+            logger.warning(f"Failed to record stage {stage} for job {job_id}: {e}")
+
+    def _finish(self, job_id: str, status: str, result: Optional[dict] = None,
+                error: Optional[str] = None, last_stage: Optional[str] = None):
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            if last_stage:
+                self._merge_stage(cur, job_id, last_stage, {
+                    'status': 'done' if status == 'completed' else 'failed',
+                    'finished_at': datetime.now().isoformat()
+                })
+            cur.execute("""
+                UPDATE processing_jobs
+                SET status = %s, result = %s, error = %s,
+                    finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (
+                status,
+                json.dumps(result) if result is not None else None,
+                error,
+                job_id
+            ))
+            cur.close()
+
+    def run(self, job_id: str) -> Optional[dict]:
+        """Execute a job inside a worker and return the process_file result"""
+        try:
+            job = self._claim(job_id)
+        except Exception as e:
+            logger.error(f"Failed to claim job {job_id}: {e}")
+            return None
+        if not job:
+            # Already taken by another worker or finished
+            return None
+
+        file_path, original_filename, category, source_type, created_by, ingested = job
+        current = {'stage': None}
+
+        def progress(stage: str):
+            self._record_stage(job_id, stage, current['stage'])
+            current['stage'] = stage
+
+        try:
+            result = self.processor.process_file(
+                file_path,
+                original_filename,
+                category=category,
+                source_type=source_type,
+                created_by=created_by,
+                progress=progress,
+                ingested=ingested
+            )
+            status = 'completed' if result['success'] else 'failed'
+            if not result['success']:
+                # The client sees the error on the job and uploads again if it wants to
+                self._discard(file_path)
+            self._finish(job_id, status, result=result,
+                         error=None if result['success'] else result['message'],
+                         last_stage=current['stage'])
+            return result
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self._discard(file_path)
+            self._finish(job_id, 'failed', error=str(e), last_stage=current['stage'])
+            return None
+
+def run_processing_job(job_id: str) -> Optional[dict]:
+    """Worker entry point; module-level so process pools can pickle it"""
+    return job_queue.run(job_id)
+
+class BulkIngestor:
+    """Ingests every file in a directory with a process pool and batched database writes
+
+    Files stay in the directory until their batch is committed, so an
+    interrupted run resumes by simply running again: files that were stored
+    but not yet moved are recognised as duplicates by their hash.
+    """
+
+    def __init__(self, processor: BriskLearningProcessor, directory: str = "/shared-files/incoming",
+                 workers: int = 2, batch_size: int = 50, category: str = "document",
+                 min_age: float = 30.0, progress_interval: float = 10.0):
+        self.processor = processor
+        self.directory = directory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.category = category
+        self.min_age = min_age
+        self.progress_interval = progress_interval
+        # Files that failed, keyed by path, with the (size, mtime) they failed at
+        self._failed = {}
+
+    def pending_files(self) -> list:
+        """Files ready for ingestion, oldest first"""
+        now = time.time()
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Dotfiles are ours or half-written; temp_ files belong to API upload jobs
+                if entry.name.startswith(('.', 'temp_')) or not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                # Other services may still be writing recent files
+                if now - stat.st_mtime < self.min_age:
+                    continue
+                if self._failed.get(entry.path) == (stat.st_size, stat.st_mtime):
+                    continue
+                files.append((stat.st_mtime, entry.path))
+        return [path for _, path in sorted(files)]
+
+    def run(self) -> dict:
+        """Ingest every pending file once"""
+        stats = {'total': 0, 'stored': 0, 'duplicates': 0, 'quarantined': 0, 'failed': 0}
+        lock_path = os.path.join(self.directory, ".bulk-ingest.lock")
+        with open(lock_path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.warning(f"Another bulk ingest is already running in {self.directory}")
+                return stats
+
+            files = self.pending_files()
+            stats['total'] = len(files)
+            if not files:
+                return stats
+
+            logger.info(f"Bulk ingest of {len(files)} files with {self.workers} workers")
+            started = time.monotonic()
+            last_report = started
+            batch = []
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = {executor.submit(prepare_for_bulk, path, self.category): path for path in files}
+                for future in as_completed(futures):
+                    path = futures.pop(future)
+                    try:
+                        prepared = future.result()
+                    except Exception as e:
+                        logger.error(f"Bulk ingest failed for {path}: {e}")
+                        self._mark_failed(path, stats)
+                        continue
+
+                    if prepared['status'] == 'duplicate':
+                        os.remove(path)
+                        stats['duplicates'] += 1
+                    elif prepared['status'] == 'infected':
+                        quarantine_path = f"/shared-files/quarantine/{prepared['file_info']['filename']}"
+                        shutil.move(path, quarantine_path)
+                        logger.warning(f"File {path} quarantined: {prepared['message']}")
+                        stats['quarantined'] += 1
+                    else:
+                        batch.append((path, prepared))
+                        if len(batch) >= self.batch_size:
+                            self._flush(batch, stats)
+
+                    if time.monotonic() - last_report >= self.progress_interval:
+                        self._report(stats, started)
+                        last_report = time.monotonic()
+
+                self._flush(batch, stats)
+
+            self._report(stats, started)
+            if stats['stored']:
+                # A large load may cross the ivfflat training threshold or warrant new lists
+                self.processor.index_manager.maintain()
+            return stats
+
+    def _flush(self, batch: list, stats: dict):
+        stored = self.processor.store_many([prepared for _, prepared in batch])
+        for (path, prepared), outcome in zip(batch, stored):
+            if outcome['status'] == 'new':
+                processed_path = f"/shared-files/processed/{prepared['file_info']['filename']}"
+                shutil.move(path, processed_path)
+                stats['stored'] += 1
+            elif outcome['status'] == 'duplicate':
+                os.remove(path)
+                stats['duplicates'] += 1
+            else:
+                self._mark_failed(path, stats)
+        batch.clear()
+
+    def _mark_failed(self, path: str, stats: dict):
+        stats['failed'] += 1
+        try:
+            stat = os.stat(path)
+            self._failed[path] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            pass
+
+    def _report(self, stats: dict, started: float):
+        done = stats['stored'] + stats['duplicates'] + stats['quarantined'] + stats['failed']
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = (stats['total'] - done) / rate if rate > 0 else 0.0
+        logger.info(
+            f"Bulk ingest: {done}/{stats['total']} files "
+            f"({stats['stored']} stored, {stats['duplicates']} duplicates, "
+            f"{stats['quarantined']} quarantined, {stats['failed']} failed), "
+            f"{rate:.1f} files/s, ~{remaining:.0f}s remaining"
+        )
+
+    def watch(self, interval: int = 60):
+        """Run an ingest pass every interval seconds until interrupted"""
+        schedule.every(interval).seconds.do(self.run)
+        self.run()
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+
+def prepare_for_bulk(file_path: str, category: str = "document") -> dict:
+    """Process-pool entry point for BulkIngestor; runs in a spawned worker with its own processor"""
+    return processor.prepare_file(
+        file_path,
+        os.path.basename(file_path),
+        category=category,
+        source_type="bulk_import",
+        created_by="bulk_ingest"
+    )
+
+class EmbeddingBackfill:
+    """Re-embeds stored documents for the configured embedding model and version
+    
+    Files still lacking chunks of that (model, version) are listed by id a
+    window at a time and their text is read a page at a time, each in its
+    own short transaction that ends before anything is encoded or
+    throttled, so no snapshot stays open. Their chunks are encoded across
+    files in batches of batch_size texts and COPYed in next to the existing chunks,
+    so a server configured for the old version keeps searching the old
+    vectors until it is switched over. Finished files are exactly those
+    with chunks of the new version, so an interrupted run resumes by
+    running again. rate caps the files re-embedded per second.
+    """
+    
+    # Arbitrary constant identifying the backfill advisory lock
+    LOCK_ID = 738202
+    
+    # Files whose text is read per query
+    PAGE_SIZE = 100
+    
+    def __init__(self, processor: BriskLearningProcessor, batch_size: int = 256, rate: float = 0.0,
+                 window: int = 5000, progress_interval: float = 10.0):
+        self.processor = processor
+        self.batch_size = batch_size
+        self.rate = rate
+        self.window = window
+        self.progress_interval = progress_interval
+    
+    def _pending_sql(self, columns: str) -> str:
+        return f"""
+            SELECT {columns} FROM processed_files f
+            WHERE f.text_content IS NOT NULL AND f.text_content <> ''
+              AND NOT EXISTS (SELECT 1 FROM document_chunks c
+                              WHERE c.file_id = f.id AND c.embedding_model = %(model)s
+                                AND c.embedding_version = %(version)s)
+        """
+    
+    def status(self) -> dict:
+        """Files and chunks stored per (model, version), and files still to re-embed"""
+        model, version = self.processor.embedding_identity()
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT embedding_model, embedding_version, count(DISTINCT file_id), count(*)
+                FROM document_chunks
+                GROUP BY embedding_model, embedding_version
+                ORDER BY embedding_model, embedding_version
+            """)
+            versions = [
+                {'model': row[0], 'version': row[1], 'files': row[2], 'chunks': row[3]}
+                for row in cur.fetchall()
+            ]
+            cur.execute(self._pending_sql("count(*)"), {'model': model, 'version': version})
+            pending = cur.fetchone()[0]
+            cur.close()
+        return {'model': model, 'version': version, 'pending_files': pending, 'versions': versions}
+    
+    @contextmanager
+    def _lock(self):
+        """Hold the backfill advisory lock; yields False if another run holds it"""
+        conn = self.processor.get_db_connection()
+        try:
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (self.LOCK_ID,))
+            locked = cur.fetchone()[0]
+            try:
+                yield locked
+            finally:
+                if locked:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (self.LOCK_ID,))
+                cur.close()
+        finally:
+            conn.close()
+    
+    def _check_dimensions(self):
+        dimensions = len(self.processor.embedding_backend.encode(["dimension check"])[0])
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            # pgvector stores a vector column's dimensions as its type modifier
+            cur.execute("""
+                SELECT atttypmod FROM pg_attribute
+                WHERE attrelid = 'document_chunks'::regclass AND attname = 'embedding'
+            """)
+            column = cur.fetchone()[0]
+            cur.close()
+        if column > 0 and column != dimensions:
+            raise ValueError(f"Model produces {dimensions}-dimensional vectors but document_chunks "
+                             f"stores {column}; a new embedding column is needed")
+    
+    def run(self) -> dict:
+        """Re-embed every pending file once"""
+        model, version = self.processor.embedding_identity()
+        stats = {'model': model, 'version': version, 'total': 0, 'files': 0, 'chunks': 0, 'empty': 0}
+        with self._lock() as locked:
+            if not locked:
+                logger.warning("Another embedding backfill is already running")
+                return stats
+            self._check_dimensions()
+            params = {'model': model, 'version': version}
+            with self.processor.db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(self._pending_sql("count(*)"), params)
+                stats['total'] = cur.fetchone()[0]
+                cur.close()
+            logger.info(f"Re-embedding {stats['total']} files for {model} version {version}")
+            
+            started = time.monotonic()
+            last_report = started
+            last_id = 0
+            batch = []
+            batch_texts = 0
+            while True:
+                # Only ids are read per window; each transaction commits before any encoding
+                with self.processor.db_connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute(self._pending_sql("f.id") + """
+                          AND f.id > %(after)s
+                        ORDER BY f.id
+                        LIMIT %(window)s
+                    """, dict(params, after=last_id, window=self.window))
+                    file_ids = [row[0] for row in cur.fetchall()]
+                    cur.close()
+                if not file_ids:
+                    break
+                last_id = file_ids[-1]
+                for offset in range(0, len(file_ids), self.PAGE_SIZE):
+                    for file_id, text_content in self._fetch_texts(file_ids[offset:offset + self.PAGE_SIZE]):
+                        spans = self.processor.chunk_text(text_content)
+                        if not spans:
+                            stats['empty'] += 1
+                            continue
+                        batch.append((file_id, text_content, spans))
+                        batch_texts += len(spans)
+                        if batch_texts >= self.batch_size:
+                            self._flush(batch, stats)
+                            batch_texts = 0
+                            self._throttle(stats, started)
+                        if time.monotonic() - last_report >= self.progress_interval:
+                            self._report(stats, started)
+                            last_report = time.monotonic()
+                if len(file_ids) < self.window:
+                    break
+            self._flush(batch, stats)
+            self._report(stats, started)
+            if stats['files']:
+                # The chunk table may have doubled, which can call for a larger ivfflat index
+                self.processor.index_manager.maintain()
+        return stats
+    
+    def _fetch_texts(self, file_ids: list) -> list:
+        """Read the text of a page of files in one short transaction"""
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, text_content FROM processed_files
+                WHERE id = ANY(%s) AND text_content IS NOT NULL AND text_content <> ''
+                ORDER BY id
+            """, (file_ids,))
+            rows = cur.fetchall()
+            cur.close()
+        return rows
+    
+    def _flush(self, batch: list, stats: dict):
+        """Encode the chunks of a batch of files and store them in one transaction"""
+        if not batch:
+            return
+        texts = [text_content[start:end] for _, text_content, spans in batch for start, end in spans]
+        vectors = []
+        for offset in range(0, len(texts), self.batch_size):
+            vectors.extend(self.processor.embedding_backend.encode(texts[offset:offset + self.batch_size]))
+        documents = []
+        position = 0
+        for file_id, text_content, spans in batch:
+            chunks = [
+                {'chunk_index': index, 'char_start': start, 'char_end': end,
+                 'embedding': array('f', vectors[position + index])}
+                for index, (start, end) in enumerate(spans)
+            ]
+            position += len(spans)
+            documents.append((file_id, text_content, chunks))
+        with self.processor.db_connection() as conn:
+            cur = conn.cursor()
+            self.processor._copy_chunks(cur, documents)
+            # Matters once servers search this version, e.g. when catching up after cut-over
+            notify_stored(cur)
+            cur.close()
+        stats['files'] += len(batch)
+        stats['chunks'] += len(texts)
+        batch.clear()
+    
+    def _throttle(self, stats: dict, started: float):
+        if self.rate > 0:
+            ahead = stats['files'] / self.rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    
+    def _report(self, stats: dict, started: float):
+        done = stats['files'] + stats['empty']
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = (stats['total'] - done) / rate if rate > 0 else 0.0
+        logger.info(
+            f"Embedding backfill: {done}/{stats['total']} files "
+            f"({stats['chunks']} chunks, {stats['empty']} without text), "
+            f"{rate:.1f} files/s, ~{remaining:.0f}s remaining"
+        )
+    
+    def prune(self, batch_size: int = 10000) -> dict:
+        """After cut-over, drop chunks of other versions and re-derive document embeddings
+        
+        Only files that have chunks of the configured version lose their
+        old chunks. Document embeddings become the mean of the new chunk
+        embeddings (cosine distance ignores the length).
+        """
+        model, version = self.processor.embedding_identity()
+        params = {'model': model, 'version': version, 'batch': batch_size}
+        stats = {'chunks_deleted': 0, 'files_updated': 0}
+        with self._lock() as locked:
+            if not locked:
+                logger.warning("An embedding backfill is running; not pruning")
+                return stats
+            while True:
+                with self.processor.db_connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute("""
+                        DELETE FROM document_chunks WHERE id IN (
+                            SELECT o.id FROM document_chunks o
+                            WHERE (o.embedding_model, o.embedding_version) <> (%(model)s, %(version)s)
+                              AND EXISTS (SELECT 1 FROM document_chunks c
+                                          WHERE c.file_id = o.file_id AND c.embedding_model = %(model)s
+                                            AND c.embedding_version = %(version)s)
+                            LIMIT %(batch)s
+                        )
+                    """, params)
+                    deleted = cur.rowcount
+                    cur.close()
+                stats['chunks_deleted'] += deleted
+                if deleted < batch_size:
+                    break
+            while True:
+                with self.processor.db_connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute("""
+                        UPDATE processed_files f
+                        SET embedding = m.embedding, embedding_model = %(model)s, embedding_version = %(version)s
+                        FROM (
+                            SELECT c.file_id, avg(c.embedding) AS embedding
+                            FROM document_chunks c
+                            WHERE c.embedding_model = %(model)s AND c.embedding_version = %(version)s
+                              AND c.file_id IN (
+                                  SELECT o.id FROM processed_files o
+                                  WHERE (o.embedding_model, o.embedding_version) <> (%(model)s, %(version)s)
+                                    AND EXISTS (SELECT 1 FROM document_chunks n
+                                                WHERE n.file_id = o.id AND n.embedding_model = %(model)s
+                                                  AND n.embedding_version = %(version)s)
+                                  LIMIT %(batch)s
+                              )
+                            GROUP BY c.file_id
+                        ) m
+                        WHERE f.id = m.file_id
+                    """, params)
+                    updated = cur.rowcount
+                    cur.close()
+                stats['files_updated'] += updated
+                if updated < batch_size:
+                    break
+        logger.info(f"Pruned {stats['chunks_deleted']} chunks of other embedding versions and "
+                    f"updated {stats['files_updated']} document embeddings")
+        return stats
+
 # Initialize processor
 processor = BriskLearningProcessor()
+job_queue = JobQueue(
+    processor,
+    workers=int(os.getenv('JOB_WORKERS', '2')),
+    executor_type=os.getenv('JOB_EXECUTOR', 'thread'),
+    stale_after=float(os.getenv('JOB_STALE_AFTER', '3600'))
+)
+metrics.add_collector(job_queue.collect_metrics)
+app.add_middleware(UploadAdmissionMiddleware, admission=processor.upload_admission, paths=("/upload",))
+
+@app.on_event("startup")
+def start_job_queue():
+    job_queue.start()
+
+@app.on_event("shutdown")
+def stop_job_queue():
+    job_queue.shutdown(wait=False)
+    processor.text_extractor.close()
+
+@app.on_event("startup")
+def start_embedding_warm_up():
+    # In the background, so /health answers while the model loads; /ready reports when it is done
+    if os.getenv('EMBEDDING_PRELOAD', 'true').lower() != 'false':
+        threading.Thread(target=processor.warm_up_embeddings, name="embedding-warm-up", daemon=True).start()
+
+# /upload parses its body itself, so the form is described for the OpenAPI docs here
+UPLOAD_REQUEST_BODY = {
+    'requestBody': {
+        'required': True,
+        'content': {
+            'multipart/form-data': {
+                'schema': {
+                    'type': 'object',
+                    'required': ['file'],
+                    'properties': {
+                        'file': {'type': 'string', 'format': 'binary'},
+                        'category': {'type': 'string', 'default': 'document'},
+                        'created_by': {'type': 'string', 'default': 'user'}
+                    }
+                }
+            }
+        }
+    }
+}
 
 # FastAPI endpoints
-@app.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    category: str = Form("document"),
-    created_by: str = Form("user")
-):
-    """Handle file upload via API"""
+@app.post("/upload", status_code=202, openapi_extra=UPLOAD_REQUEST_BODY)
+async def upload_file(request: Request, response: Response):
+    """Handle file upload via API; processing runs as a background job
+    
+    The multipart body is parsed as it streams in rather than spooled
+    first, so the file is written to disk once and oversize files are
+    cut off as soon as they cross MAX_FILE_SIZE.
+    """
     try:
-        # Save uploaded file temporarily
-        temp_dir = Path("/shared-files/incoming")
+        temp_dir = Path(processor.upload_admission.directory)
         temp_dir.mkdir(exist_ok=True)
         
-        temp_path = temp_dir / f"temp_{file.filename}"
+        # Hash, sniff and size-check the file while writing it, aborting oversize files early
+        upload = MultipartUpload(request.headers.get('content-type', ''), temp_dir, processor.max_file_size)
+        try:
+            async for chunk in request.stream():
+                if chunk:
+                    await run_in_threadpool(upload.write, chunk)
+            upload.finish()
+        except BaseException as e:
+            upload.discard()
+            if isinstance(e, FileTooLargeError):
+                raise HTTPException(status_code=413, detail=str(e))
+            if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                # The disk filled up despite the admission watermark; the client may retry later
+                raise HTTPException(status_code=503, detail="Not enough free disk space for uploads",
+                                    headers={'Retry-After': str(processor.upload_admission.retry_after)})
+            raise
+        temp_path = upload.path
+        ingested = upload.ingested
         
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Content that is already stored needs no processing at all
+        existing_id = await run_in_threadpool(processor.find_existing_file, ingested['file_hash'])
+        if existing_id:
+            os.remove(temp_path)
+            response.status_code = 200
+            return {
+                'success': True,
+                'file_id': existing_id,
+                'duplicate': True,
+                'status': 'completed',
+                'message': 'File already processed'
+            }
         
-        # Process the file
-        result = processor.process_file(
+        # Queue the file for processing; identical in-flight uploads share one job
+        job_id, created = await run_in_threadpool(
+            job_queue.create_job,
             str(temp_path), 
-            file.filename, 
-            category=category,
+            upload.filename, 
+            category=upload.fields.get('category', "document"),
             source_type="api_upload",
-            created_by=created_by
+            created_by=upload.fields.get('created_by', "user"),
+            ingested=ingested
         )
+        if created:
+            job_queue.submit(job_id)
+        else:
+            os.remove(temp_path)
         
-        return result
+        return {
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'deduplicated': not created,
+            'message': 'File queued for processing' if created else 'Identical file already queued'
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Upload endpoint failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -455,11 +5016,13 @@ async def submit_form(
             }
         }
         
-        # Generate embeddings
-        embedding = processor.generate_embeddings(text_content)
+        # Generate chunk embeddings
+        embedding, chunks = await run_in_threadpool(processor.embed_document, text_content)
         
         # Store in database
-        file_id = processor.store_in_database(file_info, text_content, embedding)
+        file_id = await run_in_threadpool(
+            processor.store_in_database, file_info, text_content, embedding, chunks
+        )
         
         if file_id:
             return {
@@ -474,16 +5037,25 @@ async def submit_form(
         logger.error(f"Form submission failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Report per-stage progress and the final result of an upload job"""
+    try:
+        job = await run_in_threadpool(job_queue.get_job, job_id)
+    except Exception as e:
+        logger.error(f"Job lookup failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
-        # Test database connection
-        conn = processor.get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.close()
-        conn.close()
+        # Test database connection; waiting for a pooled connection must not block the event loop
+        await run_in_threadpool(processor.ping_database)
         
         return {
             'status': 'healthy',
@@ -491,8 +5063,22 @@ async def health_check():
             'timestamp': datetime.now().isoformat(),
             'services': {
                 'database': 'connected',
-                'embeddings': 'available' if processor.model else 'unavailable',
+                'embeddings': processor.embedding_backend.state,
                 'storage': 'available' if processor.blob_client else 'unavailable'
+            },
+            'database_pool': processor.db_pool.stats(),
+            'dedup_cache': processor.known_hashes.stats(),
+            'clamav': processor.clamav.stats() if processor.clamav else None,
+            'text_extractor': processor.text_extractor.stats(),
+            'embedding_backend': processor.embedding_backend.stats(),
+            'embedding_version': processor.embedding_version,
+            'embedding_batcher': processor.embedding_batcher.stats(),
+            'upload_admission': processor.upload_admission.stats(),
+            'search_cache': {
+                'query_embeddings': processor.query_embeddings.stats(),
+                'results': processor.search_results.stats(),
+                'version': processor.search_version,
+                'invalidation_live': processor.search_invalidation_live
             }
         }
     except Exception as e:
@@ -502,57 +5088,414 @@ async def health_check():
             'timestamp': datetime.now().isoformat()
         }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage timings, byte and error counters, queue depth and pool gauges for Prometheus"""
+    body = await run_in_threadpool(metrics.render)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """Readiness check: 503 until the embedding model is loaded and the database answers
+    
+    /health stays the liveness check and answers while the model loads.
+    """
+    checks = {'embeddings': processor.embedding_backend.state, 'database': 'connected'}
+    try:
+        await run_in_threadpool(processor.ping_database)
+    except Exception as e:
+        checks['database'] = f"unavailable: {e}"
+    
+    ready = processor.embeddings_ready and checks['database'] == 'connected'
+    if not ready:
+        response.status_code = 503
+    return {'ready': ready, 'checks': checks, 'timestamp': datetime.now().isoformat()}
+
 @app.get("/search")
-async def search_similar(query: str, limit: int = 5):
-    """Search for similar documents using vector similarity"""
+async def search_similar(query: str, limit: int = 5, offset: int = 0, category: Optional[str] = None,
+                         source_type: Optional[str] = None, environment: Optional[str] = None,
+                         probes: Optional[int] = None, ef_search: Optional[int] = None,
+                         mode: str = "vector", vector_weight: float = 1.0, lexical_weight: float = 1.0):
+    """Search documents by vector similarity, full-text match or both
+
+    mode is 'vector', 'lexical' or 'hybrid'; hybrid fuses both rankings,
+    weighted by vector_weight and lexical_weight. category, source_type and
+    environment filter the results; offset pages through them. probes
+    (ivfflat) and ef_search (HNSW) trade latency for recall per request.
+    """
     try:
-        if not processor.model:
-            raise HTTPException(status_code=503, detail="Embedding model not available")
-        
-        # Generate embedding for query
-        query_embedding = processor.generate_embeddings(query)
-        if not query_embedding:
-            raise HTTPException(status_code=500, detail="Failed to generate query embedding")
+        if not 1 <= limit <= SEARCH_MAX_LIMIT:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+        if not 0 <= offset <= SEARCH_MAX_OFFSET:
+            raise HTTPException(status_code=400, detail=f"offset must be between 0 and {SEARCH_MAX_OFFSET}")
+        if mode not in processor.SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(processor.SEARCH_MODES)}")
+        if vector_weight < 0 or lexical_weight < 0:
+            raise HTTPException(status_code=400, detail="Weights must not be negative")
         
-        # Search database
-        conn = processor.get_db_connection()
-        cur = conn.cursor()
+        cache_key = (query, mode, limit, offset, category, source_type, environment,
+                     probes, ef_search, vector_weight, lexical_weight)
+        version = processor.search_version
+        results = processor.search_results.get((version, cache_key))
         
-        cur.execute("""
-            SELECT id, filename, original_filename, text_content, 
-                   (embedding <=> %s::vector) as similarity,
-                   processed_date, category, source_type
-            FROM processed_files 
-            WHERE embedding IS NOT NULL
-            ORDER BY similarity
-            LIMIT %s
-        """, (query_embedding, limit))
-        
-        results = cur.fetchall()
-        cur.close()
-        conn.close()
+        if results is None:
+            # Lexical search needs no embedding
+            query_embedding = None
+            if mode != "lexical":
+                if not processor.embeddings_available:
+                    raise HTTPException(status_code=503, detail="Embedding model not available")
+                if processor.embedding_backend.state == "loading":
+                    raise HTTPException(status_code=503, detail="Embedding model is loading",
+                                        headers={'Retry-After': '5'})
+                
+                # Generate embedding for query
+                query_embedding = await processor.embed_query_async(query)
+                if not query_embedding:
+                    raise HTTPException(status_code=500, detail="Failed to generate query embedding")
+            
+            # Search database
+            filters = {'category': category, 'source_type': source_type, 'environment': environment}
+            with metrics.stage('search'):
+                results = await run_in_threadpool(
+                    processor.search_documents, query_embedding, limit, probes, ef_search, filters, offset,
+                    query, mode, vector_weight, lexical_weight
+                )
+            # Keyed by the version read before searching, so a result racing an insert is never served
+            if processor.search_invalidation_live:
+                processor.search_results.put((version, cache_key), results)
         
         return {
             'query': query,
-            'results': [
-                {
-                    'id': r[0],
-                    'filename': r[1],
-                    'original_filename': r[2],
-                    'text_preview': r[3][:200] + "..." if len(r[3]) > 200 else r[3],
-                    'similarity': float(r[4]),
-                    'processed_date': r[5].isoformat() if r[5] else None,
-                    'category': r[6],
-                    'source_type': r[7]
-                }
-                for r in results
-            ]
+            'mode': mode,
+            'results': results,
+            'offset': offset,
+            'next_offset': offset + limit if len(results) == limit else None
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Search failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def serve_api(host: str = "0.0.0.0", port: int = 8000, workers: int = 1, shared_embeddings: bool = True):
+    """Run the API server, optionally as several worker processes
+    
+    With shared_embeddings the workers use the remote backend, and one
+    embedding server process holds the model for all of them.
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    
+    stopping = threading.Event()
+    embedding_server = None
+    watcher = None
+    if shared_embeddings and os.getenv('EMBEDDING_BACKEND') != 'remote':
+        socket_path = os.getenv('EMBEDDING_SERVER_SOCKET', DEFAULT_EMBEDDING_SOCKET)
+        backend_name = os.getenv('EMBEDDING_BACKEND')
+        context = multiprocessing.get_context("spawn")
+        
+        def start_embedding_server():
+            process = context.Process(
+                target=run_embedding_server, args=(socket_path, backend_name), name="embedding-server"
+            )
+            process.start()
+            return process
+        
+        def watch_embedding_server():
+            # Workers reconnect on their own, so a crashed server only needs starting again
+            nonlocal embedding_server
+            while not stopping.is_set():
+                embedding_server.join(timeout=1)
+                if embedding_server.exitcode is not None and not stopping.is_set():
+                    logger.error(f"Embedding server exited with code {embedding_server.exitcode}; restarting")
+                    time.sleep(1)
+                    embedding_server = start_embedding_server()
+        
+        embedding_server = start_embedding_server()
+        watcher = threading.Thread(target=watch_embedding_server, name="embedding-server-watch", daemon=True)
+        watcher.start()
+        os.environ['EMBEDDING_BACKEND'] = 'remote'
+        os.environ['EMBEDDING_SERVER_SOCKET'] = socket_path
+    
+    # Set only now, so the embedding server counts as a helper and workers as serving processes
+    os.environ['API_SUPERVISOR_PID'] = str(os.getpid())
+    try:
+        # Spawned workers run this file as their __main__, so the app is not imported a second time
+        uvicorn.run("__main__:app", host=host, port=port, workers=workers)
+    finally:
+        stopping.set()
+        if watcher:
+            watcher.join()
+            embedding_server.terminate()
+            embedding_server.join(timeout=10)
+
+def describe_api_memory(supervisor_pid: int, embedding_server_pid: Optional[int] = None) -> dict:
+    """Memory of a multi-worker API server's process tree, in MB
+    
+    Workers are the spawned children of the supervisor; any other process
+    in the tree (resource tracker, extraction or job pools) is a helper.
+    """
+    def is_spawned(pid: int) -> bool:
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                return b'spawn_main' in f.read()
+        except OSError:
+            return False
+    
+    workers = [pid for pid in child_pids(supervisor_pid) if pid != embedding_server_pid and is_spawned(pid)]
+    helpers = []
+    pending = [pid for pid in child_pids(supervisor_pid) if pid != embedding_server_pid and pid not in workers]
+    pending.extend(child for pid in workers + [embedding_server_pid] if pid for child in child_pids(pid))
+    while pending:
+        pid = pending.pop()
+        helpers.append(pid)
+        pending.extend(child_pids(pid))
+    
+    def mb(value: Optional[int]) -> Optional[float]:
+        return round(value / 2 ** 20, 1) if value is not None else None
+    
+    supervisor = process_memory(supervisor_pid)
+    server = process_memory(embedding_server_pid) if embedding_server_pid else {'rss': None, 'pss': None}
+    worker_memory = [process_memory(pid) for pid in workers]
+    helper_pss = sum(process_memory(pid)['pss'] or 0 for pid in helpers)
+    worker_rss = [memory['rss'] or 0 for memory in worker_memory]
+    worker_pss = [memory['pss'] or 0 for memory in worker_memory]
+    return {
+        'worker_processes': len(workers),
+        'supervisor_rss_mb': mb(supervisor['rss']),
+        'embedding_server_rss_mb': mb(server['rss']),
+        'embedding_server_pss_mb': mb(server['pss']),
+        'worker_rss_mb_mean': mb(sum(worker_rss) / len(workers)) if workers else None,
+        'worker_rss_mb_max': mb(max(worker_rss)) if workers else None,
+        'worker_pss_mb_mean': mb(sum(worker_pss) / len(workers)) if workers else None,
+        'worker_pss_mb_max': mb(max(worker_pss)) if workers else None,
+        'helper_processes': len(helpers),
+        'helper_pss_mb': mb(helper_pss),
+        'total_pss_mb': mb((supervisor['pss'] or 0) + (server['pss'] or 0) + sum(worker_pss) + helper_pss)
+    }
+
+def benchmark_api_workers(worker_counts: list, modes: list, port: int = 8100, settle: float = 5.0,
+                          timeout: float = 600.0) -> list:
+    """Start the API server per worker count and embedding mode, and measure its memory once ready"""
+    report = []
+    for workers in worker_counts:
+        # A single worker has nothing to share the model with
+        for mode in (["local"] if workers <= 1 else modes):
+            socket_path = f"/tmp/file-processor-embeddings-{port}.sock"
+            env = dict(os.environ, EMBEDDING_SERVER_SOCKET=socket_path)
+            started = time.perf_counter()
+            server = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", "--host", "127.0.0.1", "--port", str(port),
+                 "--workers", str(workers), "--embedding", mode],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                # Requests land on any worker; enough ready answers in a row mean all have loaded
+                streak = 0
+                while streak < workers * 2:
+                    if server.poll() is not None:
+                        raise RuntimeError(f"API server exited with code {server.returncode} during startup")
+                    if time.perf_counter() - started > timeout:
+                        raise RuntimeError(f"API server with {workers} workers ({mode}) not ready after {timeout:.0f}s")
+                    try:
+                        ready = requests.get(f"http://127.0.0.1:{port}/ready", timeout=5).status_code == 200
+                    except requests.RequestException:
+                        ready = False
+                    streak = streak + 1 if ready else 0
+                    time.sleep(0.1 if ready else 1)
+                startup = time.perf_counter() - started
+                time.sleep(settle)
+                
+                embedding_server_pid = None
+                if mode == "shared" and workers > 1:
+                    status, _ = RemoteEmbeddingBackend(socket_path, timeout=10)._call({'op': 'status'})
+                    embedding_server_pid = status['pid']
+                row = {'workers': workers, 'mode': mode, 'startup_s': round(startup, 2)}
+                row.update(describe_api_memory(server.pid, embedding_server_pid))
+                report.append(row)
+            finally:
+                server.send_signal(signal.SIGINT)
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+                    server.wait()
+    return report
+
 if __name__ == "__main__":
-    # Start the API server
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description="BriskLearning File Processor")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="Run the API server (default)")
+    serve_parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    serve_parser.add_argument("--workers", type=int, default=int(os.getenv('API_WORKERS', '1')),
+                              help="API worker processes")
+    serve_parser.add_argument("--embedding", choices=["shared", "local"], default=os.getenv('EMBEDDING_MODE', 'shared'),
+                              help="One embedding server for all workers, or a model in every worker")
+    
+    ingest_parser = commands.add_parser("ingest", help="Ingest every file in a directory")
+    ingest_parser.add_argument("--dir", default="/shared-files/incoming", help="Directory to ingest")
+    ingest_parser.add_argument("--workers", type=int, default=int(os.getenv('BULK_WORKERS', str(os.cpu_count() or 2))),
+                               help="Worker processes for hashing, extraction and embedding")
+    ingest_parser.add_argument("--batch-size", type=int, default=int(os.getenv('BULK_BATCH_SIZE', '50')),
+                               help="Files stored per database transaction")
+    ingest_parser.add_argument("--category", default="document", help="Category recorded for ingested files")
+    ingest_parser.add_argument("--min-age", type=float, default=30.0,
+                               help="Skip files modified within this many seconds")
+    ingest_parser.add_argument("--watch", action="store_true", help="Keep ingesting on a schedule")
+    ingest_parser.add_argument("--interval", type=int, default=60, help="Seconds between watch passes")
+    
+    index_parser = commands.add_parser("index", help="Create or rebuild vector indexes as needed")
+    index_parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the index looks current")
+    
+    bench_parser = commands.add_parser("benchmark-index", help="Measure vector index recall and latency")
+    bench_parser.add_argument("--sizes", default="10000,100000", help="Comma-separated corpus sizes")
+    bench_parser.add_argument("--queries", type=int, default=100, help="Queries per setting")
+    bench_parser.add_argument("--k", type=int, default=10, help="Neighbours per query for recall@k")
+    bench_parser.add_argument("--source", choices=["random", "chunks"], default="random",
+                              help="Random unit vectors or stored chunk embeddings")
+    bench_parser.add_argument("--index-type", choices=["ivfflat", "hnsw"], action="append",
+                              help="Index type to benchmark (default: both)")
+    bench_parser.add_argument("--storage", choices=list(VectorIndexManager.STORAGES), action="append",
+                              help="Index storage to benchmark (default: vector)")
+    bench_parser.add_argument("--rerank", help="Comma-separated re-rank multipliers for compact storages")
+    bench_parser.add_argument("--output", help="Write results as JSON to this file")
+    
+    export_parser = commands.add_parser("export-onnx", help="Export the embedding model for the onnx backend")
+    export_parser.add_argument("--output", default=os.getenv('EMBEDDING_ONNX_PATH', '/models/all-MiniLM-L6-v2-onnx'),
+                               help="Directory to write the model and tokenizer to")
+    export_parser.add_argument("--model", default=os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2'),
+                               help="sentence-transformers model to export")
+    export_parser.add_argument("--no-quantize", action="store_true", help="Keep fp32 weights")
+    
+    embed_bench_parser = commands.add_parser("benchmark-embeddings",
+                                             help="Compare embedding backends' startup, memory and throughput")
+    embed_bench_parser.add_argument("--backends", default="sentence-transformers,onnx",
+                                    help="Comma-separated backends; the first is the accuracy reference")
+    embed_bench_parser.add_argument("--texts", type=int, default=512, help="Texts encoded for throughput")
+    embed_bench_parser.add_argument("--batch-size", type=int, default=32, help="Texts per encode call")
+    embed_bench_parser.add_argument("--queries", type=int, default=100, help="Single-text encodes for latency")
+    embed_bench_parser.add_argument("--output", help="Write results as JSON to this file")
+    
+    migrate_parser = commands.add_parser("migrate",
+                                         help="Apply schema changes that rewrite or index populated tables")
+    migrate_parser.add_argument("--lock-timeout", default=os.getenv('DB_MIGRATION_LOCK_TIMEOUT', '5s'),
+                                help="Longest wait for a table lock before giving up")
+    
+    reembed_parser = commands.add_parser("reembed",
+                                         help="Re-embed stored documents for EMBEDDING_MODEL/EMBEDDING_VERSION")
+    reembed_parser.add_argument("--batch-size", type=int, default=256, help="Texts per encode call")
+    reembed_parser.add_argument("--rate", type=float, default=0.0,
+                                help="Most files re-embedded per second (0 for no limit)")
+    reembed_parser.add_argument("--status", action="store_true",
+                                help="Report stored versions and pending files, then exit")
+    reembed_parser.add_argument("--prune", action="store_true",
+                                help="After cut-over, delete chunks of other versions")
+    
+    workers_bench_parser = commands.add_parser("benchmark-workers",
+                                               help="Measure API memory per worker count and embedding mode")
+    workers_bench_parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    workers_bench_parser.add_argument("--modes", default="shared,local", help="Comma-separated embedding modes")
+    workers_bench_parser.add_argument("--port", type=int, default=8100, help="Port for the servers under test")
+    workers_bench_parser.add_argument("--settle", type=float, default=5.0,
+                                      help="Seconds to wait after readiness before measuring")
+    workers_bench_parser.add_argument("--output", help="Write results as JSON to this file")
+    
+    args = parser.parse_args()
+    
+    if args.command == "index":
+        print(json.dumps(processor.index_manager.maintain(force=args.rebuild), indent=2))
+    elif args.command == "benchmark-index":
+        report = processor.index_manager.benchmark(
+            [int(size) for size in args.sizes.split(',')],
+            queries=args.queries,
+            k=args.k,
+            source=args.source,
+            index_types=args.index_type,
+            storages=args.storage,
+            multipliers=[int(value) for value in args.rerank.split(',')] if args.rerank else None
+        )
+        print(f"{'rows':>9} {'index':>8} {'storage':>8} {'setting':>26} {'recall':>7} {'p50 ms':>8} "
+              f"{'p99 ms':>8} {'build s':>8} {'index MB':>9}")
+        for row in report:
+            print(f"{row['rows']:>9} {row['index']:>8} {row['storage']:>8} {row['setting'] or '-':>26} "
+                  f"{row['recall']:>7.3f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['build_s']:>8.2f} "
+                  f"{row['index_mb']:>9.2f}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    elif args.command == "export-onnx":
+        print(json.dumps(export_onnx_model(args.output, args.model, quantize=not args.no_quantize), indent=2))
+    elif args.command == "benchmark-embeddings":
+        # Sentences of 5 to 150 words drawn from the validation vocabulary
+        words = " ".join(EMBEDDING_VALIDATION_TEXTS).split()
+        rng = np.random.default_rng(42)
+        texts = [" ".join(rng.choice(words, size=int(rng.integers(5, 150)))) for _ in range(args.texts)]
+        report = []
+        for name in args.backends.split(','):
+            # A fresh process per backend, so startup and memory are measured from scratch
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                report.append(pool.submit(
+                    benchmark_embedding_backend, name, texts, args.batch_size, args.queries
+                ).result())
+        reference = report[0]['vectors']
+        for row in report:
+            row['min_cosine'] = round(cosine_agreement(reference, row.pop('vectors')), 5)
+        print(f"{'backend':>22} {'startup s':>9} {'rss MB':>8} {'model MB':>8} {'texts/s':>8} "
+              f"{'p50 ms':>7} {'p99 ms':>7} {'cosine':>8}")
+        for row in report:
+            print(f"{row['backend']:>22} {row['startup_s']:>9.2f} {row['rss_mb'] or 0:>8.1f} "
+                  f"{row['model_rss_mb'] or 0:>8.1f} {row['texts_per_s']:>8.1f} {row['query_p50_ms']:>7.2f} "
+                  f"{row['query_p99_ms']:>7.2f} {row['min_cosine']:>8.5f}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    elif args.command == "migrate":
+        pending = processor.init_database(rewrite=True, lock_timeout=args.lock_timeout)
+        print(json.dumps({'pending': pending}, indent=2))
+    elif args.command == "reembed":
+        backfill = EmbeddingBackfill(processor, batch_size=args.batch_size, rate=args.rate)
+        if args.status:
+            print(json.dumps(backfill.status(), indent=2))
+        elif args.prune:
+            print(json.dumps(backfill.prune(), indent=2))
+        else:
+            print(json.dumps(backfill.run(), indent=2))
+    elif args.command == "benchmark-workers":
+        report = benchmark_api_workers(
+            [int(count) for count in args.workers.split(',')],
+            args.modes.split(','),
+            port=args.port,
+            settle=args.settle
+        )
+        print(f"{'workers':>7} {'mode':>6} {'startup s':>9} {'server MB':>9} {'worker RSS':>10} "
+              f"{'worker PSS':>10} {'max PSS':>8} {'helpers':>7} {'total PSS':>9}")
+        for row in report:
+            print(f"{row['workers']:>7} {row['mode']:>6} {row['startup_s']:>9.2f} "
+                  f"{row['embedding_server_pss_mb'] or 0:>9.1f} {row['worker_rss_mb_mean'] or 0:>10.1f} "
+                  f"{row['worker_pss_mb_mean'] or 0:>10.1f} {row['worker_pss_mb_max'] or 0:>8.1f} "
+                  f"{row['helper_processes']:>7} {row['total_pss_mb']:>9.1f}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    elif args.command == "ingest":
+        ingestor = BulkIngestor(
+            processor,
+            directory=args.dir,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            category=args.category,
+            min_age=args.min_age
+        )
+        if args.watch:
+            ingestor.watch(args.interval)
+        else:
+            ingestor.run()
+    elif args.command == "serve":
+        serve_api(args.host, args.port, args.workers, shared_embeddings=args.embedding == "shared")
+    else:
+        # Start the API server
+        serve_api(workers=int(os.getenv('API_WORKERS', '1')),
+                  shared_embeddings=os.getenv('EMBEDDING_MODE', 'shared') == "shared")
@@ -0,0 +1,107 @@
+"""Loads the file processor module once for the unit tests
+
+The module reads its configuration and connects to its services at import
+time. Stand-ins are used for every variable the environment does not
+already set; an unreachable database just makes startup log its failures.
+
+Tests taking the db fixture run against PostgreSQL with pgvector. Point
+TEST_DATABASE_DSN at a server where the user may create databases; each
+session works in a scratch database of its own and drops it afterwards.
+Without TEST_DATABASE_DSN those tests are skipped.
+"""
+import importlib.util
+import os
+import sys
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_DIR = os.path.dirname(HERE)
+
+TEST_ENVIRONMENT = {
+    'PGHOST': '127.0.0.1',
+    'PGPORT': '1',
+    'ENVIRONMENT': 'test',
+    'EMBEDDING_BACKEND': 'stub',
+    'EMBEDDING_PRELOAD': 'false',
+    'CLAMAV_ENABLED': 'false',
+    'EXTRACT_CACHE_DIR': ''
+}
+
+def load_module():
+    if "file_processor" in sys.modules:
+        return sys.modules["file_processor"]
+    for key, value in TEST_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    # Deployed as file_processor.py; named file-processor.py in the repository
+    for filename in ("file_processor.py", "file-processor.py"):
+        path = os.path.join(MODULE_DIR, filename)
+        if os.path.exists(path):
+            spec = importlib.util.spec_from_file_location("file_processor", path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules["file_processor"] = module
+            spec.loader.exec_module(module)
+            return module
+    raise FileNotFoundError(f"No file processor module found in {MODULE_DIR}")
+
+@pytest.fixture(scope="session")
+def fp():
+    return load_module()
+
+@pytest.fixture(scope="session")
+def database_config():
+    dsn = os.getenv('TEST_DATABASE_DSN')
+    if not dsn:
+        pytest.skip("TEST_DATABASE_DSN is not set")
+    name = f"file_processor_test_{os.getpid()}"
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    cur = admin.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS {name}")
+    cur.execute(f"CREATE DATABASE {name}")
+    settings = psycopg2.extensions.parse_dsn(dsn)
+    try:
+        yield {
+            'host': settings.get('host', 'localhost'),
+            'port': settings.get('port', '5432'),
+            'user': settings.get('user', ''),
+            'password': settings.get('password', ''),
+            'database': name
+        }
+    finally:
+        cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.close()
+
+@pytest.fixture(scope="session")
+def db_processor(fp, database_config):
+    """A processor of its own, migrated on construction like a serving process"""
+    variables = {'PGHOST': 'host', 'PGPORT': 'port', 'PGUSER': 'user',
+                 'PGPASSWORD': 'password', 'PGDATABASE': 'database'}
+    saved = {variable: os.environ.get(variable) for variable in variables}
+    os.environ.update({variable: str(database_config[key]) for variable, key in variables.items()})
+    try:
+        processor = fp.BriskLearningProcessor()
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+    yield processor
+    processor.db_pool.close()
+
+@pytest.fixture
+def db(fp, db_processor):
+    """The database processor with empty tables and caches"""
+    with db_processor.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            TRUNCATE processed_files, document_chunks, processing_log, processing_jobs
+            RESTART IDENTITY CASCADE
+        """)
+        cur.close()
+    db_processor.known_hashes = fp.KnownHashCache(bloom_bits=1 << 16)
+    db_processor.invalidate_search_results()
+    return db_processor
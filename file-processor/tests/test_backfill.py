@@ -0,0 +1,174 @@
+from contextlib import contextmanager
+
+import pytest
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.db.queries.append(sql)
+        if "pg_try_advisory_lock" in sql or "pg_advisory_unlock" in sql:
+            self.rows = [(True,)]
+        elif "atttypmod" in sql:
+            self.rows = [(-1,)]
+        elif "count(*)" in sql:
+            self.rows = [(len(self.db.texts),)]
+        elif "SELECT f.id" in sql:
+            ids = sorted(i for i in self.db.texts if i > params['after'])
+            self.rows = [(i,) for i in ids[:params['window']]]
+        elif "SELECT id, text_content" in sql:
+            self.rows = [(i, self.db.texts[i]) for i in sorted(params[0])]
+        else:
+            self.rows = []
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    autocommit = False
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, name=None):
+        assert name is None, "server-side cursors outlive the batch"
+        return FakeCursor(self.db)
+
+    def close(self):
+        pass
+
+class FakeBackend:
+    def __init__(self, db):
+        self.db = db
+
+    def encode(self, texts):
+        assert self.db.open_transactions == 0, "encoding inside a read transaction"
+        return [[0.0, 1.0] for _ in texts]
+
+class FakeIndexManager:
+    def maintain(self):
+        pass
+
+class FakeProcessor:
+    def __init__(self, texts):
+        self.texts = texts
+        self.queries = []
+        self.open_transactions = 0
+        self.stored = []
+        self.embedding_backend = FakeBackend(self)
+        self.index_manager = FakeIndexManager()
+
+    def embedding_identity(self):
+        return ("stub", 2)
+
+    def chunk_text(self, text):
+        return [(0, len(text))] if text.strip() else []
+
+    def get_db_connection(self):
+        return FakeConnection(self)
+
+    @contextmanager
+    def db_connection(self):
+        self.open_transactions += 1
+        try:
+            yield FakeConnection(self)
+        finally:
+            self.open_transactions -= 1
+
+    def _copy_chunks(self, cur, documents):
+        self.stored.extend(file_id for file_id, _, _ in documents)
+
+def test_backfill_reads_in_short_transactions(fp):
+    texts = {i: f"document {i}" for i in range(1, 26)}
+    texts[7] = "   "
+    processor = FakeProcessor(texts)
+    backfill = fp.EmbeddingBackfill(processor, batch_size=4, window=10)
+    backfill.PAGE_SIZE = 3
+    stats = backfill.run()
+    assert stats['total'] == 25
+    assert (stats['files'], stats['chunks'], stats['empty']) == (24, 24, 1)
+    assert sorted(processor.stored) == [i for i in range(1, 26) if i != 7]
+    # Three windows of ids, the last one short
+    assert sum("SELECT f.id" in sql for sql in processor.queries) == 3
+    assert sum("SELECT id, text_content" in sql for sql in processor.queries) == 10
+
+def store(db, n, chunked=True):
+    text = f"stored document {n} about backfills" if n >= 0 else ""
+    embedding, chunks = db.embed_document(text) if text else (None, [])
+    file_info = {'file_hash': f"{n:+064d}", 'filename': f"doc-{n}.txt", 'file_type': 'text/plain',
+                 'file_size': len(text)}
+    return db.store_in_database(file_info, text, embedding, chunks if chunked else [])
+
+def chunk_versions(db):
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT embedding_version, count(DISTINCT file_id) FROM document_chunks
+            GROUP BY embedding_version ORDER BY embedding_version
+        """)
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+def test_backfill_reembeds_every_window(fp, db, monkeypatch):
+    for n in range(23):
+        store(db, n)
+    for n in range(23, 26):
+        # Stored before chunking
+        store(db, n, chunked=False)
+    store(db, -1)
+    assert chunk_versions(db) == [(1, 23)]
+
+    monkeypatch.setattr(db, "embedding_version", 2)
+    monkeypatch.setattr(db.index_manager, "maintain", lambda: None)
+    backfill = fp.EmbeddingBackfill(db, batch_size=4, window=10)
+    monkeypatch.setattr(backfill, "PAGE_SIZE", 3)
+    assert backfill.status()['pending_files'] == 26
+    stats = backfill.run()
+    assert (stats['total'], stats['files'], stats['empty']) == (26, 26, 0)
+    # Old vectors stay until every server has switched to the new version
+    assert chunk_versions(db) == [(1, 23), (2, 26)]
+    assert backfill.status()['pending_files'] == 0
+    assert backfill.run()['total'] == 0
+
+    query = db.embedding_backend.encode(["stored document 24"])[0].tolist()
+    results = db.search_documents(query, limit=1)
+    assert results[0]['original_filename'] == "doc-24.txt" and results[0]['matched_chunk'] == 0
+
+def test_interrupted_backfill_resumes(fp, db, monkeypatch):
+    for n in range(12):
+        store(db, n)
+    monkeypatch.setattr(db, "embedding_version", 2)
+    monkeypatch.setattr(db.index_manager, "maintain", lambda: None)
+    backfill = fp.EmbeddingBackfill(db, batch_size=4, window=5)
+    flush = backfill._flush
+    flushes = []
+    def crash_on_third(batch, stats):
+        flushes.append(len(batch))
+        if len(flushes) == 3:
+            raise RuntimeError("killed")
+        flush(batch, stats)
+    monkeypatch.setattr(backfill, "_flush", crash_on_third)
+    with pytest.raises(RuntimeError):
+        backfill.run()
+    assert chunk_versions(db) == [(1, 12), (2, 8)]
+
+    monkeypatch.setattr(backfill, "_flush", flush)
+    stats = backfill.run()
+    assert (stats['total'], stats['files']) == (4, 4)
+    assert chunk_versions(db) == [(1, 12), (2, 12)]
+
+def test_one_backfill_at_a_time(fp, db):
+    store(db, 0)
+    backfill = fp.EmbeddingBackfill(db)
+    with backfill._lock() as locked:
+        assert locked
+        assert backfill.run()['total'] == 0
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+
+import pytest
+from azure.core.exceptions import ResourceExistsError
+
+class FakeBlob:
+    def __init__(self, service, container, name):
+        self.service = service
+        self.key = (container, name)
+        self.url = f"https://account.blob.core.windows.net/{container}/{name}"
+
+    def exists(self):
+        # A concurrent upload may land between this check and ours
+        return self.key in self.service.blobs and self.key not in self.service.racing
+
+    def upload_blob(self, data, length, overwrite, max_concurrency, **options):
+        assert not overwrite
+        if self.service.error:
+            raise self.service.error
+        if self.key in self.service.blobs:
+            raise ResourceExistsError("The specified blob already exists")
+        content = data.read()
+        assert len(content) == length
+        self.service.uploads.append(self.key)
+        self.service.blobs[self.key] = (content, options)
+
+class FakeBlobService:
+    def __init__(self):
+        self.blobs = {}
+        self.uploads = []
+        self.racing = set()
+        self.containers = []
+        self.error = None
+
+    def create_container(self, name):
+        self.containers.append(name)
+        raise ResourceExistsError("The specified container already exists")
+
+    def get_blob_client(self, container, blob):
+        return FakeBlob(self, container, blob)
+
+@pytest.fixture
+def service(fp, monkeypatch):
+    service = FakeBlobService()
+    monkeypatch.setattr(fp.processor, "blob_client", service)
+    monkeypatch.setattr(fp.processor, "_containers", set())
+    return service
+
+def upload(fp, tmp_path, content, filename):
+    path = tmp_path / filename
+    path.write_bytes(content)
+    file_info = {'file_hash': hashlib.sha256(content).hexdigest(), 'file_type': 'application/pdf',
+                 'original_filename': filename}
+    return fp.processor.submit_upload(str(path), "processed", file_info).result(5), file_info
+
+def test_identical_content_is_stored_once(fp, service, tmp_path):
+    url, file_info = upload(fp, tmp_path, b"%PDF report", "Q3 report.pdf")
+    name = f"{fp.processor.environment}/sha256/{file_info['file_hash'][:2]}/{file_info['file_hash']}"
+    assert url.endswith(f"/processed/{name}")
+    content, options = service.blobs[('processed', name)]
+    assert content == b"%PDF report"
+    assert options['content_settings'].content_type == 'application/pdf'
+    assert options['metadata'] == {'original_filename': "Q3%20report.pdf"}
+
+    # Same bytes under another name: found by its hash, not uploaded again
+    assert upload(fp, tmp_path, b"%PDF report", "copy.pdf")[0] == url
+    assert service.uploads == [('processed', name)]
+    assert service.containers == ["processed"]
+
+def test_concurrent_upload_of_the_same_content(fp, service, tmp_path):
+    first, file_info = upload(fp, tmp_path, b"shared", "a.pdf")
+    service.racing.add(('processed', fp.processor.blob_name_for(file_info['file_hash'])))
+    assert upload(fp, tmp_path, b"shared", "b.pdf")[0] == first
+    assert len(service.uploads) == 1
+
+def test_uploads_run_in_parallel(fp, service, tmp_path, monkeypatch):
+    barrier = threading.Barrier(2, timeout=5)
+    upload_blob = FakeBlob.upload_blob
+    def meet_then_upload(self, *args, **kwargs):
+        # Both uploads must be in flight at once to get past the barrier
+        barrier.wait()
+        return upload_blob(self, *args, **kwargs)
+    monkeypatch.setattr(FakeBlob, "upload_blob", meet_then_upload)
+    futures = []
+    for name in ("a.pdf", "b.pdf"):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        file_info = {'file_hash': hashlib.sha256(name.encode()).hexdigest(), 'file_type': 'application/pdf'}
+        futures.append(fp.processor.submit_upload(str(path), "processed", file_info))
+    assert all(future.result(10) for future in futures)
+    assert len(service.uploads) == 2
+
+def test_failed_upload_resolves_to_none(fp, service, tmp_path):
+    service.error = OSError("connection reset")
+    assert upload(fp, tmp_path, b"data", "a.pdf")[0] is None
@@ -0,0 +1,87 @@
+import fcntl
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+@pytest.fixture
+def ingest(fp, db, tmp_path, monkeypatch):
+    """A BulkIngestor on tmp_path whose workers are threads sharing the db processor"""
+    monkeypatch.setattr(fp, "processor", db)
+    monkeypatch.setattr(fp, "ProcessPoolExecutor",
+                        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    moves = []
+    def move(source, destination):
+        moves.append((os.path.basename(source), destination))
+        os.remove(source)
+    monkeypatch.setattr(fp.shutil, "move", move)
+    batches = []
+    store_many = db.store_many
+    def record_batch(prepared):
+        batches.append(len(prepared))
+        return store_many(prepared)
+    monkeypatch.setattr(db, "store_many", record_batch)
+    maintained = []
+    monkeypatch.setattr(db.index_manager, "maintain", lambda: maintained.append(True))
+
+    ingestor = fp.BulkIngestor(db, directory=str(tmp_path), workers=2, batch_size=2, progress_interval=0)
+    ingestor.moves = moves
+    ingestor.batches = batches
+    ingestor.maintained = maintained
+    return ingestor
+
+def write(directory, name, content, age=120):
+    path = directory / name
+    path.write_bytes(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_ingests_ready_files_in_batches(db, ingest, tmp_path):
+    for n in range(3):
+        write(tmp_path, f"doc-{n}.txt", f"bulk document {n}".encode())
+    write(tmp_path, "copy.txt", b"bulk document 0")
+    skipped = [write(tmp_path, "temp_1_upload.txt", b"api upload"),
+               write(tmp_path, ".partial.txt", b"half written"),
+               write(tmp_path, "recent.txt", b"still being written", age=0)]
+
+    stats = ingest.run()
+    # The copy is either found in the database or loses the insert race within its batch
+    assert stats == {'total': 4, 'stored': 3, 'duplicates': 1, 'quarantined': 0, 'failed': 0}
+    assert sum(ingest.batches) in (3, 4) and max(ingest.batches) <= 2
+    stored = {name for name, _ in ingest.moves}
+    assert len(stored) == 3 and stored <= {"doc-0.txt", "doc-1.txt", "doc-2.txt", "copy.txt"}
+    for name, destination in ingest.moves:
+        assert destination.startswith("/shared-files/processed/") and destination.endswith(name)
+    assert all(path.exists() for path in skipped)
+    assert [entry.name for entry in tmp_path.iterdir() if entry.name.startswith("doc-")] == []
+    assert ingest.maintained == [True]
+    digest = hashlib.sha256(b"bulk document 1").hexdigest()
+    assert db.find_existing_file(digest) is not None
+
+def test_failed_files_wait_until_they_change(db, ingest, tmp_path, monkeypatch):
+    prepare_file = db.prepare_file
+    def prepare(file_path, *args, **kwargs):
+        if file_path.endswith("broken.txt"):
+            raise RuntimeError("extractor crashed")
+        return prepare_file(file_path, *args, **kwargs)
+    monkeypatch.setattr(db, "prepare_file", prepare)
+    broken = write(tmp_path, "broken.txt", b"broken")
+    write(tmp_path, "good.txt", b"good")
+
+    assert ingest.run()['failed'] == 1
+    assert broken.exists()
+    # Unchanged, so not retried
+    assert ingest.run()['total'] == 0
+    write(tmp_path, "broken.txt", b"fixed content")
+    monkeypatch.setattr(db, "prepare_file", prepare_file)
+    assert ingest.run() == {'total': 1, 'stored': 1, 'duplicates': 0, 'quarantined': 0, 'failed': 0}
+
+def test_one_ingest_per_directory(ingest, tmp_path):
+    write(tmp_path, "doc.txt", b"waiting")
+    with open(tmp_path / ".bulk-ingest.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert ingest.run()['total'] == 0
+    assert ingest.moves == []
@@ -0,0 +1,55 @@
+import hashlib
+import time
+
+def sha(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+def test_known_hashes_trusts_bloom_only_when_ready(fp):
+    cache = fp.KnownHashCache(bloom_bits=1 << 16)
+    assert cache.might_contain(sha("missing"))
+    cache.ready = True
+    assert not cache.might_contain(sha("missing"))
+    cache.add(sha("stored"))
+    assert cache.might_contain(sha("stored"))
+    assert cache.stats()['bloom_negatives'] == 1
+
+def test_known_hashes_lru(fp):
+    cache = fp.KnownHashCache(max_entries=2, bloom_bits=1 << 16)
+    cache.add(sha("a"), 1)
+    cache.add(sha("b"), 2)
+    assert cache.get(sha("a")) == 1
+    cache.add(sha("c"), 3)
+    # b was least recently used
+    assert cache.get(sha("b")) is None
+    assert cache.get(sha("a")) == 1 and cache.get(sha("c")) == 3
+    cache.discard(sha("a"))
+    assert cache.get(sha("a")) is None
+    cache.ready = True
+    # Discarded hashes keep their Bloom bits
+    assert cache.might_contain(sha("a"))
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (3, 2, 1)
+
+def test_ttl_cache_expiry(fp):
+    cache = fp.TTLCache(max_entries=10, ttl=0.05)
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expired']) == (1, 1, 1)
+
+def test_ttl_cache_eviction(fp):
+    cache = fp.TTLCache(max_entries=2, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+    assert cache.stats()['evicted'] == 1
+    cache.clear()
+    assert cache.get("c") is None
+
+def test_ttl_cache_disabled(fp):
+    cache = fp.TTLCache(max_entries=0)
+    cache.put("key", "value")
+    assert cache.get("key") is None
@@ -0,0 +1,44 @@
+import pytest
+
+def spans_text(text, spans):
+    return [text[start:end] for start, end in spans]
+
+def test_token_chunks_overlap(fp):
+    text = " ".join(f"w{i}" for i in range(10))
+    spans = list(fp.iter_chunk_spans(text, size=4, overlap=1))
+    assert spans_text(text, spans) == ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9"]
+
+def test_token_chunks_keep_short_tail(fp):
+    text = " ".join(f"w{i}" for i in range(6))
+    spans = list(fp.iter_chunk_spans(text, size=4, overlap=1))
+    assert spans_text(text, spans) == ["w0 w1 w2 w3", "w3 w4 w5"]
+
+def test_token_chunks_with_tokenizer(fp):
+    def tokenizer(text, **kwargs):
+        # One token per character pair
+        return {'offset_mapping': [(i, min(i + 2, len(text))) for i in range(0, len(text), 2)]}
+    text = "abcdefgh"
+    spans = list(fp.iter_chunk_spans(text, size=2, overlap=0, tokenizer=tokenizer))
+    assert spans_text(text, spans) == ["abcd", "efgh"]
+
+def test_char_chunks_break_on_whitespace(fp):
+    text = "aaaa bbbb cccc dddd"
+    spans = list(fp.iter_chunk_spans(text, size=10, overlap=0, unit="chars"))
+    assert spans_text(text, spans) == ["aaaa bbbb", " cccc dddd"]
+    assert spans[-1][1] == len(text)
+
+def test_char_chunks_overlap(fp):
+    text = "x" * 25
+    spans = list(fp.iter_chunk_spans(text, size=10, overlap=3, unit="chars"))
+    assert spans == [(0, 10), (7, 17), (14, 24), (21, 25)]
+
+@pytest.mark.parametrize("unit", ["tokens", "chars"])
+def test_empty_text_has_no_chunks(fp, unit):
+    assert list(fp.iter_chunk_spans("", size=10, overlap=2, unit=unit)) == []
+    assert list(fp.iter_chunk_spans("   \n ", size=10, overlap=2, unit="tokens")) == []
+
+def test_invalid_settings(fp):
+    with pytest.raises(ValueError):
+        list(fp.iter_chunk_spans("some text", size=5, overlap=5))
+    with pytest.raises(ValueError):
+        list(fp.iter_chunk_spans("some text", size=5, overlap=1, unit="lines"))
@@ -0,0 +1,64 @@
+import sys
+
+import pytest
+
+from conftest import MODULE_DIR
+
+# The fake clamd of the benchmarks needs only the standard library
+sys.path.insert(0, MODULE_DIR)
+from benchmark import INFECTED_MARKER, FakeClamd
+
+@pytest.fixture
+def fake_clamd():
+    server = FakeClamd(port=0, latency=0, bytes_per_second=0, stream_max=4096).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(fp, fake_clamd):
+    return fp.ClamdClient("127.0.0.1", fake_clamd.port, timeout=5, stream_max=1 << 20, chunk_size=1024)
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+def test_clean_and_infected(client, tmp_path):
+    assert client.scan_file(write(tmp_path, "clean.txt", b"hello")) == (True, "Clean")
+    is_clean, message = client.scan_file(write(tmp_path, "bad.txt", b"x" * 2000 + INFECTED_MARKER))
+    assert not is_clean
+    assert message == "Infected: Benchmark-Test-Signature"
+    stats = client.stats()
+    assert (stats['scans'], stats['infected'], stats['errors']) == (2, 1, 0)
+    # Both scans went over one session
+    assert stats['connections_opened'] == 1
+
+def test_clean_cache(client, tmp_path):
+    path = write(tmp_path, "clean.txt", b"hello")
+    client.scan_file(path, file_hash="h", file_size=5)
+    assert client.scan_file(path, file_hash="h", file_size=5) == (True, "Clean (cached)")
+    assert client.stats()['scans'] == 1
+
+def test_stream_limit_reply_is_an_error(fp, client, tmp_path):
+    with pytest.raises(fp.ClamdError, match="size limit exceeded"):
+        client.scan_file(write(tmp_path, "big.bin", b"x" * 5000))
+    assert client.stats()['errors'] == 1
+
+def test_files_above_stream_max_are_not_sent(fp, fake_clamd, tmp_path):
+    client = fp.ClamdClient("127.0.0.1", fake_clamd.port, timeout=5, stream_max=100)
+    with pytest.raises(fp.ClamdError, match="StreamMaxLength"):
+        client.scan_file(write(tmp_path, "big.bin", b"x" * 101))
+    assert client.stats()['connections_opened'] == 0
+
+def test_unreachable_clamd_is_an_error(fp, tmp_path):
+    client = fp.ClamdClient("127.0.0.1", 1, timeout=1)
+    with pytest.raises(fp.ClamdError):
+        client.scan_file(write(tmp_path, "a.txt", b"a"))
+
+def test_scan_errors_are_not_reported_infected(fp, tmp_path, monkeypatch):
+    monkeypatch.setattr(fp.processor, 'clamav', fp.ClamdClient("127.0.0.1", 1, timeout=1))
+    path = write(tmp_path, "a.txt", b"a")
+    file_info = {'file_size': 1, 'file_type': 'text/plain', 'file_hash': 'h'}
+    with pytest.raises(fp.ClamdError):
+        fp.processor.scan_file_with_clamav(path, file_info)
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+def test_pool_counts_and_reuse(fp, database_config):
+    pool = fp.DatabasePool(database_config, minconn=1, maxconn=2, timeout=0.2)
+    try:
+        with pool.connection() as first:
+            stats = pool.stats()
+            assert (stats['in_use'], stats['idle']) == (1, 0)
+            with pool.connection() as second:
+                assert second is not first
+                assert pool.stats()['in_use'] == 2
+                # Both slots are taken
+                with pytest.raises(TimeoutError):
+                    with pool.connection():
+                        pass
+        stats = pool.stats()
+        # psycopg2 keeps minconn idle connections and closes the rest
+        assert (stats['in_use'], stats['idle'], stats['timeouts']) == (0, 1, 1)
+        with pool.connection() as again:
+            assert again is second and first.closed
+    finally:
+        pool.close()
+
+def test_pool_commits_and_rolls_back(fp, database_config):
+    pool = fp.DatabasePool(database_config, minconn=1, maxconn=1)
+    try:
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS pool_check (n INTEGER)")
+            cur.execute("TRUNCATE pool_check")
+        with pytest.raises(ZeroDivisionError):
+            with pool.connection() as conn:
+                conn.cursor().execute("INSERT INTO pool_check VALUES (1)")
+                1 / 0
+        with pool.connection() as conn:
+            conn.cursor().execute("INSERT INTO pool_check VALUES (2)")
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT array_agg(n) FROM pool_check")
+            assert cur.fetchone()[0] == [2]
+            cur.execute("DROP TABLE pool_check")
+    finally:
+        pool.close()
+
+def test_pool_replaces_dropped_connections(fp, database_config):
+    pool = fp.DatabasePool(database_config, minconn=1, maxconn=1, validate_after=0)
+    try:
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_backend_pid()")
+            pid = cur.fetchone()[0]
+        killer = fp.DatabasePool(database_config, minconn=1, maxconn=1)
+        with killer.connection() as other:
+            other.cursor().execute("SELECT pg_terminate_backend(%s)", (pid,))
+        killer.close()
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_backend_pid()")
+            assert cur.fetchone()[0] != pid
+        stats = pool.stats()
+        assert (stats['discarded'], stats['in_use'], stats['idle']) == (1, 0, 1)
+    finally:
+        pool.close()
+
+def test_pool_waits_for_a_free_slot(fp, database_config):
+    pool = fp.DatabasePool(database_config, minconn=1, maxconn=1, timeout=5)
+    try:
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with pool.connection():
+                held.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait(5)
+        threading.Timer(0.1, release.set).start()
+        with pool.connection():
+            pass
+        holder.join()
+        stats = pool.stats()
+        assert stats['waits'] == 1 and stats['wait_time_max'] > 0
+        assert stats['checkouts'] == 2
+    finally:
+        pool.close()
@@ -0,0 +1,64 @@
+import hashlib
+
+def store(db, content, filename="stored.txt"):
+    text = content.decode()
+    embedding, chunks = db.embed_document(text)
+    file_info = {'file_hash': hashlib.sha256(content).hexdigest(), 'filename': filename,
+                 'file_type': 'text/plain', 'file_size': len(content)}
+    return db.store_in_database(file_info, text, embedding, chunks)
+
+def count_connections(db, monkeypatch):
+    calls = []
+    db_connection = db.db_connection
+    def counted():
+        calls.append(1)
+        return db_connection()
+    monkeypatch.setattr(db, "db_connection", counted)
+    return calls
+
+def test_duplicate_skips_every_later_stage(db, monkeypatch, tmp_path):
+    content = b"minutes of the board meeting"
+    file_id = store(db, content)
+    def never(*args, **kwargs):
+        raise AssertionError("stage ran for a duplicate")
+    for stage in ("scan_file_with_clamav", "submit_upload", "extract_text", "embed_document"):
+        monkeypatch.setattr(db, stage, never)
+    path = tmp_path / "copy.txt"
+    path.write_bytes(content)
+    stages = []
+    result = db.process_file(str(path), "copy.txt", progress=stages.append)
+    assert result['success'] and result['duplicate']
+    assert (result['file_id'], result['scan_status']) == (file_id, 'skipped')
+    assert stages == ['hash'] and not path.exists()
+
+def test_bloom_filter_answers_unknown_hashes_without_the_database(fp, db, monkeypatch):
+    content = b"stored before this process started"
+    file_id = store(db, content)
+    db.known_hashes = fp.KnownHashCache(bloom_bits=1 << 16)
+    db.load_known_hashes()
+    assert db.known_hashes.ready
+
+    calls = count_connections(db, monkeypatch)
+    assert db.find_existing_file(hashlib.sha256(b"never stored").hexdigest()) is None
+    assert calls == []
+    # In the filter but not the LRU: one lookup, then remembered
+    file_hash = hashlib.sha256(content).hexdigest()
+    assert db.find_existing_file(file_hash) == file_id
+    assert db.find_existing_file(file_hash) == file_id
+    assert len(calls) == 1
+
+def test_unready_filter_falls_back_to_the_database(fp, db, monkeypatch):
+    db.known_hashes = fp.KnownHashCache(bloom_bits=1 << 16)
+    # Stored by another process that this one has not heard from
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO processed_files (filename, original_filename, file_hash, file_type, file_size)
+            VALUES ('other.txt', 'other.txt', %s, 'text/plain', 5) RETURNING id
+        """, (hashlib.sha256(b"other").hexdigest(),))
+        file_id = cur.fetchone()[0]
+        cur.close()
+    calls = count_connections(db, monkeypatch)
+    assert db.find_existing_file(hashlib.sha256(b"other").hexdigest()) == file_id
+    assert db.find_existing_file(hashlib.sha256(b"unknown").hexdigest()) is None
+    assert len(calls) == 2
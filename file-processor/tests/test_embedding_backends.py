@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+class FakeModel:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, batch_size):
+        assert batch_size > 0
+        self.batch_sizes.append(batch_size)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+def test_backend_interface_is_abstract(fp):
+    with pytest.raises(TypeError):
+        fp.EmbeddingBackend()
+
+def test_sentence_transformer_empty_batch(fp):
+    backend = fp.SentenceTransformerBackend()
+    backend._model = FakeModel()
+    backend.state = "ready"
+    assert backend.encode([]).shape == (0, 4)
+    assert backend.encode(["a", "b"]).shape == (2, 4)
+    assert backend._model.batch_sizes == [2]
@@ -0,0 +1,71 @@
+import threading
+
+import numpy as np
+import pytest
+
+class GatedBackend:
+    """Encodes a text as [len(text)], holding the first call until released"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        if len(self.batches) == 1:
+            self.entered.set()
+            assert self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+@pytest.fixture
+def make_batcher(fp):
+    batchers = []
+    def make(backend, **kwargs):
+        batcher = fp.EmbeddingBatcher(backend, **kwargs)
+        batchers.append(batcher)
+        return batcher
+    yield make
+    for batcher in batchers:
+        batcher.close()
+
+def test_coalesces_queued_requests(make_batcher):
+    backend = GatedBackend()
+    batcher = make_batcher(backend, max_batch_size=4, max_wait=0.05)
+    first = batcher.submit("a")
+    assert backend.entered.wait(5)
+    # Queued while the model is busy, then encoded in full batches
+    texts = ["b" * n for n in range(1, 11)]
+    futures = [batcher.submit(text) for text in texts]
+    backend.release.set()
+    assert first.result(5) == [1.0]
+    assert [future.result(5) for future in futures] == [[float(n)] for n in range(1, 11)]
+    assert [len(batch) for batch in backend.batches] == [1, 4, 4, 2]
+    stats = batcher.stats()
+    assert (stats['requests'], stats['batches'], stats['max_batch_size_seen']) == (11, 4, 4)
+    assert stats['avg_batch_size'] == 11 / 4
+
+def test_lone_request_waits_at_most_max_wait(make_batcher):
+    backend = GatedBackend()
+    backend.release.set()
+    batcher = make_batcher(backend, max_batch_size=32, max_wait=0.01)
+    assert batcher.encode("abc", timeout=1) == [3.0]
+    assert backend.batches == [["abc"]]
+
+def test_failed_batch_fails_every_request(make_batcher):
+    backend = GatedBackend(fail=True)
+    batcher = make_batcher(backend, max_batch_size=8, max_wait=0.05)
+    first = batcher.submit("a")
+    assert backend.entered.wait(5)
+    others = [batcher.submit("b"), batcher.submit("c")]
+    backend.release.set()
+    for future in [first] + others:
+        with pytest.raises(RuntimeError, match="model crashed"):
+            future.result(5)
+    assert batcher.stats()['errors'] == 2
+    # The batcher keeps serving after a failure
+    backend.fail = False
+    assert batcher.encode("abcd", timeout=5) == [4.0]
@@ -0,0 +1,83 @@
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+def start_server(fp, socket_path, backend):
+    # run_embedding_server warms the backend up in the background; here it is ready at once
+    backend.warm_up()
+    server = fp.EmbeddingServer(socket_path, backend, max_batch_size=8, max_wait=0.01)
+    connections = []
+    process_request = server.process_request
+    def track(request, client_address):
+        connections.append(request)
+        process_request(request, client_address)
+    server.process_request = track
+    server.connections = connections
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+    # Like the server process exiting: its clients' connections close too
+    for connection in server.connections:
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    server.batcher.close()
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "embeddings.sock")
+
+@pytest.fixture
+def server(fp, socket_path):
+    server = start_server(fp, socket_path, fp.StubEmbeddingBackend(dimensions=8))
+    yield server
+    stop_server(server)
+
+def test_workers_share_the_server_model(fp, server, socket_path):
+    local = fp.StubEmbeddingBackend(dimensions=8)
+    texts = [f"text number {n}" for n in range(12)]
+    results = {}
+    def worker(n):
+        # Each worker process has its own client; threads stand in for them here
+        client = fp.RemoteEmbeddingBackend(socket_path, timeout=5, wait=5)
+        results[n] = client.encode(texts[n * 3:n * 3 + 3])
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for n in range(4):
+        np.testing.assert_allclose(results[n], local.encode(texts[n * 3:n * 3 + 3]), rtol=1e-6)
+    assert server.batcher.stats()['requests'] == 12
+
+def test_client_reports_the_server_backend(fp, server, socket_path):
+    client = fp.RemoteEmbeddingBackend(socket_path, timeout=5, wait=5)
+    assert client.model_id == "stub-8"
+    client.ensure_loaded()
+    assert (client.remote_backend, client.tokenizer) == ("stub", None)
+    assert client.encode([]).shape == (0, 0)
+    with pytest.raises(RuntimeError, match="Unknown operation"):
+        client._call({'op': 'shutdown'})
+
+def test_client_reconnects_to_a_restarted_server(fp, server, socket_path):
+    client = fp.RemoteEmbeddingBackend(socket_path, timeout=5, wait=5)
+    first = client.encode(["hello"])
+    stop_server(server)
+    restarted = start_server(fp, socket_path, fp.StubEmbeddingBackend(dimensions=8))
+    try:
+        np.testing.assert_allclose(client.encode(["hello"]), first)
+    finally:
+        stop_server(restarted)
+
+def test_client_waits_for_an_unreachable_server(fp, socket_path):
+    client = fp.RemoteEmbeddingBackend(socket_path, timeout=1, wait=0)
+    assert client.model_id is None
+    with pytest.raises(RuntimeError, match="not ready"):
+        client.encode(["hello"])
+    assert client.state == "failed"
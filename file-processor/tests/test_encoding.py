@@ -0,0 +1,84 @@
+import struct
+
+class CopyCursor:
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, stream):
+        self.copies.append((sql, stream.read()))
+
+def parse_copy(data):
+    """Rows of field values from a binary COPY payload"""
+    assert data.startswith(b"PGCOPY\n\xff\r\n\x00")
+    pos = 19
+    rows = []
+    while True:
+        (fields,) = struct.unpack_from("!h", data, pos)
+        pos += 2
+        if fields == -1:
+            assert pos == len(data)
+            return rows
+        row = []
+        for _ in range(fields):
+            (size,) = struct.unpack_from("!i", data, pos)
+            pos += 4
+            if size == -1:
+                row.append(None)
+            else:
+                row.append(data[pos:pos + size])
+                pos += size
+        rows.append(row)
+
+def test_format_vector(fp):
+    assert fp.format_vector([1.0, -0.5, 0.123456789]) == "[1,-0.5,0.1234568]"
+
+def test_pg_vector(fp):
+    encoded = fp.pg_vector([1.0, 2.5, -3.0])
+    assert struct.unpack("!hh3f", encoded) == (3, 0, 1.0, 2.5, -3.0)
+    assert fp.pg_vector(None) is None
+
+def test_scalar_encoders(fp):
+    assert fp.pg_int4(-2) == struct.pack("!i", -2)
+    assert fp.pg_int8(2 ** 40) == struct.pack("!q", 2 ** 40)
+    assert fp.pg_text("héllo") == "héllo".encode()
+    assert fp.pg_int4(None) is None and fp.pg_text(None) is None
+
+def test_copy_binary_rows_and_nulls(fp):
+    cur = CopyCursor()
+    rows = [(fp.pg_int4(1), fp.pg_text("a")), (fp.pg_int4(2), None)]
+    fp.copy_binary(cur, "t", ["id", "name"], iter(rows))
+    assert len(cur.copies) == 1
+    sql, data = cur.copies[0]
+    assert sql == "COPY t (id, name) FROM STDIN WITH (FORMAT BINARY)"
+    assert parse_copy(data) == [list(row) for row in rows]
+
+def test_copy_binary_pages(fp):
+    cur = CopyCursor()
+    rows = [(fp.pg_int4(i),) for i in range(5)]
+    fp.copy_binary(cur, "t", ["id"], rows, page_size=2)
+    assert [len(parse_copy(data)) for _, data in cur.copies] == [2, 2, 1]
+
+def test_copy_binary_without_rows(fp):
+    cur = CopyCursor()
+    fp.copy_binary(cur, "t", ["id"], [])
+    assert cur.copies == []
+
+def test_notify_stored_splits_payloads(fp):
+    class Cursor:
+        def __init__(self):
+            self.calls = []
+
+        def execute(self, sql, params):
+            self.calls.append(params)
+
+    cur = Cursor()
+    hashes = [f"{i:064x}" for i in range(fp.NOTIFY_HASHES_PER_PAYLOAD + 1)]
+    fp.notify_stored(cur, hashes)
+    payloads = [params[1].split(",") for params in cur.calls]
+    assert [len(payload) for payload in payloads] == [fp.NOTIFY_HASHES_PER_PAYLOAD, 1]
+    assert sum(payloads, []) == hashes
+    assert all(len(params[1]) < 8000 for params in cur.calls)
+
+    cur = Cursor()
+    fp.notify_stored(cur)
+    assert cur.calls == [(fp.SEARCH_INVALIDATION_CHANNEL,)]
@@ -0,0 +1,27 @@
+import os
+import socket
+
+def test_worker_releases_inherited_descriptors(fp, tmp_path):
+    path = tmp_path / "note.txt"
+    path.write_text("hello extraction")
+    extractor = fp.TextExtractor(workers=1, memory_limit=0)
+    listener = socket.socket()
+    try:
+        assert extractor.extract(str(path), "text/plain") == "hello extraction"
+        worker = extractor._idle[0]
+        inherited = os.readlink(f"/proc/self/fd/{listener.fileno()}")
+        fd_dir = f"/proc/{worker['process'].pid}/fd"
+        targets = {os.readlink(os.path.join(fd_dir, name)) for name in os.listdir(fd_dir)}
+        assert inherited not in targets
+    finally:
+        listener.close()
+        extractor.close()
+
+def test_missing_ocr_stores_placeholder(fp, tmp_path, monkeypatch):
+    monkeypatch.setattr(fp.shutil, "which", lambda command: None)
+    extractor = fp.TextExtractor(workers=1)
+    path = tmp_path / "scan.png"
+    path.write_bytes(b"not really an image")
+    assert extractor.extract(str(path), "image/png") == "[Binary file: scan.png]"
+    assert "image/*" not in extractor.stats()['extractors']
+    assert extractor.stats()['workers_started'] == 0
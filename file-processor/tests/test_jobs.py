@@ -0,0 +1,113 @@
+import os
+import time
+
+import pytest
+
+@pytest.fixture
+def queue(fp, db):
+    return fp.JobQueue(db, workers=1, stale_after=60)
+
+def ingested(content):
+    return {'file_hash': content * 8, 'file_type': 'text/plain', 'file_size': 8}
+
+def fake_process_file(calls, success=True):
+    def process_file(file_path, original_filename, progress=None, ingested=None, **kwargs):
+        calls.append((file_path, original_filename, ingested))
+        for stage in ("scan", "extract", "store"):
+            progress(stage)
+        return {'success': success, 'file_id': 7 if success else None,
+                'message': "done" if success else "Processing failed: boom"}
+    return process_file
+
+def set_status(db, job_id, status, age):
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE processing_jobs
+            SET status = %s, updated_at = CURRENT_TIMESTAMP - make_interval(secs => %s)
+            WHERE id = %s
+        """, (status, age, job_id))
+        cur.close()
+
+def test_job_lifecycle(db, queue, monkeypatch):
+    calls = []
+    monkeypatch.setattr(db, "process_file", fake_process_file(calls))
+    job_id, created = queue.create_job("/tmp/a.txt", "a.txt", ingested=ingested("a"))
+    assert created
+    # Identical content already in flight shares the job
+    assert queue.create_job("/tmp/b.txt", "b.txt", ingested=ingested("a")) == (job_id, False)
+    assert queue.get_job(job_id)['status'] == 'queued'
+
+    assert queue.run(job_id)['file_id'] == 7
+    assert calls == [("/tmp/a.txt", "a.txt", ingested("a"))]
+    job = queue.get_job(job_id)
+    assert (job['status'], job['stage'], job['attempts']) == ('completed', 'store', 1)
+    assert {stage: progress['status'] for stage, progress in job['progress'].items()} == {
+        'scan': 'done', 'extract': 'done', 'store': 'done'
+    }
+    assert job['result']['file_id'] == 7 and job['finished_at']
+    # A finished job is never claimed again, and new uploads of its content get a new job
+    assert queue.run(job_id) is None
+    assert len(calls) == 1
+    assert queue.create_job("/tmp/c.txt", "c.txt", ingested=ingested("a"))[1]
+
+def test_failed_job_records_the_error(db, queue, monkeypatch):
+    monkeypatch.setattr(db, "process_file", fake_process_file([], success=False))
+    job_id, _ = queue.create_job("/tmp/a.txt", "a.txt", ingested=ingested("a"))
+    queue.run(job_id)
+    job = queue.get_job(job_id)
+    assert (job['status'], job['error']) == ('failed', "Processing failed: boom")
+    assert job['progress']['store']['status'] == 'failed'
+
+def test_recover_requeues_pending_and_stale_jobs(db, queue, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(queue, "submit", submitted.append)
+    queued, _ = queue.create_job("/tmp/a.txt", "a.txt", ingested=ingested("a"))
+    stale, _ = queue.create_job("/tmp/b.txt", "b.txt", ingested=ingested("b"))
+    running, _ = queue.create_job("/tmp/c.txt", "c.txt", ingested=ingested("c"))
+    done, _ = queue.create_job("/tmp/d.txt", "d.txt", ingested=ingested("d"))
+    set_status(db, stale, 'running', 120)
+    set_status(db, running, 'running', 10)
+    set_status(db, done, 'completed', 120)
+
+    queue.recover()
+    assert sorted(submitted) == sorted([queued, stale])
+    assert queue.get_job(stale)['status'] == 'queued'
+    assert queue.get_job(running)['status'] == 'running'
+    assert queue.get_job(done)['status'] == 'completed'
+
+def test_failed_job_deletes_its_upload(db, queue, monkeypatch, tmp_path):
+    upload = tmp_path / "temp_1_a.txt"
+    upload.write_text("a")
+    monkeypatch.setattr(db, "process_file", fake_process_file([], success=False))
+    job_id, _ = queue.create_job(str(upload), "a.txt", ingested=ingested("a"))
+    queue.run(job_id)
+    assert not upload.exists()
+
+    upload.write_text("b")
+    def crash(*args, **kwargs):
+        raise RuntimeError("worker crashed")
+    monkeypatch.setattr(db, "process_file", crash)
+    job_id, _ = queue.create_job(str(upload), "a.txt", ingested=ingested("b"))
+    assert queue.run(job_id) is None
+    assert queue.get_job(job_id)['error'] == "worker crashed"
+    assert not upload.exists()
+
+def test_recover_removes_orphaned_uploads(db, queue, monkeypatch, tmp_path):
+    monkeypatch.setattr(db.upload_admission, "directory", str(tmp_path))
+    monkeypatch.setattr(queue, "submit", lambda job_id: None)
+    def upload(name, age):
+        path = tmp_path / name
+        path.write_text(name)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+    orphan = upload("temp_1_orphan.txt", 120)
+    pending = upload("temp_2_pending.txt", 120)
+    recent = upload("temp_3_recent.txt", 10)
+    bulk = upload("report.txt", 120)
+    queue.create_job(str(pending), "pending.txt", ingested=ingested("p"))
+
+    queue.recover()
+    assert not orphan.exists()
+    assert pending.exists() and recent.exists() and bulk.exists()
@@ -0,0 +1,49 @@
+def test_render_counters_and_histograms(fp):
+    metrics = fp.Metrics(namespace="test", buckets=(0.1, 1.0))
+    metrics.describe('stage_duration_seconds', "Seconds per stage")
+    metrics.inc('files_total', outcome='processed')
+    metrics.inc('files_total', 2, outcome='processed')
+    for value in (0.05, 0.5, 5.0):
+        metrics.observe('stage_duration_seconds', value, stage='scan')
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE test_files_total counter" in lines
+    assert 'test_files_total{outcome="processed"} 3' in lines
+    assert "# HELP test_stage_duration_seconds Seconds per stage" in lines
+    assert "# TYPE test_stage_duration_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith("test_stage_duration_seconds_bucket")]
+    assert buckets == [
+        'test_stage_duration_seconds_bucket{stage="scan",le="0.1"} 1',
+        'test_stage_duration_seconds_bucket{stage="scan",le="1.0"} 2',
+        'test_stage_duration_seconds_bucket{stage="scan",le="+Inf"} 3'
+    ]
+    assert 'test_stage_duration_seconds_sum{stage="scan"} 5.55' in lines
+    assert 'test_stage_duration_seconds_count{stage="scan"} 3' in lines
+
+def test_render_gauges_and_escaping(fp):
+    metrics = fp.Metrics(namespace="test")
+    metrics.add_collector(lambda: fp.Metrics.stats_gauges('pool', {'in_use': 2, 'name': 'x', 'ratio': 0.5}))
+    metrics.add_collector(lambda: [('label', {'path': 'a"b\\c'}, 1)])
+
+    def broken():
+        raise RuntimeError("collector down")
+    metrics.add_collector(broken)
+
+    lines = metrics.render().splitlines()
+    assert "test_pool_in_use 2.0" in lines
+    assert "test_pool_ratio 0.5" in lines
+    assert not any(line.startswith("test_pool_name") for line in lines)
+    assert 'test_label{path="a\\"b\\\\c"} 1' in lines
+
+def test_stage_records_errors(fp):
+    metrics = fp.Metrics(namespace="test")
+    timings = {}
+    try:
+        with metrics.stage('extract', timings):
+            raise ValueError("bad file")
+    except ValueError:
+        pass
+    output = metrics.render()
+    assert 'test_stage_errors_total{exception="ValueError",stage="extract"} 1' in output
+    assert 'test_stage_duration_seconds_count{stage="extract"} 1' in output
+    assert 'extract' in timings
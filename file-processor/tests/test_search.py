@@ -0,0 +1,73 @@
+import hashlib
+
+def store(db, text, filename, chunked=True):
+    embedding, chunks = db.embed_document(text)
+    file_info = {
+        'file_hash': hashlib.sha256(f"{filename}:{text}".encode()).hexdigest(),
+        'filename': filename,
+        'file_type': 'text/plain',
+        'file_size': len(text)
+    }
+    return db.store_in_database(file_info, text, embedding, chunks if chunked else [])
+
+def search(db, text, mode="lexical", limit=10):
+    embedding = None
+    if mode != "lexical":
+        embedding = db.embedding_backend.encode([text])[0].tolist()
+    return db.search_documents(embedding, limit=limit, query_text=text, mode=mode)
+
+def corpus(db):
+    return {
+        'strong': store(db, "invoice invoice invoice with payment terms for the invoice", "terms.txt"),
+        'weak': store(db, "travel notes that mention one invoice in passing among many other words", "travel.txt"),
+        'named': store(db, "quarterly figures without the search word", "invoice-2024.txt"),
+        'legacy': store(db, "scanned invoice from before chunking", "scan.txt", chunked=False),
+        'unrelated': store(db, "garden planting schedule", "garden.txt")
+    }
+
+def test_lexical_ranks_chunks_names_and_legacy_documents(db):
+    ids = corpus(db)
+    results = search(db, "invoice")
+    ranked = [r['id'] for r in results]
+    assert set(ranked) == {ids['strong'], ids['weak'], ids['named'], ids['legacy']}
+    assert ranked.index(ids['strong']) < ranked.index(ids['weak'])
+    by_id = {r['id']: r for r in results}
+    assert by_id[ids['strong']]['matched_chunk'] == 0
+    # Matched on its name only, at file level
+    assert by_id[ids['named']]['matched_chunk'] is None
+    assert all(r['similarity'] is None for r in results)
+
+def test_lexical_ranks_before_limiting(db):
+    for n in range(40):
+        store(db, f"filler document {n} mentions invoice once among plenty of other words", f"filler-{n}.txt")
+    best = store(db, "invoice invoice invoice invoice", "best.txt")
+    assert [r['id'] for r in search(db, "invoice", limit=1)] == [best]
+
+def test_hybrid_fuses_both_rankings(db):
+    ids = corpus(db)
+    results = search(db, "invoice payment terms", mode="hybrid")
+    assert results[0]['id'] == ids['strong']
+    assert results[0]['similarity'] is not None
+    scores = [r['score'] for r in results]
+    assert scores == sorted(scores, reverse=True)
+    assert {ids['weak'], ids['named'], ids['legacy']} <= {r['id'] for r in results}
+
+def test_search_computes_missing_columns_until_migrated(fp, db):
+    corpus(db)
+    expected = {mode: search(db, "invoice", mode=mode) for mode in ("lexical", "hybrid")}
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("ALTER TABLE processed_files DROP COLUMN search_vector, DROP COLUMN filename_vector")
+        cur.execute("ALTER TABLE document_chunks DROP COLUMN search_vector")
+        cur.close()
+    try:
+        # Populated tables: the generated columns are left to the migrate command
+        pending = db.init_database()
+        assert any("search_vector" in change for change in pending)
+        assert db.tsvector_columns == set()
+        db.invalidate_search_results()
+        for mode, results in expected.items():
+            assert search(db, "invoice", mode=mode) == results
+    finally:
+        assert db.init_database(rewrite=True) == []
+    assert db.tsvector_columns == set(fp.BriskLearningProcessor.TSVECTOR_COLUMNS)
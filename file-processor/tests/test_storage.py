@@ -0,0 +1,70 @@
+import hashlib
+
+def record(processor, text, name=None):
+    file_hash = hashlib.sha256(text.encode()).hexdigest()
+    embedding, chunks = processor.embed_document(text)
+    return {
+        'file_info': {
+            'file_hash': file_hash,
+            'filename': name or f"{file_hash[:8]}.txt",
+            'file_type': 'text/plain',
+            'file_size': len(text),
+            'stage_timings': {'extract': 0.01}
+        },
+        'text_content': text,
+        'embedding': embedding,
+        'chunks': chunks
+    }
+
+def fetch(processor, sql, params=()):
+    with processor.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+def test_store_many_batches_new_and_duplicate_files(db):
+    existing = record(db, "already stored")
+    stored = db.store_in_database(
+        existing['file_info'], existing['text_content'], existing['embedding'], existing['chunks']
+    )
+    batch = [
+        record(db, "first document about invoices"),
+        record(db, "already stored"),
+        record(db, "first document about invoices", name="copy.txt"),
+        record(db, "second document " * 400)
+    ]
+    outcomes = db.store_many(batch)
+    assert [outcome['status'] for outcome in outcomes] == ['new', 'duplicate', 'duplicate', 'new']
+    assert outcomes[1]['file_id'] == stored
+    assert outcomes[2]['file_id'] == outcomes[0]['file_id']
+
+    assert fetch(db, "SELECT count(*) FROM processed_files") == [(3,)]
+    assert fetch(db, "SELECT count(*) FROM processing_log") == [(3,)]
+    chunks = fetch(db, """
+        SELECT chunk_index, char_start, char_end, content, vector_dims(embedding)
+        FROM document_chunks WHERE file_id = %s ORDER BY chunk_index
+    """, (outcomes[3]['file_id'],))
+    text = batch[3]['text_content']
+    assert len(chunks) == len(batch[3]['chunks']) > 1
+    for chunk_index, start, end, content, dimensions in chunks:
+        assert content == text[start:end]
+        assert dimensions == len(batch[3]['chunks'][chunk_index]['embedding'])
+    assert all(db.known_hashes.get(r['file_info']['file_hash']) for r in batch)
+
+def test_binary_copy_round_trips_values_across_pages(fp, db):
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE copy_check (n INTEGER, big BIGINT, label TEXT, v vector(3))")
+        fp.copy_binary(cur, "copy_check", ['n', 'big', 'label', 'v'], (
+            (fp.pg_int4(n), fp.pg_int8(n << 40), fp.pg_text(None if n == 2 else f"row {n} é"),
+             fp.pg_vector([n, 0.5, -1.0]))
+            for n in range(5)
+        ), page_size=2)
+        cur.execute("SELECT n, big, label, v::text FROM copy_check ORDER BY n")
+        rows = cur.fetchall()
+        cur.close()
+    assert len(rows) == 5
+    assert rows[2] == (2, 2 << 40, None, "[2,0.5,-1]")
+    assert rows[4][2] == "row 4 é"
@@ -0,0 +1,90 @@
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+CONTENT_TYPE = "multipart/form-data; boundary=b"
+
+def body(content, filename="notes.txt", fields=(("category", "contract"),), trailer=(("created_by", "api"),)):
+    parts = [f'--b\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields]
+    parts.append(f'--b\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: text/plain\r\n\r\n'.encode() + content + b"\r\n")
+    parts.extend(f'--b\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+                 for name, value in trailer)
+    return b"".join(parts) + b"--b--\r\n"
+
+def feed(upload, data, size):
+    for start in range(0, len(data), size):
+        upload.write(data[start:start + size])
+
+def test_streams_file_part_to_disk(fp, tmp_path):
+    content = b"line of text\n" * 5000
+    upload = fp.MultipartUpload(CONTENT_TYPE, tmp_path, max_size=1 << 20)
+    # Boundaries and headers split across writes
+    feed(upload, body(content, filename="../dir/notes.txt"), 7)
+    upload.finish()
+    assert upload.filename == "notes.txt"
+    assert upload.path.parent == tmp_path and upload.path.name.startswith("temp_")
+    assert upload.path.read_bytes() == content
+    assert upload.fields == {'category': "contract", 'created_by': "api"}
+    assert upload.ingested == {
+        'file_hash': hashlib.sha256(content).hexdigest(),
+        'file_type': "text/plain",
+        'file_size': len(content)
+    }
+
+def test_oversize_file_stops_the_upload(fp, tmp_path):
+    upload = fp.MultipartUpload(CONTENT_TYPE, tmp_path, max_size=1000)
+    with pytest.raises(fp.FileTooLargeError):
+        feed(upload, body(b"x" * 5000), 512)
+    upload.discard()
+    assert list(tmp_path.iterdir()) == []
+
+@pytest.mark.parametrize("content_type, data, status", [
+    ("application/json", None, 422),
+    (CONTENT_TYPE, body(b"abc")[:-12], 400),
+    (CONTENT_TYPE, b'--b\r\nContent-Disposition: form-data; name="category"\r\n\r\nx\r\n--b--\r\n', 422)
+])
+def test_rejects_bad_bodies(fp, tmp_path, content_type, data, status):
+    with pytest.raises(HTTPException) as excinfo:
+        upload = fp.MultipartUpload(content_type, tmp_path, max_size=1000)
+        upload.write(data)
+        upload.finish()
+    assert excinfo.value.status_code == status
+
+@pytest.fixture
+def api(fp, db, tmp_path, monkeypatch):
+    # The admission middleware holds the module processor's admission; the endpoint uses db's
+    monkeypatch.setattr(fp.processor.upload_admission, "directory", str(tmp_path))
+    monkeypatch.setattr(db.upload_admission, "directory", str(tmp_path))
+    monkeypatch.setattr(fp, "processor", db)
+    queue = fp.JobQueue(db, workers=1)
+    queue.submitted = []
+    monkeypatch.setattr(queue, "submit", queue.submitted.append)
+    monkeypatch.setattr(fp, "job_queue", queue)
+    # Without the context manager the startup handlers do not run
+    return TestClient(fp.app)
+
+def test_upload_endpoint_queues_the_streamed_file(api, fp, tmp_path):
+    content = b"quarterly report\n" * 100
+    response = api.post("/upload", content=body(content), headers={'Content-Type': CONTENT_TYPE})
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+    assert fp.job_queue.submitted == [job_id]
+    job = fp.job_queue.get_job(job_id)
+    assert (job['original_filename'], job['category']) == ("notes.txt", "contract")
+    [path] = tmp_path.iterdir()
+    assert path.read_bytes() == content
+
+    response = api.post("/upload", files={'file': ("copy.txt", content)})
+    assert response.json()['job_id'] == job_id and response.json()['deduplicated']
+    assert len(list(tmp_path.iterdir())) == 1
+
+def test_upload_endpoint_rejects_oversize_file(api, fp, db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "max_file_size", 1000)
+    response = api.post("/upload", files={'file': ("big.bin", b"x" * 5000)})
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+    assert fp.job_queue.submitted == []
@@ -0,0 +1,107 @@
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+def make_admission(fp, tmp_path, **kwargs):
+    settings = dict(max_request_size=1000, max_inflight=2, max_inflight_bytes=1500, min_free_bytes=0)
+    settings.update(kwargs)
+    return fp.UploadAdmission(str(tmp_path), **settings)
+
+def test_caps_inflight_uploads_and_bytes(fp, tmp_path):
+    admission = make_admission(fp, tmp_path)
+    first = admission.admit(800)
+    with pytest.raises(HTTPException) as excinfo:
+        admission.admit(800)
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers == {'Retry-After': '10'}
+
+    second = admission.admit(None)
+    with pytest.raises(HTTPException) as excinfo:
+        admission.admit(1)
+    assert excinfo.value.status_code == 429
+
+    admission.release(first)
+    admission.release(second)
+    stats = admission.stats()
+    assert (stats['inflight'], stats['inflight_bytes']) == (0, 0)
+    assert (stats['admitted'], stats['rejected_busy']) == (2, 2)
+
+def test_lone_upload_may_exceed_byte_budget(fp, tmp_path):
+    admission = make_admission(fp, tmp_path, max_request_size=5000)
+    ticket = admission.admit(2000)
+    admission.consume(ticket, 2500)
+    assert admission.stats()['inflight_bytes'] == 2500
+    admission.release(ticket)
+
+def test_streamed_bytes_are_reserved(fp, tmp_path):
+    admission = make_admission(fp, tmp_path)
+    first = admission.admit(None)
+    second = admission.admit(None)
+    admission.consume(first, 900)
+    with pytest.raises(HTTPException) as excinfo:
+        admission.consume(second, 700)
+    assert excinfo.value.status_code == 429
+    with pytest.raises(HTTPException) as excinfo:
+        admission.consume(first, 200)
+    assert excinfo.value.status_code == 413
+    assert excinfo.value.headers is None
+
+def test_oversize_declared_length(fp, tmp_path):
+    admission = make_admission(fp, tmp_path)
+    with pytest.raises(HTTPException) as excinfo:
+        admission.admit(1001)
+    assert excinfo.value.status_code == 413
+    assert admission.stats()['inflight'] == 0
+
+def test_disk_watermark(fp, tmp_path):
+    admission = make_admission(fp, tmp_path, min_free_bytes=1 << 60)
+    with pytest.raises(HTTPException) as excinfo:
+        admission.admit(10)
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers == {'Retry-After': '10'}
+
+@pytest.fixture
+def client(fp, tmp_path):
+    admission = make_admission(fp, tmp_path)
+    app = FastAPI()
+    app.add_middleware(fp.UploadAdmissionMiddleware, admission=admission, paths=("/upload",))
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {'size': len(await file.read())}
+
+    with TestClient(app) as client:
+        client.admission = admission
+        yield client
+
+def test_middleware_admits_upload(client):
+    response = client.post("/upload", files={'file': ("a.txt", b"x" * 100)})
+    assert response.status_code == 200
+    assert response.json() == {'size': 100}
+    assert client.admission.stats()['inflight'] == 0
+
+def test_middleware_rejects_declared_length(client):
+    response = client.post("/upload", files={'file': ("a.txt", b"x" * 2000)})
+    assert response.status_code == 413
+    assert client.admission.stats()['rejected_too_large'] == 1
+
+def test_middleware_rejects_oversize_stream(client):
+    def body():
+        # Streamed without a Content-Length, so only the byte count can stop it
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.txt"\r\n\r\n'
+        for _ in range(20):
+            yield b"x" * 100
+        yield b"\r\n--b--\r\n"
+    response = client.post("/upload", content=body(), headers={'Content-Type': 'multipart/form-data; boundary=b'})
+    assert response.status_code == 413
+    stats = client.admission.stats()
+    assert stats['rejected_too_large'] == 1
+    assert (stats['inflight'], stats['inflight_bytes']) == (0, 0)
+
+def test_middleware_answers_429_with_retry_after(client):
+    held = [client.admission.admit(None), client.admission.admit(None)]
+    response = client.post("/upload", files={'file': ("a.txt", b"x")})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
+    for ticket in held:
+        client.admission.release(ticket)
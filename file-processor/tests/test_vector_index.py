@@ -0,0 +1,79 @@
+import pytest
+
+class VersionCursor:
+    def __init__(self, version):
+        self.version = version
+        self.queries = 0
+
+    def execute(self, sql, params=None):
+        self.queries += 1
+
+    def fetchone(self):
+        return (self.version,) if self.version else None
+
+def test_compact_storage_falls_back_on_old_pgvector(fp):
+    manager = fp.VectorIndexManager(None, storage="halfvec")
+    cur = VersionCursor("0.6.2")
+    manager.check_storage(cur)
+    assert manager.storage == "vector" and manager.rerank_multiplier == 1
+    assert manager.coarse_distance("c.embedding", "%(query)s") is None
+    assert not manager.supports_iterative_scan(cur)
+    # The version is read once
+    assert cur.queries == 1
+
+def test_compact_storage_kept_on_supported_pgvector(fp):
+    manager = fp.VectorIndexManager(None, storage="bit")
+    cur = VersionCursor("0.8.0")
+    manager.check_storage(cur)
+    assert manager.storage == "bit" and manager.rerank_multiplier == 10
+    assert manager.supports_iterative_scan(cur)
+
+def test_storage_check_waits_for_extension(fp):
+    manager = fp.VectorIndexManager(None, storage="halfvec")
+    manager.check_storage(VersionCursor(None))
+    assert manager.storage == "halfvec"
+    manager.check_storage(VersionCursor("0.7.4"))
+    assert manager.storage == "halfvec"
+
+class StopMaintaining(Exception):
+    pass
+
+def store_documents(db, start, count):
+    for n in range(start, start + count):
+        text = f"document number {n}"
+        embedding, chunks = db.embed_document(text)
+        file_info = {'file_hash': f"{n:064d}", 'filename': f"doc-{n}.txt", 'file_type': 'text/plain',
+                     'file_size': len(text)}
+        db.store_in_database(file_info, text, embedding, chunks)
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("ANALYZE processed_files")
+        cur.execute("ANALYZE document_chunks")
+        cur.close()
+
+def test_periodic_maintenance_rebuilds_grown_index(fp, db, monkeypatch):
+    manager = fp.VectorIndexManager(db, ivfflat_min_rows=4, maintain_interval=30)
+    actions = []
+    maintain = manager.maintain
+    monkeypatch.setattr(manager, "maintain", lambda: actions.append(maintain()['processed_files']))
+    # Each sleep is a stretch of uploads that grows the table
+    uploads = iter([(5, 3), (8, 10)])
+    def sleep(seconds):
+        assert seconds == 30
+        try:
+            store_documents(db, *next(uploads))
+        except StopIteration:
+            raise StopMaintaining()
+    monkeypatch.setattr(fp.time, "sleep", sleep)
+
+    store_documents(db, 0, 5)
+    with pytest.raises(StopMaintaining):
+        manager.maintain_periodically()
+    # Built at 5 rows, left alone at 8, rebuilt at 18
+    assert actions == ["built", "unchanged", "built"]
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        assert manager._describe(cur, "processed_files_embedding_idx")['built_rows'] == 18
+        cur.close()
+    # Drop the indexes again so they do not steer other tests' searches
+    fp.VectorIndexManager(db).maintain()
@@ -0,0 +1,77 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+def store(db, text, filename, category="document", source_type="upload", chunked=True):
+    embedding, chunks = db.embed_document(text)
+    file_info = {
+        'file_hash': hashlib.sha256(f"{filename}:{text}".encode()).hexdigest(),
+        'filename': filename,
+        'file_type': 'text/plain',
+        'file_size': len(text),
+        'category': category,
+        'source_type': source_type
+    }
+    return db.store_in_database(file_info, text, embedding, chunks if chunked else [])
+
+def search(db, text, limit=10, offset=0, **filters):
+    embedding = db.embedding_backend.encode([text])[0].tolist()
+    return db.search_documents(embedding, limit=limit, offset=offset, filters=filters)
+
+@pytest.fixture
+def library(db):
+    ids = {}
+    for n in range(4):
+        ids[f"contract-{n}"] = store(db, f"lease contract clause {n} rent deposit", f"contract-{n}.txt",
+                                     category="contract")
+    for n in range(4):
+        ids[f"note-{n}"] = store(db, f"lease notes {n} about rent", f"note-{n}.txt", source_type="bulk_import")
+    return ids
+
+@pytest.mark.parametrize("prefilter_max", [1000, 1])
+def test_filters_restrict_results(db, library, monkeypatch, prefilter_max):
+    # 1000 sorts the few matching rows exactly; 1 leaves the filter to the index scan
+    monkeypatch.setattr(db, "search_prefilter_max_files", prefilter_max)
+    contracts = search(db, "lease rent", category="contract")
+    assert {r['id'] for r in contracts} == {library[f"contract-{n}"] for n in range(4)}
+    assert all(r['category'] == "contract" for r in contracts)
+    imported = search(db, "lease rent", source_type="bulk_import", category="document")
+    assert {r['id'] for r in imported} == {library[f"note-{n}"] for n in range(4)}
+    assert search(db, "lease rent", category="invoice") == []
+
+def test_pages_do_not_overlap(db, library):
+    everything = search(db, "lease contract rent", limit=8)
+    assert len(everything) == 8
+    pages = [search(db, "lease contract rent", limit=3, offset=offset) for offset in (0, 3, 6)]
+    assert [len(page) for page in pages] == [3, 3, 2]
+    assert [r['id'] for page in pages for r in page] == [r['id'] for r in everything]
+    scores = [r['score'] for r in everything]
+    assert scores == sorted(scores, reverse=True)
+
+def test_results_carry_previews_not_full_text(db):
+    long_text = "budget " * 200
+    file_id = store(db, long_text, "budget.txt")
+    legacy_id = store(db, "budget from before chunking", "legacy.txt", chunked=False)
+    results = {r['id']: r for r in search(db, "budget")}
+    assert results[file_id]['text_preview'] == long_text[:200] + "..."
+    assert results[file_id]['matched_chunk'] == 0
+    # Documents without chunks are ranked on their document embedding
+    assert results[legacy_id]['matched_chunk'] is None
+    assert all('text_content' not in r for r in results.values())
+
+@pytest.fixture
+def api(fp, db, monkeypatch):
+    monkeypatch.setattr(fp, "processor", db)
+    return TestClient(fp.app)
+
+def test_search_endpoint_pages_and_validates(api, library):
+    response = api.get("/search", params={'query': "lease rent", 'limit': 3, 'category': "contract"})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body['results']) == 3 and body['next_offset'] == 3
+    response = api.get("/search", params={'query': "lease rent", 'limit': 3, 'offset': 3,
+                                          'category': "contract"})
+    assert len(response.json()['results']) == 1 and response.json()['next_offset'] is None
+    for params in ({'limit': 0}, {'limit': 1000}, {'offset': -1}, {'offset': 10 ** 6}):
+        assert api.get("/search", params=dict(params, query="lease")).status_code == 400